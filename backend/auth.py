@@ -4,14 +4,25 @@ from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from database import get_db_connection, verify_password
+from cache import TTLCache
+from metrics import JWT_DECODE_SECONDS
 import os
+import time
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "charizard")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
+# Validated tokens are remembered so repeat requests skip jwt.decode.
+# Entries never outlive the token's own expiry.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 300))
+
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+_token_cache_secret = SECRET_KEY
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
@@ -24,26 +35,69 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Verify JWT token and return user info"""
-    token = credentials.credentials
+def decode_token(token: str) -> dict:
+    """Decode and validate a JWT, returning the user info it carries"""
+    global _token_cache_secret
+    # Tokens validated under a previous secret must be checked again
+    if _token_cache_secret != SECRET_KEY:
+        token_cache.clear()
+        _token_cache_secret = SECRET_KEY
+    
+    user = token_cache.get(token)
+    if user is not None:
+        return dict(user)
+    
+    start = time.perf_counter()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        is_admin: bool = payload.get("is_admin", False)
-        if username is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return {"username": username, "is_admin": is_admin}
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    finally:
+        JWT_DECODE_SECONDS.observe(time.perf_counter() - start)
+    username: str = payload.get("sub")
+    is_admin: bool = payload.get("is_admin", False)
+    if username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    user = {"username": username, "is_admin": is_admin}
+    expires_in = payload["exp"] - time.time() if "exp" in payload else TOKEN_CACHE_TTL
+    token_cache.set(token, user, ttl=expires_in)
+    return dict(user)
+
+def token_cache_stats() -> dict:
+    """Hit/miss counters of the validated-token cache"""
+    return {"size": len(token_cache), "hits": token_cache.hits, "misses": token_cache.misses}
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Verify JWT token and return user info"""
+    return decode_token(credentials.credentials)
+
+def get_stream_user(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Verify the user of a streaming request
+
+    Browsers' EventSource cannot set headers, so the token may also be passed
+    as a `token` query parameter.
+    """
+    if credentials is not None:
+        return decode_token(credentials.credentials)
+    if token:
+        return decode_token(token)
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
 def get_current_user(current_user: dict = Depends(verify_token)):
     """Get current authenticated user"""
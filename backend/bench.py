@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the Event Manager backend.
+
+Each benchmark runs against a throwaway database, so it is safe to run next
+to a development server:
+
+    python bench.py date-range --sizes 1000 10000 100000 1000000
+    python bench.py login --workers 1 2 4 8
+    python bench.py token
+    python bench.py db
+    python bench.py startup
+    python bench.py fanout --clients 10000
+    python bench.py bulk --sizes 1000 10000 100000
+    python bench.py churn --sizes 10000 100000 1000000
+    python bench.py memory --sizes 100000 1000000
+    python bench.py json --sizes 1000 10000 100000
+    python bench.py etag --sizes 1000 10000 100000
+    python bench.py changes --sizes 1000 10000 100000
+    python bench.py calendar --sizes 1000 10000 100000
+    python bench.py recovery --sizes 100000 1000000
+    python bench.py fsync
+    python bench.py workers --workers 1 2 4 --sizes 10000
+    python bench.py search --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+from typing import List, Optional
+
+# Point the app at a scratch database before anything imports database.py
+os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="event-manager-bench-"), "bench.db")
+
+from models import EventCategory, TimeSlot
+from store import TimeslotStore
+
+EVENTS_PER_DAY = 20
+FIRST_DAY = date(2025, 1, 1)
+
+
+def make_timeslots(count: int, names: Optional[List[str]] = None):
+    """Generate `count` events, EVENTS_PER_DAY per day starting at FIRST_DAY
+
+    Events are named "Event <n>", or after a random one of `names`.
+    """
+    categories = list(EventCategory)
+    rng = random.Random(count)
+    for i in range(count):
+        hour = rng.randint(8, 20)
+        yield TimeSlot(
+            id=str(uuid.uuid4()),
+            name=rng.choice(names) if names else f"Event {i}",
+            category=rng.choice(categories),
+            date=(FIRST_DAY + timedelta(days=i // EVENTS_PER_DAY)).isoformat(),
+            start_time=f"{hour:02d}:00",
+            end_time=f"{hour + 2:02d}:00",
+        )
+
+
+def seeded_store(count: int, names: Optional[List[str]] = None) -> TimeslotStore:
+    """A fresh store (and database) holding `count` generated events"""
+    from database import pool, init_db
+    init_db()
+    with pool.connection() as conn, conn:
+        conn.execute("DELETE FROM bookings")
+        conn.execute("DELETE FROM timeslots")
+    store = TimeslotStore()
+    store.add_many(make_timeslots(count, names))
+    return store
+
+
+def timed(fn, repeat: int) -> float:
+    """Median wall time of `fn` in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def bench_date_range(args):
+    """One-month calendar query as the total number of events grows"""
+    print(f"{'events':>10} {'results':>8} {'index ms':>10} {'scan ms':>10}")
+    for size in args.sizes:
+        store = seeded_store(size)
+        # Query the last month of data so the window is always fully populated
+        last_day = FIRST_DAY + timedelta(days=(size - 1) // EVENTS_PER_DAY)
+        start_date = (last_day - timedelta(days=30)).isoformat()
+        end_date = last_day.isoformat()
+        categories = {EventCategory.CAT1, EventCategory.CAT3}
+
+        def indexed():
+            return store.query(start_date, end_date, categories)
+
+        # The plain list of models the endpoints used to filter
+        everything = store.all()
+
+        def scan():
+            filtered = everything
+            filtered = [ts for ts in filtered if ts.date >= start_date]
+            filtered = [ts for ts in filtered if ts.date <= end_date]
+            return [ts for ts in filtered if ts.category in categories]
+
+        results = len(indexed())
+        assert results == len(scan())
+        print(f"{size:>10} {results:>8} {timed(indexed, args.repeat):>10.3f} {timed(scan, args.repeat):>10.3f}")
+
+
+def bench_login(args):
+    """bcrypt login throughput against the number of verifier processes"""
+    from database import get_password_hash
+    from passwords import PasswordVerifier
+
+    hashed = get_password_hash("password1")
+    worker_counts = args.workers or range(1, (os.cpu_count() or 1) + 1)
+
+    async def run(verifier, logins):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(verifier.verify("password1", hashed) for _ in range(logins)))
+        assert all(results)
+        return logins / (time.perf_counter() - start)
+
+    print(f"cpu count: {os.cpu_count()}")
+    print(f"{'workers':>8} {'logins/s':>10}")
+    for workers in worker_counts:
+        verifier = PasswordVerifier(workers=workers, max_pending=args.logins, cache_size=0)
+        asyncio.run(run(verifier, workers))  # warm up the pool
+        rate = asyncio.run(run(verifier, args.logins))
+        verifier.shutdown()
+        print(f"{workers:>8} {rate:>10.1f}")
+
+    verifier = PasswordVerifier(workers=1, max_pending=args.logins)
+    asyncio.run(run(verifier, 1))
+    rate = asyncio.run(run(verifier, args.logins * 100))
+    verifier.shutdown()
+    print(f"{'cached':>8} {rate:>10.1f}")
+
+
+def bench_token(args):
+    """Cost of validating a bearer token with and without the token cache"""
+    import auth
+
+    token = auth.create_access_token({"sub": "user1", "is_admin": False})
+    count = args.repeat * 1000
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(count):
+            auth.decode_token(token)
+        return (time.perf_counter() - start) / count * 1e6
+
+    auth.token_cache.maxsize = 0
+    uncached = run()
+    auth.token_cache.maxsize = auth.TOKEN_CACHE_SIZE
+    cached = run()
+    print(f"{'uncached':>10} {uncached:>8.2f} us/request")
+    print(f"{'cached':>10} {cached:>8.2f} us/request")
+    print(auth.token_cache_stats())
+
+
+def bench_db(args):
+    """Per-query latency with a fresh connection per call vs. the connection pool"""
+    import sqlite3
+    import database
+    from database import pool, USER_LOGIN_QUERY
+
+    store = seeded_store(args.sizes[0])
+    timeslot_id = store.all()[-1].id
+    lookup_query = "SELECT * FROM timeslots WHERE id = ?"
+    queries = {"login": (USER_LOGIN_QUERY, ("user1",)), "lookup": (lookup_query, (timeslot_id,))}
+    count = args.repeat * 100
+
+    def fresh(sql, params):
+        conn = sqlite3.connect(database.DB_FILE)
+        conn.row_factory = sqlite3.Row
+        conn.execute(sql, params).fetchone()
+        conn.close()
+
+    def pooled(sql, params):
+        with pool.connection() as conn:
+            conn.execute(sql, params).fetchone()
+
+    print(f"{'query':>8} {'fresh us':>10} {'pooled us':>10}")
+    for name, (sql, params) in queries.items():
+        results = []
+        for run in (fresh, pooled):
+            start = time.perf_counter()
+            for _ in range(count):
+                run(sql, params)
+            results.append((time.perf_counter() - start) / count * 1e6)
+        print(f"{name:>8} {results[0]:>10.1f} {results[1]:>10.1f}")
+
+
+def bench_startup(args):
+    """Schema initialization cost and worker startup time on a fresh and a warm database"""
+    import subprocess
+    from database import init_db
+
+    print(f"{'step':>28} {'ms':>8}")
+    for label in ("init_db (fresh database)", "init_db (warm database)"):
+        start = time.perf_counter()
+        init_db()
+        print(f"{label:>28} {(time.perf_counter() - start) * 1000:>8.1f}")
+
+    # Import the app and run its startup handlers in a new interpreter, like a uvicorn worker
+    worker = (
+        "import asyncio, time; start = time.perf_counter(); import main; "
+        "imported = time.perf_counter(); asyncio.run(main.app.router.startup()); "
+        "print((imported - start) * 1000, (time.perf_counter() - imported) * 1000)"
+    )
+    for _ in range(3):
+        output = subprocess.run(
+            [sys.executable, "-c", worker], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.split()
+        print(f"{'worker: import modules':>28} {float(output[-2]):>8.1f}")
+        print(f"{'worker: startup handlers':>28} {float(output[-1]):>8.1f}")
+
+
+def bench_fanout(args):
+    """Time to push one cancellation to its bookers with many clients connected"""
+    from notifications import NotificationHub
+
+    async def run():
+        hub = NotificationHub()
+        queues = [hub.subscribe(f"user{i}") for i in range(args.clients)]
+        print(f"{args.clients} connected clients")
+        print(f"{'bookers':>8} {'fan-out ms':>11}")
+        for bookers in sorted({1, min(100, args.clients), args.clients}):
+            user_ids = [f"user{i}" for i in range(bookers)]
+            start = time.perf_counter()
+            # Publish from a worker thread, as the synchronous endpoints do
+            await asyncio.to_thread(hub.publish, user_ids, {"type": "cancelled", "timeslot_id": "x"})
+            elapsed = (time.perf_counter() - start) * 1000
+            assert all(queues[i].qsize() == 1 for i in range(bookers))
+            for i in range(bookers):
+                queues[i].get_nowait()
+            print(f"{bookers:>8} {elapsed:>11.3f}")
+
+    asyncio.run(run())
+
+
+def bench_bulk(args):
+    """Events/sec through the bulk NDJSON endpoint vs. one POST per event"""
+    import json
+    from fastapi.testclient import TestClient
+    import main
+
+    event = {"name": "Bulk", "category": EventCategory.CAT3.value, "date": "2099-01-01",
+             "start_time": "10:00", "end_time": "11:00"}
+    with TestClient(main.app) as client:
+        login = client.post("/api/auth/login", json={"username": "admin1", "password": "adminpassword1"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        count = min(args.sizes)
+        start = time.perf_counter()
+        for _ in range(count):
+            client.post("/api/timeslots", json=event, headers=headers)
+        print(f"{'events':>8} {'mode':>10} {'events/s':>10}")
+        print(f"{count:>8} {'single':>10} {count / (time.perf_counter() - start):>10.0f}")
+
+        ndjson_headers = {**headers, "Content-Type": "application/x-ndjson"}
+        for count in args.sizes:
+            body = "\n".join(json.dumps(event) for _ in range(count))
+            start = time.perf_counter()
+            response = client.post("/api/admin/timeslots/bulk", content=body, headers=ndjson_headers)
+            elapsed = time.perf_counter() - start
+            assert response.text.count('"created"') == count
+            print(f"{count:>8} {'bulk':>10} {count / elapsed:>10.0f}")
+
+
+def bench_churn(args):
+    """Per-operation cost of deletes and reschedules as the total number of events grows"""
+    print(f"{'events':>10} {'delete ms':>10} {'reschedule ms':>14} {'rebuild ms':>11}")
+    rng = random.Random(0)
+    for size in args.sizes:
+        store = seeded_store(size)
+        ops = min(args.repeat, size // 2)
+        victims = rng.sample(store.all(), 2 * ops)
+
+        start = time.perf_counter()
+        for ts in victims[:ops]:
+            store.delete(ts.id)
+        delete_ms = (time.perf_counter() - start) * 1000 / ops
+
+        start = time.perf_counter()
+        for ts in victims[ops:]:
+            ts.date = (FIRST_DAY + timedelta(days=rng.randrange(size // EVENTS_PER_DAY + 1))).isoformat()
+            store.update(ts)
+        reschedule_ms = (time.perf_counter() - start) * 1000 / ops
+
+        # What a delete used to cost: copying every other event into a new list
+        remaining = store.all()
+        target = victims[-1].id
+        rebuild_ms = timed(lambda: [ts for ts in remaining if ts.id != target], 3)
+        print(f"{size:>10} {delete_ms:>10.3f} {reschedule_ms:>14.3f} {rebuild_ms:>11.3f}")
+
+
+def bench_memory(args):
+    """Bytes per cached event: one pydantic TimeSlot per event vs. the store's compact records"""
+    import gc
+    import tracemalloc
+    from database import pool
+
+    def load_models():
+        # What the cache held before records: a TimeSlot model per row, keyed by id
+        with pool.connection() as conn:
+            rows = conn.execute("SELECT * FROM timeslots").fetchall()
+        return {row["id"]: TimeSlot(
+            id=row["id"], name=row["name"], category=row["category"], date=row["date"],
+            start_time=row["start_time"], end_time=row["end_time"], booked_by=[],
+            capacity=row["capacity"], status=row["status"], original_date=row["original_date"],
+            original_start_time=row["original_start_time"], original_end_time=row["original_end_time"]
+        ) for row in rows}
+
+    def load_store():
+        store = TimeslotStore()
+        store.load()
+        return store
+
+    def traced_bytes(load) -> int:
+        gc.collect()
+        tracemalloc.start()
+        loaded = load()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del loaded
+        return size
+
+    print(f"{'events':>10} {'models B/event':>15} {'store B/event':>14}")
+    for size in args.sizes:
+        seeded_store(size)
+        models = traced_bytes(load_models)
+        records = traced_bytes(load_store)
+        print(f"{size:>10} {models / size:>15.0f} {records / size:>14.0f}")
+
+
+def bench_json(args):
+    """GET /api/admin/timeslots throughput with the default and the FAST_JSON response path"""
+    from fastapi.testclient import TestClient
+    from auth import create_access_token
+    import main
+    import responses
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin1', 'is_admin': True})}"}
+    encoder = "orjson" if responses.orjson is not None else "json"
+    print(f"{'events':>8} {'default ms':>11} {'fast ms':>9} {'speedup':>8}   (fast path encoder: {encoder})")
+    with TestClient(main.app) as client:
+        for size in args.sizes:
+            main.timeslots = seeded_store(size)
+            repeat = max(3, min(args.repeat, 100000 // size))
+            timings = {}
+            bodies = {}
+            for fast in (False, True):
+                main.FAST_JSON = fast
+
+                def fetch():
+                    bodies[fast] = client.get("/api/admin/timeslots", headers=headers).content
+
+                timings[fast] = timed(fetch, repeat)
+            assert bodies[False] == bodies[True]
+            print(f"{size:>8} {timings[False]:>11.1f} {timings[True]:>9.1f} {timings[False] / timings[True]:>7.1f}x")
+
+
+def bench_etag(args):
+    """Admin timeslot refresh: full response vs. If-None-Match revalidation answered with 304"""
+    from fastapi.testclient import TestClient
+    from auth import create_access_token
+    import main
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin1', 'is_admin': True})}"}
+    print(f"{'events':>8} {'200 ms':>9} {'304 ms':>8} {'200 body bytes':>15}")
+    with TestClient(main.app) as client:
+        for size in args.sizes:
+            main.timeslots = seeded_store(size)
+            repeat = max(3, min(args.repeat, 100000 // size))
+            full = client.get("/api/admin/timeslots", headers=headers)
+            revalidate = {**headers, "If-None-Match": full.headers["ETag"]}
+            assert client.get("/api/admin/timeslots", headers=revalidate).status_code == 304
+            full_ms = timed(lambda: client.get("/api/admin/timeslots", headers=headers), repeat)
+            cached_ms = timed(lambda: client.get("/api/admin/timeslots", headers=revalidate), repeat)
+            print(f"{size:>8} {full_ms:>9.1f} {cached_ms:>8.2f} {len(full.content):>15}")
+
+
+def bench_changes(args):
+    """Client refresh after a few edits: delta since the client's version vs. the full listing"""
+    from fastapi.testclient import TestClient
+    from auth import create_access_token
+    import main
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin1', 'is_admin': True})}"}
+    print(f"{'events':>8} {'edits':>6} {'full ms':>9} {'delta ms':>9} {'full bytes':>11} {'delta bytes':>12}")
+    with TestClient(main.app) as client:
+        for size in args.sizes:
+            main.timeslots = seeded_store(size)
+            since = main.timeslots.version
+            edited = random.Random(size).sample(main.timeslots.all(), min(size, 10))
+            main.timeslots.cancel_many([ts.id for ts in edited])
+            repeat = max(3, min(args.repeat, 100000 // size))
+            url = f"/api/timeslots/changes?since={since}"
+            full = client.get("/api/admin/timeslots", headers=headers)
+            delta = client.get(url, headers=headers)
+            assert not delta.json()["snapshot"] and len(delta.json()["upserts"]) == len(edited)
+            full_ms = timed(lambda: client.get("/api/admin/timeslots", headers=headers), repeat)
+            delta_ms = timed(lambda: client.get(url, headers=headers), repeat)
+            print(f"{size:>8} {len(edited):>6} {full_ms:>9.1f} {delta_ms:>9.2f} "
+                  f"{len(full.content):>11} {len(delta.content):>12}")
+
+
+def bench_calendar(args):
+    """Month grid data: the calendar summary vs. listing the month's timeslots"""
+    from fastapi.testclient import TestClient
+    from auth import create_access_token
+    import main
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'user1', 'is_admin': False})}"}
+    month = FIRST_DAY.strftime("%Y-%m")
+    listing = f"/api/timeslots?start_date={month}-01&end_date={month}-31"
+    summary = f"/api/calendar/summary?month={month}"
+    print(f"{'events':>8} {'month events':>13} {'list ms':>9} {'summary ms':>11} {'list bytes':>11} {'summary bytes':>14}")
+    with TestClient(main.app) as client:
+        for size in args.sizes:
+            main.timeslots = seeded_store(size)
+            repeat = max(3, min(args.repeat, 100000 // size))
+            listed = client.get(listing, headers=headers)
+            summarized = client.get(summary, headers=headers)
+            assert sum(day["total"] for day in summarized.json()["days"]) == len(listed.json())
+            list_ms = timed(lambda: client.get(listing, headers=headers), repeat)
+            summary_ms = timed(lambda: client.get(summary, headers=headers), repeat)
+            print(f"{size:>8} {len(listed.json()):>13} {list_ms:>9.1f} {summary_ms:>11.2f} "
+                  f"{len(listed.content):>11} {len(summarized.content):>14}")
+
+
+def bench_search(args):
+    """Name search queries as the number of events grows, against scanning every name"""
+    from search import name_tokens, query_terms
+
+    titles = ["Summer Music Festival", "Jazz Night", "Rock Concert", "Classical Performance", "Stand-up Comedy Show",
+              "Improv Night", "Movie Premiere", "Film Screening", "Food & Wine Festival", "Street Food Fair",
+              "Art Gallery Opening", "Photography Show", "Basketball Game", "Tennis Tournament", "Tech Conference",
+              "Developer Meetup", "Networking Mixer", "Workshop"]
+    venues = ["Riverside", "Downtown", "Harbor", "Old Town", "City Hall", "Main Square", "Campus", "Arena"]
+    names = [f"{title} at {venue}" for title in titles for venue in venues]
+    month = (FIRST_DAY.isoformat(), (FIRST_DAY + timedelta(days=30)).isoformat())
+    queries = [
+        ("jazz", None), ("jazz night", None), ("jazz ni", None), ("festival", month),
+        ("food harbor", None), ("n", None), ("t", month), ("opera", None), ("jazz tennis", None),
+    ]
+    print(f"{'events':>10} {'query':>18} {'range':>6} {'results':>8} {'search ms':>10} {'scan ms':>10}")
+    for size in args.sizes:
+        store = seeded_store(size, names)
+        records = list(store._by_id.values())
+        for query, dates in queries:
+            start_date, end_date = dates or (None, None)
+            results = store.search(query, start_date, end_date, limit=20)
+            search_ms = timed(lambda: store.search(query, start_date, end_date, limit=20), args.repeat)
+            terms = query_terms(query)
+
+            def scan():
+                # Every name, checking whole words only
+                return [record for record in records if all(term in name_tokens(record.name) for term in terms)]
+
+            scan_ms = timed(scan, max(1, min(args.repeat, 1000000 // size)))
+            print(f"{size:>10} {query!r:>18} {'month' if dates else 'all':>6} {len(results):>8} "
+                  f"{search_ms:>10.3f} {scan_ms:>10.1f}")
+
+
+def run_worker(code: str, **env) -> list:
+    """Run Python code in a new interpreter against the bench database; returns its printed words"""
+    import subprocess
+    return subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, **env}
+    ).stdout.split()
+
+
+def bench_recovery(args):
+    """Restart cost: replaying the database into the store after a crash and after a clean shutdown"""
+    from database import checkpointer
+
+    # A new process, like a restarted worker: nothing is cached but the OS page cache
+    worker = (
+        "import os, time; from store import TimeslotStore; from database import DB_FILE; "
+        "wal = os.path.getsize(DB_FILE + '-wal') if os.path.exists(DB_FILE + '-wal') else 0; "
+        "start = time.perf_counter(); store = TimeslotStore(); store.load(); "
+        "print((time.perf_counter() - start) * 1000, len(store), wal)"
+    )
+    print(f"{'events':>8} {'state':>22} {'WAL file bytes':>15} {'replay ms':>10}")
+    for size in args.sizes:
+        seeded_store(size)
+        # Left as a crash leaves it: whatever the WAL holds since its last auto-checkpoint
+        for state in ("crash (WAL not folded)", "clean (checkpointed)"):
+            if state.startswith("clean"):
+                checkpointer.checkpoint("TRUNCATE")
+            elapsed, loaded, wal = run_worker(worker)
+            assert int(loaded) == size
+            print(f"{size:>8} {state:>22} {int(wal):>15} {float(elapsed):>10.0f}")
+
+
+def bench_fsync(args):
+    """Booking commit latency and throughput under each DB_FSYNC policy"""
+    worker = (
+        "import time; from database import init_db, checkpointer; from store import TimeslotStore; "
+        "from models import TimeSlot, EventCategory; init_db(); store = TimeslotStore(); store.load(); "
+        "ts = TimeSlot(id='fsync-bench', name='x', category=EventCategory.CAT8, date='2999-01-01', "
+        "start_time='10:00', end_time='11:00', capacity=100000); store.delete(ts.id); store.add(ts); "
+        "checkpointer.start(); samples = []; start = time.perf_counter()\n"
+        "for i in range({bookings}):\n"
+        "    t = time.perf_counter(); store.book(ts.id, f'user{{i}}'); samples.append(time.perf_counter() - t)\n"
+        "total = time.perf_counter() - start; checkpointer.stop(); samples.sort(); "
+        "print(samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000, len(samples) / total)"
+    ).format(bookings=args.bookings)
+    print(f"{'policy':>12} {'p50 ms':>8} {'p99 ms':>8} {'commits/s':>10}")
+    for policy in ("always", "interval", "checkpoint", "os"):
+        p50, p99, rate = run_worker(worker, DB_FSYNC=policy)
+        print(f"{policy:>12} {float(p50):>8.3f} {float(p99):>8.3f} {float(rate):>10.0f}")
+
+
+def read_load(port: int, token: str, seconds: float, results):
+    """Client process: GET one page of timeslots over keep-alive for `seconds`; reports requests done"""
+    import httpx
+    headers = {"Authorization": f"Bearer {token}"}
+    done = 0
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}", headers=headers) as client:
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            client.get("/api/timeslots", params={"limit": 50}).raise_for_status()
+            done += 1
+    results.put(done)
+
+
+def bench_workers(args):
+    """Read throughput of uvicorn with 1..N worker processes sharing state (SHARED_STATE=1)"""
+    import multiprocessing
+    import subprocess
+    import httpx
+    from auth import create_access_token
+
+    seeded_store(args.sizes[0])
+    token = create_access_token({"sub": "user1", "is_admin": False})
+    context = multiprocessing.get_context("spawn")
+    port = 8765
+    print(f"{args.sizes[0]} events, {os.cpu_count()} CPUs, {args.clients_per_worker} clients per worker")
+    print(f"{'workers':>8} {'req/s':>9} {'scaling':>8}")
+    baseline = None
+    for workers in args.workers or [1, 2, 4]:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+             "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, "SHARED_STATE": "1"}
+        )
+        try:
+            deadline = time.perf_counter() + 120
+            while True:
+                try:
+                    httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+                    break
+                except httpx.TransportError:
+                    if time.perf_counter() > deadline:
+                        raise
+                    time.sleep(0.2)
+            time.sleep(workers)  # let every worker finish its startup
+            results = context.Queue()
+            clients = [
+                context.Process(target=read_load, args=(port, token, args.seconds, results))
+                for _ in range(workers * args.clients_per_worker)
+            ]
+            for client in clients:
+                client.start()
+            total = sum(results.get() for _ in clients)
+            for client in clients:
+                client.join()
+        finally:
+            server.terminate()
+            server.wait()
+        rate = total / args.seconds
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>9.0f} {rate / baseline:>7.2f}x")
+
+
+BENCHMARKS = {
+    "date-range": bench_date_range,
+    "login": bench_login,
+    "token": bench_token,
+    "db": bench_db,
+    "startup": bench_startup,
+    "fanout": bench_fanout,
+    "bulk": bench_bulk,
+    "churn": bench_churn,
+    "memory": bench_memory,
+    "json": bench_json,
+    "etag": bench_etag,
+    "changes": bench_changes,
+    "calendar": bench_calendar,
+    "recovery": bench_recovery,
+    "fsync": bench_fsync,
+    "workers": bench_workers,
+    "search": bench_search,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        help="login: verifier process counts (default 1..cpu count); workers: uvicorn worker counts")
+    parser.add_argument("--logins", type=int, default=32, help="login: concurrent logins per measurement")
+    parser.add_argument("--clients", type=int, default=10000, help="fanout: connected notification streams")
+    parser.add_argument("--bookings", type=int, default=2000, help="fsync: bookings committed per policy")
+    parser.add_argument("--seconds", type=float, default=10, help="workers: load duration per worker count")
+    parser.add_argument("--clients-per-worker", type=int, default=2, help="workers: client processes per worker")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -1,26 +1,194 @@
+import logging
 import sqlite3
 import os
-from passlib.context import CryptContext
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from time import perf_counter
+from typing import Optional
+from hashing import pwd_context, verify_password, get_password_hash
+from metrics import DB_SECONDS, DB_WAIT_SECONDS
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
 
 # Database file path - store in backend directory
 DB_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(DB_DIR, "event_manager.db")
+DB_FILE = os.getenv("DB_FILE", os.path.join(DB_DIR, "event_manager.db"))
+
+# Columns added to the timeslots table after its first release
+TIMESLOT_COLUMNS = [
+    ("name", "TEXT NOT NULL DEFAULT 'Event'"),
+    ("status", "TEXT NOT NULL DEFAULT 'active'"),
+    ("original_date", "TEXT"),
+    ("original_start_time", "TEXT"),
+    ("original_end_time", "TEXT"),
+]
+
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", 16 * 1024))  # page cache per connection
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))
+DB_STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection
+
+# When commits reach the disk. Every change is committed to the SQLite WAL
+# (the journal) before it is applied to the in-memory stores, so this bounds
+# what a power loss or OS crash can take; a process crash loses nothing.
+#   always:     fsync on every commit (synchronous=FULL)
+#   checkpoint: fsync when the WAL is checkpointed, about every 1000 pages (synchronous=NORMAL)
+#   interval:   like checkpoint, plus a checkpoint every DB_FSYNC_INTERVAL_MS, so
+#               the commits of each interval share one fsync (group commit)
+#   os:         never fsync; the OS writes pages back when it likes (synchronous=OFF)
+DB_FSYNC_POLICIES = {"always": "FULL", "checkpoint": "NORMAL", "interval": "NORMAL", "os": "OFF"}
+DB_FSYNC = os.getenv("DB_FSYNC", "checkpoint")
+if DB_FSYNC not in DB_FSYNC_POLICIES:
+    raise ValueError(f"DB_FSYNC must be one of {', '.join(DB_FSYNC_POLICIES)}, not {DB_FSYNC!r}")
+DB_FSYNC_INTERVAL_MS = int(os.getenv("DB_FSYNC_INTERVAL_MS", 100))
+# Seconds between snapshots (WAL checkpoints) under the other policies
+DB_CHECKPOINT_INTERVAL = float(os.getenv("DB_CHECKPOINT_INTERVAL", 30))
+
+# Hot query. sqlite3 caches prepared statements per connection keyed on the
+# SQL text, so pooled connections reuse the compiled statement.
+USER_LOGIN_QUERY = "SELECT username, password_hash, is_admin FROM users WHERE username = ?"
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_FILE)
+    """Get a new database connection configured for WAL journaling"""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_FSYNC_POLICIES[DB_FSYNC]}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
     return conn
 
-def init_db():
-    """Initialize database with tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections
+
+    Connections are opened lazily up to `size`; once all are in use, callers
+    wait up to `timeout` seconds for one to be returned.
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                open_new = True
+            else:
+                open_new = False
+        if open_new:
+            try:
+                return get_db_connection()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("Timed out waiting for a database connection")
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block
+
+        Uncommitted work is rolled back when the connection is returned.
+        """
+        start = perf_counter()
+        conn = self._acquire()
+        acquired = perf_counter()
+        DB_WAIT_SECONDS.observe(acquired - start)
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+            DB_SECONDS.observe(perf_counter() - acquired)
+
+    def stats(self) -> dict:
+        """Connections opened and currently idle"""
+        return {"open": self._opened, "idle": self._idle.qsize()}
+
+    def close(self):
+        """Close idle connections and forget them"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+pool = ConnectionPool()
+
+class Checkpointer:
+    """Background thread folding the WAL back into the database file
+
+    A checkpoint syncs the WAL, then copies its pages into the database (the
+    snapshot), so startup has little WAL left to read. Checkpoints are PASSIVE
+    and never wait for readers or writers; stop() runs a final TRUNCATE
+    checkpoint that empties the WAL file.
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        if interval is None:
+            interval = DB_FSYNC_INTERVAL_MS / 1000 if DB_FSYNC == "interval" else DB_CHECKPOINT_INTERVAL
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def checkpoint(self, mode: str = "PASSIVE"):
+        """Checkpoint the WAL now"""
+        with pool.connection() as conn:
+            conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except sqlite3.Error as e:
+                logger.warning("WAL checkpoint failed: %s", e)
+
+    def start(self):
+        """Start checkpointing every `interval` seconds"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="wal-checkpointer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the thread and leave an empty WAL behind"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.checkpoint("TRUNCATE")
+
+checkpointer = Checkpointer()
+
+def get_db():
+    """FastAPI dependency yielding a pooled connection for the request"""
+    with pool.connection() as conn:
+        yield conn
+
+def _migrate_initial_schema(cursor):
+    """Version 1: users, timeslots, bookings and user_preferences tables plus default users"""
     # Create users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -67,14 +235,96 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    
     # Create default users if they don't exist
-    create_default_users(cursor, conn)
+    create_default_users(cursor)
+
+def _migrate_persisted_timeslots(cursor):
+    """Version 2: event columns on timeslots and indexes for the timeslot store"""
+    # Some databases gained these columns before the schema was versioned
+    existing_columns = {row["name"] for row in cursor.execute("PRAGMA table_info(timeslots)")}
+    for column, definition in TIMESLOT_COLUMNS:
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE timeslots ADD COLUMN {column} {definition}")
     
-    conn.close()
+    # timeslots.id is already indexed as the primary key
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_timeslots_date_category ON timeslots(date, category)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user_id ON bookings(user_id)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_timeslot_user ON bookings(timeslot_id, user_id)")
+
+def _migrate_preferences_index(cursor):
+    """Version 3: index user_preferences by user, now that preferences are persisted"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_preferences_user_id ON user_preferences(user_id)")
 
-def create_default_users(cursor, conn):
+def _migrate_changes_log(cursor):
+    """Version 4: changes table through which workers share writes (see shared.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            origin TEXT NOT NULL
+        )
+    ''')
+
+def _migrate_waitlist(cursor):
+    """Version 5: waitlist table, one row per user waiting for a seat, in joining order"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timeslot_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            joined_at TEXT NOT NULL,
+            FOREIGN KEY (timeslot_id) REFERENCES timeslots(id),
+            FOREIGN KEY (user_id) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_waitlist_timeslot_user ON waitlist(timeslot_id, user_id)")
+    # A timeslot's waiters in joining order, so promoting the first is one index probe
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_timeslot_id ON waitlist(timeslot_id, id)")
+
+# Schema migrations in order; PRAGMA user_version records the last one applied
+MIGRATIONS = [
+    (1, _migrate_initial_schema),
+    (2, _migrate_persisted_timeslots),
+    (3, _migrate_preferences_index),
+    (4, _migrate_changes_log),
+    (5, _migrate_waitlist),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    """Schema version recorded in the database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    """Bring the database schema up to date
+
+    Returns straight away when the schema is current. Otherwise the pending
+    migrations run in one write transaction, so concurrent workers wait for the
+    first one and then find nothing left to do.
+    """
+    conn = get_db_connection()
+    try:
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            return
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check now that we hold the write lock
+            version = get_schema_version(conn)
+            cursor = conn.cursor()
+            for target_version, migrate in MIGRATIONS:
+                if target_version > version:
+                    migrate(cursor)
+                    cursor.execute(f"PRAGMA user_version = {target_version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+def create_default_users(cursor):
     """Create default users with hashed passwords"""
     # Check if users already exist
     cursor.execute("SELECT COUNT(*) FROM users WHERE username IN ('user1', 'admin1')")
@@ -94,21 +344,3 @@ def create_default_users(cursor, conn):
             INSERT INTO users (username, password_hash, is_admin, created_at)
             VALUES (?, ?, ?, ?)
         ''', ("admin1", admin1_password_hash, 1, datetime.now().isoformat()))
-        
-        conn.commit()
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
-    return pwd_context.hash(password)
-
-# Initialize database on import (with error handling)
-try:
-    init_db()
-except Exception as e:
-    print(f"Warning: Database initialization failed: {e}")
-    print("You may need to run 'python init_db.py' manually")
-
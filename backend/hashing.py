@@ -0,0 +1,40 @@
+"""
+Password hashing.
+
+Kept apart from database.py so the login verifier's worker processes import
+nothing but passlib. Run as a script, this module is such a worker (see
+passwords.py): it reads one JSON `[password, hash]` request per line on stdin
+and answers each with a `1` (verified) or `0` line on stdout until stdin closes.
+"""
+import json
+import sys
+from passlib.context import CryptContext
+
+# Password hashing context
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash"""
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    """Hash a password"""
+    return pwd_context.hash(password)
+
+
+def serve(requests=sys.stdin.buffer, responses=sys.stdout.buffer):
+    """Answer verification requests until the requests stream closes"""
+    for line in requests:
+        plain_password, hashed_password = json.loads(line)
+        try:
+            verified = verify_password(plain_password, hashed_password)
+        except ValueError:
+            verified = False  # malformed stored hash: nothing can match it
+        responses.write(b"1\n" if verified else b"0\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    serve()
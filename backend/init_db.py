@@ -5,16 +5,7 @@ Run this script to create the database with default users.
 """
 import os
 import sys
-import sqlite3
-from passlib.context import CryptContext
-from datetime import datetime
-
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# Database file path
-DB_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(DB_DIR, "event_manager.db")
+from database import DB_FILE, SCHEMA_VERSION, init_db
 
 def init_database():
     """Initialize database with tables and default users"""
@@ -25,87 +16,17 @@ def init_database():
         print(f"Database {DB_FILE} already exists.")
         response = input("Do you want to recreate it? (y/n): ")
         if response.lower() != 'y':
-            print("Keeping existing database.")
+            print("Keeping existing database (applying any pending migrations).")
+            init_db()
             return
-        os.remove(DB_FILE)
+        for path in (DB_FILE, f"{DB_FILE}-wal", f"{DB_FILE}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
         print("Removed existing database.")
     
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create users table
-    print("Creating users table...")
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            is_admin INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL
-        )
-    ''')
-    
-    # Create timeslots table
-    print("Creating timeslots table...")
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS timeslots (
-            id TEXT PRIMARY KEY,
-            category TEXT NOT NULL,
-            date TEXT NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT NOT NULL,
-            capacity INTEGER NOT NULL DEFAULT 1,
-            created_at TEXT NOT NULL
-        )
-    ''')
-    
-    # Create bookings table
-    print("Creating bookings table...")
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timeslot_id TEXT NOT NULL,
-            user_id TEXT NOT NULL,
-            booked_at TEXT NOT NULL,
-            FOREIGN KEY (timeslot_id) REFERENCES timeslots(id),
-            FOREIGN KEY (user_id) REFERENCES users(username)
-        )
-    ''')
-    
-    # Create user_preferences table
-    print("Creating user_preferences table...")
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            category TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(username)
-        )
-    ''')
-    
-    conn.commit()
-    
-    # Create default users
-    print("Creating default users...")
-    
-    # Create normal user: user1/password1
-    user1_password_hash = pwd_context.hash("password1")
-    cursor.execute('''
-        INSERT INTO users (username, password_hash, is_admin, created_at)
-        VALUES (?, ?, ?, ?)
-    ''', ("user1", user1_password_hash, 0, datetime.now().isoformat()))
-    print("  - Created user: user1 / password1")
-    
-    # Create admin user: admin1/adminpassword1
-    admin1_password_hash = pwd_context.hash("adminpassword1")
-    cursor.execute('''
-        INSERT INTO users (username, password_hash, is_admin, created_at)
-        VALUES (?, ?, ?, ?)
-    ''', ("admin1", admin1_password_hash, 1, datetime.now().isoformat()))
-    print("  - Created admin: admin1 / adminpassword1")
-    
-    conn.commit()
-    conn.close()
+    # Create tables, indexes and default users
+    print(f"Applying schema migrations up to version {SCHEMA_VERSION}...")
+    init_db()
     
     print(f"\nDatabase initialized successfully at: {DB_FILE}")
     print("\nDefault credentials:")
@@ -118,4 +39,3 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error initializing database: {e}")
         sys.exit(1)
-
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Load test for the Event Manager API.
+
+Seeds events (through the admin bulk endpoint) and user identities, then
+drives a weighted mix of requests from `--concurrency` concurrent clients
+and reports latency percentiles and throughput per endpoint as JSON:
+
+    python loadtest.py --mix browse --events 10000 --users 500 --concurrency 32
+    python loadtest.py --mix mixed --output results.json
+    python loadtest.py --mix mixed --compare results.json --max-regression 20
+    python loadtest.py --url http://localhost:8000 --mix booking-storm
+
+Without --url the app runs in-process over httpx's ASGI transport against a
+scratch database, so runs are reproducible and need no server. With --url it
+targets a running server, which must share this machine's SECRET_KEY, since
+users are JWTs signed here rather than logins (bcrypt would dominate every
+mix). Runs are seeded (--seed), so the same commit replays the same requests.
+
+Mixes:
+    browse         calendar browsing: week listings, month summaries, pages, single events
+    booking-storm  many users booking and releasing a few hot events
+    notifications  notification polling, own bookings, delta sync
+    admin          admin bulk cancels/reschedules, creates and deletes
+    mixed          all of the above, weighted like a normal day
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# (weight, operation name) per mix; operations are the Scenario methods of the same name
+MIXES: Dict[str, List[Tuple[int, str]]] = {
+    "browse": [(40, "list_week"), (20, "month_summary"), (20, "list_page"), (20, "get_event")],
+    "booking-storm": [(60, "book"), (40, "unbook")],
+    "notifications": [(50, "notifications"), (30, "my_bookings"), (20, "changes")],
+    "admin": [(30, "bulk_cancel"), (30, "bulk_reschedule"), (30, "create_event"), (10, "delete_event")],
+}
+MIXES["mixed"] = (
+    [(weight * 6, name) for weight, name in MIXES["browse"]]
+    + [(weight * 2, name) for weight, name in MIXES["booking-storm"]]
+    + [(weight * 2, name) for weight, name in MIXES["notifications"]]
+    + [(weight // 5, name) for weight, name in MIXES["admin"]]
+)
+
+CATEGORIES = [
+    "Music Festivals", "Comedy Shows", "Movies", "Food Festivals",
+    "Art Exhibitions", "Sports Events", "Tech Conferences", "Other",
+]
+TIMES = [("09:00", "11:00"), ("10:00", "12:00"), ("14:00", "16:00"), ("15:00", "17:00"), ("18:00", "20:00"), ("19:00", "21:00")]
+NAMES = ["Summer Music Festival", "Comedy Special", "Film Screening", "Street Food Fair",
+         "Photography Show", "Soccer Match", "Developer Meetup", "Networking Mixer"]
+# Events spread over this many days from today
+SEED_DAYS = 365
+# Events targeted by the booking storm
+HOT_EVENTS = 20
+SEED_BATCH = 5000
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * fraction // 1))  # ceil
+    return sorted_values[int(rank) - 1]
+
+
+def event_items(rng: random.Random, count: int, first_day: date) -> List[dict]:
+    """`count` create requests in the style of create_sample_events, spread over SEED_DAYS"""
+    items = []
+    for _ in range(count):
+        start_time, end_time = rng.choice(TIMES)
+        items.append({
+            "name": rng.choice(NAMES),
+            "category": rng.choice(CATEGORIES),
+            "date": (first_day + timedelta(days=rng.randrange(SEED_DAYS))).isoformat(),
+            "start_time": start_time,
+            "end_time": end_time,
+        })
+    return items
+
+
+class Recorder:
+    """Latencies and status codes per endpoint label"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, label: str, seconds: float, status: Optional[int]):
+        self.latencies[label].append(seconds * 1000)
+        self.statuses[label][str(status) if status is not None else "transport-error"] += 1
+        # 4xx answers (full event, already booked, ...) are expected under load; 5xx are not
+        if status is None or status >= 500:
+            self.errors[label] += 1
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for label in sorted(self.latencies):
+            values = sorted(self.latencies[label])
+            endpoints[label] = {
+                "count": len(values),
+                "errors": self.errors[label],
+                "status": dict(self.statuses[label]),
+                "throughput_rps": round(len(values) / elapsed, 1),
+                "latency_ms": {
+                    "p50": round(percentile(values, 0.50), 3),
+                    "p95": round(percentile(values, 0.95), 3),
+                    "p99": round(percentile(values, 0.99), 3),
+                    "mean": round(sum(values) / len(values), 3),
+                    "max": round(values[-1], 3),
+                },
+            }
+        everything = sorted(value for values in self.latencies.values() for value in values)
+        total = {
+            "count": len(everything),
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(len(everything) / elapsed, 1),
+            "latency_ms": {
+                "p50": round(percentile(everything, 0.50), 3),
+                "p95": round(percentile(everything, 0.95), 3),
+                "p99": round(percentile(everything, 0.99), 3),
+            },
+        }
+        return {"endpoints": endpoints, "total": total}
+
+
+class Scenario:
+    """The operations a mix draws from, sharing seeded events and user tokens"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random,
+                 event_ids: List[str], user_tokens: List[Tuple[str, str]], admin_token: str):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.event_ids = event_ids
+        self.hot_ids = event_ids[:HOT_EVENTS]
+        self.users = user_tokens
+        self.admin = {"Authorization": f"Bearer {admin_token}"}
+        self.today = date.today()
+        self.version = 0
+
+    async def request(self, label: str, method: str, url: str, headers: dict, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+        except httpx.TransportError:
+            self.recorder.record(label, time.perf_counter() - start, None)
+            return None
+        self.recorder.record(label, time.perf_counter() - start, response.status_code)
+        return response
+
+    def user(self) -> Tuple[str, dict]:
+        user_id, token = self.rng.choice(self.users)
+        return user_id, {"Authorization": f"Bearer {token}"}
+
+    def day(self) -> date:
+        return self.today + timedelta(days=self.rng.randrange(SEED_DAYS))
+
+    # Calendar browsing
+    async def list_week(self):
+        _, headers = self.user()
+        start = self.day()
+        params = {"start_date": start.isoformat(), "end_date": (start + timedelta(days=6)).isoformat()}
+        await self.request("GET /api/timeslots (week)", "GET", "/api/timeslots", headers, params=params)
+
+    async def month_summary(self):
+        _, headers = self.user()
+        month = self.day().strftime("%Y-%m")
+        await self.request("GET /api/calendar/summary", "GET", "/api/calendar/summary", headers, params={"month": month})
+
+    async def list_page(self):
+        _, headers = self.user()
+        params = {"limit": 50, "start_date": self.day().isoformat()}
+        response = await self.request("GET /api/timeslots (page)", "GET", "/api/timeslots", headers, params=params)
+        cursor = response.headers.get("x-next-cursor") if response is not None else None
+        if cursor:
+            params["cursor"] = cursor
+            await self.request("GET /api/timeslots (page)", "GET", "/api/timeslots", headers, params=params)
+
+    async def get_event(self):
+        _, headers = self.user()
+        await self.request("GET /api/timeslots/{id}", "GET", f"/api/timeslots/{self.rng.choice(self.event_ids)}", headers)
+
+    # Booking storm
+    async def book(self):
+        _, headers = self.user()
+        await self.request("POST /api/timeslots/{id}/book", "POST", f"/api/timeslots/{self.rng.choice(self.hot_ids)}/book", headers)
+
+    async def unbook(self):
+        _, headers = self.user()
+        await self.request("DELETE /api/timeslots/{id}/book", "DELETE", f"/api/timeslots/{self.rng.choice(self.hot_ids)}/book", headers)
+
+    # Notification polling
+    async def notifications(self):
+        _, headers = self.user()
+        await self.request("GET /api/notifications", "GET", "/api/notifications", headers)
+
+    async def my_bookings(self):
+        user_id, headers = self.user()
+        await self.request("GET /api/users/{id}/bookings", "GET", f"/api/users/{user_id}/bookings", headers)
+
+    async def changes(self):
+        _, headers = self.user()
+        response = await self.request(
+            "GET /api/timeslots/changes", "GET", "/api/timeslots/changes", headers, params={"since": self.version}
+        )
+        if response is not None and response.status_code == 200:
+            self.version = response.json()["version"]
+
+    # Admin bulk edits
+    def sample_ids(self, count: int) -> List[str]:
+        return self.rng.sample(self.event_ids, min(count, len(self.event_ids)))
+
+    async def bulk_cancel(self):
+        await self.request("POST /api/admin/timeslots/bulk/cancel", "POST", "/api/admin/timeslots/bulk/cancel",
+                           self.admin, json={"ids": self.sample_ids(50)})
+
+    async def bulk_reschedule(self):
+        start_time, end_time = self.rng.choice(TIMES)
+        body = {"ids": self.sample_ids(50), "date": self.day().isoformat(), "start_time": start_time, "end_time": end_time}
+        await self.request("POST /api/admin/timeslots/bulk/reschedule", "POST", "/api/admin/timeslots/bulk/reschedule",
+                           self.admin, json=body)
+
+    async def create_event(self):
+        item = event_items(self.rng, 1, self.today)[0]
+        response = await self.request("POST /api/timeslots", "POST", "/api/timeslots", self.admin, json=item)
+        if response is not None and response.status_code == 200:
+            self.event_ids.append(response.json()["id"])
+
+    async def delete_event(self):
+        # Spare the hot events so the booking storm keeps its targets
+        if len(self.event_ids) <= HOT_EVENTS:
+            return
+        index = self.rng.randrange(HOT_EVENTS, len(self.event_ids))
+        timeslot_id = self.event_ids.pop(index)
+        await self.request("DELETE /api/timeslots/{id}", "DELETE", f"/api/timeslots/{timeslot_id}", self.admin)
+
+
+async def seed(client: httpx.AsyncClient, admin_token: str, rng: random.Random, events: int) -> List[str]:
+    """Create `events` events through the bulk endpoint; returns their ids"""
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    ids = []
+    for start in range(0, events, SEED_BATCH):
+        items = event_items(rng, min(SEED_BATCH, events - start), date.today())
+        response = await client.post("/api/admin/timeslots/bulk", headers=headers, json=items, timeout=600)
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            result = json.loads(line)
+            if result["status"] == "created":
+                ids.append(result["id"])
+    return ids
+
+
+async def drive(scenario: Scenario, mix: List[Tuple[int, str]], concurrency: int,
+                duration: Optional[float], requests: Optional[int]) -> float:
+    """Run `concurrency` clients until `duration` seconds or `requests` operations; returns the elapsed time"""
+    names = [name for _, name in mix]
+    weights = [weight for weight, _ in mix]
+    operations: List[Callable] = [getattr(scenario, name) for name in names]
+    remaining = [requests]
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    async def client_loop(rng: random.Random):
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if remaining[0] is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            await rng.choices(operations, weights)[0]()
+
+    # One generator per client keeps each client's sequence reproducible
+    await asyncio.gather(*(client_loop(random.Random(scenario.rng.random())) for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    if args.url is None:
+        # In-process: the app and a scratch database in this interpreter
+        os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="event-manager-loadtest-"), "loadtest.db")
+    from auth import create_access_token
+    admin_token = create_access_token({"sub": "admin1", "is_admin": True})
+    user_tokens = [(f"loaduser{i}", create_access_token({"sub": f"loaduser{i}", "is_admin": False}))
+                   for i in range(args.users)]
+    rng = random.Random(args.seed)
+
+    app = None
+    if args.url is None:
+        import main
+        app = main.app
+        await app.router.startup()
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://loadtest")
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60)
+    try:
+        seed_start = time.perf_counter()
+        event_ids = await seed(client, admin_token, rng, args.events)
+        seed_seconds = time.perf_counter() - seed_start
+        print(f"seeded {len(event_ids)} events in {seed_seconds:.1f}s", file=sys.stderr)
+
+        recorder = Recorder()
+        scenario = Scenario(client, recorder, rng, event_ids, user_tokens, admin_token)
+        if args.warmup:
+            await drive(scenario, MIXES[args.mix], args.concurrency, args.warmup, None)
+            scenario.recorder = recorder = Recorder()
+        elapsed = await drive(scenario, MIXES[args.mix], args.concurrency, args.duration, args.requests)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "target": args.url or "in-process",
+            "mix": args.mix,
+            "events": args.events,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "elapsed_s": round(elapsed, 3),
+            "seed_s": round(seed_seconds, 3),
+        },
+    }
+    report.update(recorder.report(elapsed))
+    return report
+
+
+def print_table(report: dict, baseline: Optional[dict] = None):
+    """Human-readable summary on stderr, with p95 change against a baseline"""
+    header = f"{'endpoint':<44} {'count':>7} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    print(header + ("  p95 vs base" if baseline else ""), file=sys.stderr)
+    rows = list(report["endpoints"].items()) + [("TOTAL", report["total"])]
+    for label, stats in rows:
+        latency = stats["latency_ms"]
+        line = (f"{label:<44} {stats['count']:>7} {stats['errors']:>4} {stats['throughput_rps']:>8.1f} "
+                f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f}")
+        base = (baseline or {}).get("endpoints", {}).get(label) if label != "TOTAL" else (baseline or {}).get("total")
+        if base:
+            line += f"  {regression(base, stats):+10.1f}%"
+        print(line, file=sys.stderr)
+
+
+def regression(base: dict, stats: dict) -> float:
+    """Change of p95 latency from `base` to `stats`, in percent"""
+    before = base["latency_ms"]["p95"]
+    return (stats["latency_ms"]["p95"] - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--events", type=int, default=10000, help="events to seed")
+    parser.add_argument("--users", type=int, default=500, help="distinct users issuing requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run (ignored with --requests)")
+    parser.add_argument("--requests", type=int, help="stop after this many operations instead of a duration")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of unrecorded load before measuring")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and request sequence")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON report to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float,
+                        help="with --compare, exit 1 if any endpoint's p95 grew by more than this percent")
+    args = parser.parse_args()
+    if args.requests:
+        args.duration = None
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(report, baseline)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if baseline is not None and args.max_regression is not None:
+        regressed = [
+            label for label, stats in report["endpoints"].items()
+            if label in baseline["endpoints"] and regression(baseline["endpoints"][label], stats) > args.max_regression
+        ]
+        if regressed:
+            print(f"p95 regressed by more than {args.max_regression}%: {', '.join(regressed)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,44 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 import uvicorn
+import asyncio
+import logging
+import os
+import hashlib
+import json
 from typing import List, Optional
 from datetime import datetime, date, time, timedelta
-from enum import Enum
 import uuid
-from database import get_db_connection, verify_password, init_db
-from auth import create_access_token, get_current_user, get_current_admin
+from time import perf_counter
+from database import pool, init_db, checkpointer, USER_LOGIN_QUERY
+from auth import create_access_token, get_current_user, get_current_admin, get_stream_user, token_cache_stats
+from models import (
+    EventCategory, TimeSlot, TimeSlotCreate, TimeSlotReschedule, TimeSlotIds,
+    TimeSlotBulkReschedule, UserPreferences, LoginRequest
+)
+from metrics import (
+    METRICS, BOOKING_LOG_SAMPLE, BOOKINGS, MetricsMiddleware, registry, log_sampled
+)
+from notifications import NotificationHub
+from profiler import ProfilerBusy, ProfilerMiddleware, profiler
+from records import CATEGORY_CODES
+from responses import FAST_JSON, FastJSONResponse
+from passwords import PasswordVerifier, VerifierSaturated, VerifierUnavailable
+from shared import SHARED_STATE, ChangeFeedMiddleware, change_feed, record_changes
+from store import (
+    TimeslotStore, TimeslotNotFound, TimeslotCancelled, TimeslotEnded, AlreadyBooked, TimeslotFull, NotBooked,
+    AlreadyWaiting, NotWaiting, SortKey, encode_cursor, decode_cursor
+)
 
-# Ensure database is initialized
-try:
-    init_db()
-    print("Database initialized successfully")
-except Exception as e:
-    print(f"Warning: Database initialization error: {e}")
-    print("Please run 'python init_db.py' to initialize the database")
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s"
+)
+logger = logging.getLogger(__name__)
+booking_logger = logging.getLogger("bookings")
 
 app = FastAPI(title="Event Manager API")
 
@@ -26,76 +49,264 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+if SHARED_STATE:
+    app.add_middleware(ChangeFeedMiddleware)
+# Idle until an admin opens a window at /api/admin/profile
+app.add_middleware(ProfilerMiddleware)
+# Outermost, so request timings include catching up with other workers
+if METRICS:
+    app.add_middleware(MetricsMiddleware)
+
+# Largest page a client may request from the timeslot listing endpoints
+MAX_PAGE_SIZE = 1000
+# Fields accepted by the `fields=` projection on timeslot listings
+PROJECTABLE_FIELDS = set(TimeSlot.model_fields) | {"booked_count"}
+# Most items accepted by one bulk admin request
+MAX_BULK_ITEMS = 100000
+# Largest bulk admin request body, in bytes
+MAX_BULK_BYTES = 64 * 1024 * 1024
+# Result lines sent per chunk of a streamed bulk response
+NDJSON_CHUNK_ITEMS = 1000
+# Sent with ETagged reads: browsers may keep the body but must revalidate it every time
+REVALIDATE_HEADERS = {"Cache-Control": "private, no-cache"}
+# Seconds between keepalive comments on an idle notification stream
+NOTIFICATION_KEEPALIVE_SECONDS = 25
+# Longest window /api/admin/profile may sample
+MAX_PROFILE_SECONDS = 300
 
-# Enums
-class EventCategory(str, Enum):
-    CAT1 = "Music Festivals"
-    CAT2 = "Comedy Shows"
-    CAT3 = "Movies"
-    CAT4 = "Food Festivals"
-    CAT5 = "Art Exhibitions"
-    CAT6 = "Sports Events"
-    CAT7 = "Tech Conferences"
-    CAT8 = "Other"
-
-# Models
-class TimeSlot(BaseModel):
-    id: str
-    name: str  # Event name
-    category: EventCategory
-    date: str  # ISO format date string
-    start_time: str  # HH:MM format
-    end_time: str  # HH:MM format
-    booked_by: List[str] = []  # List of User IDs
-    capacity: int = 1  # Maximum number of seats
-    status: str = "active"  # "active", "cancelled", "rescheduled"
-    original_date: Optional[str] = None  # Original date if rescheduled
-    original_start_time: Optional[str] = None  # Original start time if rescheduled
-    original_end_time: Optional[str] = None  # Original end time if rescheduled
-
-class TimeSlotCreate(BaseModel):
-    name: str  # Event name
-    category: EventCategory
-    date: str
-    start_time: str
-    end_time: str
-    capacity: int = 1
-
-class TimeSlotReschedule(BaseModel):
-    date: str
-    start_time: str
-    end_time: str
-
-class TimeSlotBook(BaseModel):
-    user_id: str
-
-class UserPreferences(BaseModel):
-    user_id: str
-    categories: List[EventCategory]
-
-class LoginRequest(BaseModel):
-    username: str
-    password: str
-
-timeslots: List[TimeSlot] = []
+# With SHARED_STATE, several workers keep copies in sync through the database (shared.py)
+timeslots = TimeslotStore(change_feed if SHARED_STATE else None)
 user_preferences: dict[str, List[EventCategory]] = {}
+# Store version issued for each user's last preference change, so delta syncs from before it get a snapshot
+preference_versions: dict[str, int] = {}
+password_verifier = PasswordVerifier()
+notification_hub = NotificationHub()
+
+# Sizes read when /metrics is scraped
+registry.gauge(
+    "timeslot_store_size", "Entries in the in-memory timeslot store", ("structure",),
+    callback=lambda: {(name,): value for name, value in timeslots.stats().items()}
+)
+registry.gauge("user_preferences_users", "Users with preferences in memory", callback=lambda: len(user_preferences))
+registry.gauge(
+    "token_cache_entries", "Validated JWTs cached", callback=lambda: token_cache_stats()["size"]
+)
+registry.gauge("credential_cache_entries", "Verified logins cached", callback=lambda: len(password_verifier.cache))
+registry.gauge("password_verify_pending", "Logins waiting for or running bcrypt", callback=lambda: password_verifier.pending)
+registry.gauge("notification_streams", "Open notification streams", callback=notification_hub.subscriber_count)
+registry.gauge(
+    "db_pool_connections", "Pooled SQLite connections", ("state",),
+    callback=lambda: {(state,): value for state, value in pool.stats().items()}
+)
+registry.gauge("change_feed_seq", "Last change applied from the shared change feed", callback=lambda: change_feed.seq)
+
+@app.on_event("startup")
+def startup():
+    """Migrate the database schema if needed and load timeslots and preferences into memory"""
+    started = perf_counter()
+    # Ensure database is initialized
+    try:
+        init_db()
+    except Exception as e:
+        logger.warning("Database initialization error: %s. Please run 'python init_db.py' to initialize the database", e)
+    timeslots.load()
+    user_preferences.clear()
+    user_preferences.update(load_user_preferences())
+    if SHARED_STATE:
+        change_feed.start(timeslots.version)
+    checkpointer.start()
+    logger.info("Startup completed in %.1f ms (%d timeslots)", (perf_counter() - started) * 1000, len(timeslots))
+
+@app.on_event("shutdown")
+def stop_password_verifier():
+    """Stop the password verification worker processes"""
+    password_verifier.shutdown()
+
+@app.on_event("shutdown")
+def stop_checkpointer():
+    """Stop following other workers and checkpoint the WAL so the next startup reads a compact database"""
+    change_feed.stop()
+    checkpointer.stop()
+
+# Category of the single row recording an empty selection, which is not the same as no preferences
+NO_CATEGORIES = ""
+
+def load_user_preferences(user_ids: Optional[List[str]] = None) -> dict:
+    """Preferred categories of the given users (default: every user), from the database"""
+    preferences: dict[str, List[EventCategory]] = {}
+    with pool.connection() as conn:
+        if user_ids is None:
+            rows = conn.execute("SELECT user_id, category FROM user_preferences ORDER BY id").fetchall()
+        else:
+            rows = [row for user_id in user_ids for row in conn.execute(
+                "SELECT user_id, category FROM user_preferences WHERE user_id = ? ORDER BY id", (user_id,)
+            )]
+    for row in rows:
+        categories = preferences.setdefault(row["user_id"], [])
+        if row["category"] != NO_CATEGORIES:
+            categories.append(EventCategory(row["category"]))
+    return preferences
+
+def save_user_preferences(user_id: str, categories: List[EventCategory]):
+    """Replace a user's preferred categories in the database"""
+    with pool.connection() as conn, conn:
+        conn.execute("DELETE FROM user_preferences WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO user_preferences (user_id, category) VALUES (?, ?)",
+            [(user_id, category.value) for category in categories] or [(user_id, NO_CATEGORIES)]
+        )
+        if SHARED_STATE:
+            record_changes(conn, "preferences", (user_id,))
+
+def apply_preference_changes(changes):
+    """Reload the preferences of users changed by any worker (change feed handler)"""
+    latest = {user_id: seq for seq, user_id, _ in changes}
+    reloaded = load_user_preferences(list(latest))
+    for user_id, seq in latest.items():
+        if user_id in reloaded:
+            user_preferences[user_id] = reloaded[user_id]
+        else:
+            user_preferences.pop(user_id, None)
+        preference_versions[user_id] = timeslots.advance(seq)
+
+def apply_timeslot_changes(changes):
+    """Apply timeslot changes from any worker, notifying bookers of other workers' changes"""
+    for old, new, promoted in timeslots.apply_changes(changes):
+        if promoted:
+            notification_hub.publish(promoted, {"type": "promoted", "timeslot_id": new.id})
+        if new is None:
+            if old is not None:
+                notification_hub.publish(list(old.booked_by), {"type": "deleted", "timeslot_id": old.id})
+        elif new.status == "cancelled" and (old is None or old.status != "cancelled"):
+            notification_hub.publish(list(new.booked_by), {"type": "cancelled", "timeslot_id": new.id})
+        elif (new.status == "rescheduled" and old is not None
+              and (old.date, old.start, old.end) != (new.date, new.start, new.end)):
+            notification_hub.publish(list(new.booked_by), {"type": "rescheduled", "timeslot_id": new.id})
+
+def reload_shared_state():
+    """Reload everything after falling too far behind the change feed"""
+    timeslots.load()
+    user_preferences.clear()
+    user_preferences.update(load_user_preferences())
+    # Versions issued before the reload are older than the store's new change log
+    preference_versions.clear()
+
+change_feed.subscribe("timeslot", apply_timeslot_changes)
+change_feed.subscribe("preferences", apply_preference_changes)
+change_feed.on_resync(reload_shared_state)
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma-separated `fields=` projection"""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in PROJECTABLE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def project_timeslot(ts: TimeSlot, fields: List[str]) -> dict:
+    """Build the projected representation of a timeslot"""
+    return {
+        field: len(ts.booked_by) if field == "booked_count" else getattr(ts, field)
+        for field in fields
+    }
+
+def make_etag(version: int, *parts) -> str:
+    """Strong ETag for a representation of store `version` shaped by the request `parts`"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+    return f'"{version}-{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match lists `etag` (or is *)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip() for tag in header.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def not_modified(etag: str) -> Response:
+    """304 response for a matching If-None-Match"""
+    return Response(status_code=304, headers={"ETag": etag, **REVALIDATE_HEADERS})
+
+def list_timeslots_page(
+    request: Request,
+    response: Response,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    categories: Optional[set],
+    limit: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[str]
+):
+    """Fetch one page of timeslots in (date, start_time, id) order
+
+    When more results follow the page, its cursor is returned in the X-Next-Cursor header.
+    The ETag comes from the store version of the requested dates, so an unchanged
+    page is answered with 304 before anything is queried or serialized.
+    With FAST_JSON the page is rendered straight from the store's records.
+    """
+    projection = parse_fields(fields)
+    after: Optional[SortKey] = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    try:
+        # Read the version first: a change racing the query then only makes the ETag stale
+        version = timeslots.version_for_dates(start_date, end_date)
+        etag = make_etag(
+            version, start_date, end_date, sorted(categories) if categories is not None else None,
+            limit, cursor, projection
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        records = timeslots.query_records(start_date, end_date, categories, after=after, limit=limit + 1 if limit else None)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
+    response.headers["ETag"] = etag
+    response.headers.update(REVALIDATE_HEADERS)
+    if limit and len(records) > limit:
+        records = records[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(records[-1].key)
+    
+    if FAST_JSON:
+        # A returned Response does not pick up headers set on `response`
+        return FastJSONResponse(
+            [record.to_dict(projection) for record in records],
+            headers=dict(response.headers)
+        )
+    
+    page = [record.to_model() for record in records]
+    if projection is None:
+        return page
+    return [project_timeslot(ts, projection) for ts in page]
 
 @app.get("/")
 def read_root():
     return {"message": "Event Manager API"}
 
+if METRICS:
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        """Metrics in the Prometheus text format"""
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # Authentication endpoints
+def fetch_user(username: str):
+    """Get a user's login record from the database"""
+    with pool.connection() as conn:
+        return conn.execute(USER_LOGIN_QUERY, (username,)).fetchone()
+
 @app.post("/api/auth/login")
-def login(login_data: LoginRequest):
+async def login(login_data: LoginRequest):
     """Login endpoint for both users and admins"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Get user from database
-    cursor.execute("SELECT username, password_hash, is_admin FROM users WHERE username = ?", (login_data.username,))
-    user = cursor.fetchone()
-    conn.close()
+    user = await run_in_threadpool(fetch_user, login_data.username)
     
     if not user:
         raise HTTPException(
@@ -103,8 +314,22 @@ def login(login_data: LoginRequest):
             detail="Incorrect username or password"
         )
     
-    # Verify password
-    if not verify_password(login_data.password, user["password_hash"]):
+    # Verify password in the worker pool, shedding load when it is saturated
+    try:
+        verified = await password_verifier.verify(login_data.password, user["password_hash"])
+    except VerifierSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    except VerifierUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Login is temporarily unavailable, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -149,41 +374,77 @@ def update_user_preferences(user_id: str, preferences: UserPreferences, current_
     if current_user["username"] != user_id and not current_user["is_admin"]:
         raise HTTPException(status_code=403, detail="Not authorized to update this user's preferences")
     
-    user_preferences[user_id] = preferences.categories
-    return {"user_id": user_id, "categories": user_preferences[user_id]}
+    # Persist first, so memory never holds preferences that a restart would lose
+    save_user_preferences(user_id, preferences.categories)
+    if SHARED_STATE:
+        # Applied by the feed, in order with other workers' writes
+        change_feed.poll()
+    else:
+        user_preferences[user_id] = preferences.categories
+        preference_versions[user_id] = timeslots.advance()
+    return {"user_id": user_id, "categories": preferences.categories}
+
+@app.get("/api/users/{user_id}/bookings")
+def get_user_bookings(user_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Get the timeslots a user has booked, ordered by date and start time"""
+    # Users can only see their own bookings
+    if current_user["username"] != user_id and not current_user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's bookings")
+    
+    projection = parse_fields(fields)
+    booked = timeslots.bookings_for(user_id)
+    if projection is None:
+        return booked
+    return [project_timeslot(ts, projection) for ts in booked]
+
+@app.get("/api/users/{user_id}/waitlist")
+def get_user_waitlist(user_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Get the timeslots a user waits for, with their place in each line, ordered by date and start time"""
+    if current_user["username"] != user_id and not current_user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's waitlist")
+    
+    projection = parse_fields(fields)
+    return [
+        {"timeslot": ts if projection is None else project_timeslot(ts, projection), "position": position}
+        for ts, position in timeslots.waitlist_for(user_id)
+    ]
 
 # Timeslot endpoints
 @app.get("/api/timeslots")
 def get_timeslots(
+    request: Request,
+    response: Response,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     category: Optional[EventCategory] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get timeslots with optional filters"""
+    """Get timeslots with optional filters, pagination and field projection"""
     user_id = current_user["username"]
-    filtered = timeslots.copy()
-    
-    if start_date:
-        filtered = [ts for ts in filtered if ts.date >= start_date]
-    if end_date:
-        filtered = [ts for ts in filtered if ts.date <= end_date]
-    if category:
-        filtered = [ts for ts in filtered if ts.category == category]
+    categories = {category} if category else None
     
     # If user has preferences, only show timeslots for user's preferred categories
     if user_id in user_preferences:
-        user_cats = user_preferences[user_id]
-        filtered = [ts for ts in filtered if ts.category in user_cats]
+        user_cats = set(user_preferences[user_id])
+        categories = user_cats if categories is None else categories & user_cats
     
-    return filtered
+    return list_timeslots_page(request, response, start_date, end_date, categories, limit, cursor, fields)
 
 @app.post("/api/timeslots")
 def create_timeslot(timeslot: TimeSlotCreate, current_user: dict = Depends(get_current_admin)):
     """Create a new timeslot (Admin only) - capacity is fixed to 1"""
+    new_timeslot = build_timeslot(timeslot)
+    timeslots.add(new_timeslot)
+    return new_timeslot
+
+def build_timeslot(timeslot: TimeSlotCreate) -> TimeSlot:
+    """Build a new, unsaved timeslot from a create request"""
     capacity = 1
     
-    new_timeslot = TimeSlot(
+    return TimeSlot(
         id=str(uuid.uuid4()),
         name=timeslot.name,
         category=timeslot.category,
@@ -194,108 +455,413 @@ def create_timeslot(timeslot: TimeSlotCreate, current_user: dict = Depends(get_c
         capacity=capacity,  # Always 1
         status="active"
     )
-    timeslots.append(new_timeslot)
-    return new_timeslot
+
+# Declared before /api/timeslots/{timeslot_id}, which would otherwise match them
+@app.get("/api/timeslots/changes")
+def get_timeslot_changes(since: int = Query(..., ge=0), current_user: dict = Depends(get_current_user)):
+    """Timeslots created, changed or deleted after store version `since`"""
+    user_id = current_user["username"]
+    categories = set(user_preferences[user_id]) if user_id in user_preferences else None
+
+    # A delta filtered by new preferences would miss the events of newly preferred categories
+    changes = None if since < preference_versions.get(user_id, 0) else timeslots.changes_since(since)
+    if changes is None:
+        version = timeslots.version
+        records, deleted, snapshot = timeslots.query_records(categories=categories), [], True
+    else:
+        version, records, deleted = changes
+        snapshot = False
+        if categories is not None:
+            codes = {CATEGORY_CODES[category] for category in categories}
+            records = [record for record in records if record.category in codes]
+
+    if FAST_JSON:
+        return FastJSONResponse({
+            "version": version,
+            "snapshot": snapshot,
+            "upserts": [record.to_dict() for record in records],
+            "deleted": deleted,
+        })
+    return {
+        "version": version,
+        "snapshot": snapshot,
+        "upserts": [record.to_model() for record in records],
+        "deleted": deleted,
+    }
+
+@app.get("/api/timeslots/search")
+def search_timeslots(
+    q: str = Query(..., min_length=1, max_length=200),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[EventCategory] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Timeslots whose names contain every word of `q`, best matches first"""
+    user_id = current_user["username"]
+    categories = {category} if category else None
+    if user_id in user_preferences:
+        user_cats = set(user_preferences[user_id])
+        categories = user_cats if categories is None else categories & user_cats
+
+    projection = parse_fields(fields)
+    try:
+        hits = timeslots.search(q, start_date, end_date, categories, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
+    records = [record for _, record in hits]
+
+    if FAST_JSON:
+        return FastJSONResponse([record.to_dict(projection) for record in records])
+    page = [record.to_model() for record in records]
+    if projection is None:
+        return page
+    return [project_timeslot(ts, projection) for ts in page]
 
 @app.get("/api/timeslots/{timeslot_id}")
-def get_timeslot(timeslot_id: str):
-    """Get a specific timeslot"""
-    for ts in timeslots:
-        if ts.id == timeslot_id:
-            return ts
-    raise HTTPException(status_code=404, detail="Timeslot not found")
+def get_timeslot(timeslot_id: str, request: Request, response: Response):
+    """Get a specific timeslot; answers a matching If-None-Match with 304"""
+    version = timeslots.timeslot_version(timeslot_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    etag = make_etag(version, timeslot_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    ts = timeslots.get(timeslot_id)
+    if ts is None:
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    response.headers["ETag"] = etag
+    response.headers.update(REVALIDATE_HEADERS)
+    return ts
+
+def record_booking(action: str, outcome: str, timeslot_id: str, user_id: str):
+    """Count a booking attempt and log a sample of them"""
+    BOOKINGS.inc(action, outcome)
+    log_sampled(booking_logger, BOOKING_LOG_SAMPLE, action, outcome=outcome, timeslot_id=timeslot_id, user_id=user_id)
 
 @app.post("/api/timeslots/{timeslot_id}/book")
 def book_timeslot(timeslot_id: str, current_user: dict = Depends(get_current_user)):
     """Book a timeslot - only one booking per user per event"""
     user_id = current_user["username"]
-    for ts in timeslots:
-        if ts.id == timeslot_id:
-            # Check if event is cancelled
-            if ts.status == "cancelled":
-                raise HTTPException(status_code=400, detail="Cannot book cancelled events")
-            
-            # Check if event has ended
-            try:
-                event_datetime = datetime.strptime(f"{ts.date} {ts.end_time}", "%Y-%m-%d %H:%M")
-                if event_datetime < datetime.now():
-                    raise HTTPException(status_code=400, detail="Cannot book events that have already ended")
-            except ValueError:
-                # If date parsing fails
-                pass
-            
-            # Check if user already booked
-            if user_id in ts.booked_by:
-                raise HTTPException(status_code=400, detail="You have already booked this timeslot")
-            
-            # Check if capacity is full
-            if len(ts.booked_by) >= ts.capacity:
-                raise HTTPException(status_code=400, detail="Timeslot is full")
-            
-            ts.booked_by.append(user_id)
-            return ts
-    raise HTTPException(status_code=404, detail="Timeslot not found")
+    
+    # The store checks existence, cancellation, end time, duplicates and capacity atomically
+    try:
+        ts = timeslots.book(timeslot_id, user_id)
+    except TimeslotNotFound:
+        record_booking("book", "not_found", timeslot_id, user_id)
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    except TimeslotCancelled:
+        record_booking("book", "cancelled", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="Cannot book cancelled events")
+    except TimeslotEnded:
+        record_booking("book", "ended", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="Cannot book events that have already ended")
+    except AlreadyBooked:
+        record_booking("book", "already_booked", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="You have already booked this timeslot")
+    except TimeslotFull:
+        record_booking("book", "full", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="Timeslot is full")
+    record_booking("book", "booked", timeslot_id, user_id)
+    return ts
 
 @app.delete("/api/timeslots/{timeslot_id}/book")
 def unbook_timeslot(timeslot_id: str, current_user: dict = Depends(get_current_user)):
-    """Unbook a timeslot"""
+    """Unbook a timeslot; the seat goes to the first user on its waitlist"""
+    user_id = current_user["username"]
+    try:
+        promoted = timeslots.unbook(timeslot_id, user_id)
+    except TimeslotNotFound:
+        record_booking("unbook", "not_found", timeslot_id, user_id)
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    except NotBooked:
+        record_booking("unbook", "not_booked", timeslot_id, user_id)
+        raise HTTPException(status_code=403, detail="You have not booked this timeslot")
+    record_booking("unbook", "unbooked", timeslot_id, user_id)
+    if promoted is not None:
+        record_booking("promote", "booked", timeslot_id, promoted)
+        notification_hub.publish([promoted], {"type": "promoted", "timeslot_id": timeslot_id})
+    return {"message": "Timeslot unbooked successfully"}
+
+@app.post("/api/timeslots/{timeslot_id}/waitlist")
+def join_waitlist(timeslot_id: str, current_user: dict = Depends(get_current_user)):
+    """Wait for a seat in a full timeslot, or book it at once if one is free"""
     user_id = current_user["username"]
-    for ts in timeslots:
-        if ts.id == timeslot_id:
-            if user_id not in ts.booked_by:
-                raise HTTPException(status_code=403, detail="You have not booked this timeslot")
-            ts.booked_by.remove(user_id)
-            return {"message": "Timeslot unbooked successfully"}
-    raise HTTPException(status_code=404, detail="Timeslot not found")
+    try:
+        position = timeslots.join_waitlist(timeslot_id, user_id)
+    except TimeslotNotFound:
+        record_booking("wait", "not_found", timeslot_id, user_id)
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    except TimeslotCancelled:
+        record_booking("wait", "cancelled", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="Cannot wait for cancelled events")
+    except TimeslotEnded:
+        record_booking("wait", "ended", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="Cannot wait for events that have already ended")
+    except AlreadyBooked:
+        record_booking("wait", "already_booked", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="You have already booked this timeslot")
+    except AlreadyWaiting:
+        record_booking("wait", "already_waiting", timeslot_id, user_id)
+        raise HTTPException(status_code=400, detail="You are already on the waitlist")
+    if position == 0:
+        record_booking("wait", "booked", timeslot_id, user_id)
+        return {"status": "booked", "timeslot": timeslots.get(timeslot_id)}
+    record_booking("wait", "waiting", timeslot_id, user_id)
+    return {"status": "waiting", "position": position, "waiting": timeslots.waitlist_length(timeslot_id)}
+
+@app.get("/api/timeslots/{timeslot_id}/waitlist")
+def get_waitlist_position(timeslot_id: str, current_user: dict = Depends(get_current_user)):
+    """The user's place in a timeslot's waitlist (1 is next, null if not waiting) and its length"""
+    if timeslots.timeslot_version(timeslot_id) is None:
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    return {
+        "timeslot_id": timeslot_id,
+        "position": timeslots.waitlist_position(timeslot_id, current_user["username"]),
+        "waiting": timeslots.waitlist_length(timeslot_id)
+    }
+
+@app.delete("/api/timeslots/{timeslot_id}/waitlist")
+def leave_waitlist(timeslot_id: str, current_user: dict = Depends(get_current_user)):
+    """Leave a timeslot's waitlist"""
+    user_id = current_user["username"]
+    try:
+        timeslots.leave_waitlist(timeslot_id, user_id)
+    except NotWaiting:
+        record_booking("leave", "not_waiting", timeslot_id, user_id)
+        raise HTTPException(status_code=403, detail="You are not on this timeslot's waitlist")
+    record_booking("leave", "left", timeslot_id, user_id)
+    return {"message": "Left the waitlist"}
 
 @app.get("/api/admin/timeslots")
-def get_all_timeslots_admin(current_user: dict = Depends(get_current_admin)):
-    """Get all timeslots for admin view"""
-    return timeslots
+def get_all_timeslots_admin(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_admin)
+):
+    """Get all timeslots for admin view, with optional pagination and field projection"""
+    return list_timeslots_page(request, response, None, None, None, limit, cursor, fields)
+
+@app.get("/api/admin/profile")
+async def profile_requests(
+    seconds: float = Query(10, gt=0, le=MAX_PROFILE_SECONDS),
+    rate: float = Query(1.0, gt=0, le=1),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    format: str = Query("json", pattern="^(json|collapsed)$"),
+    current_user: dict = Depends(get_current_admin)
+):
+    """Profile a `rate` fraction of the requests served in the next `seconds` (Admin only)"""
+    try:
+        profiler.start(rate, interval_ms / 1000)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already being taken")
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = profiler.stop()
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    return profile.to_dict()
+
+def ndjson_response(results: List[dict]) -> StreamingResponse:
+    """Send per-item results as newline-delimited JSON, serialized a chunk at a time"""
+    def chunks():
+        # One chunk per NDJSON_CHUNK_ITEMS lines keeps per-send overhead off large batches
+        for i in range(0, len(results), NDJSON_CHUNK_ITEMS):
+            batch = results[i:i + NDJSON_CHUNK_ITEMS]
+            yield "".join(json.dumps(result, default=str) + "\n" for result in batch)
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+async def read_bulk_items(request: Request) -> list:
+    """Read a bulk request body given as a JSON array or as NDJSON
+
+    Malformed NDJSON lines become ValueError entries so they can be reported per item.
+    Bodies over MAX_BULK_BYTES are refused with 413 before they are parsed.
+    """
+    too_large = HTTPException(status_code=413, detail=f"Bodies are limited to {MAX_BULK_BYTES} bytes")
+    try:
+        declared = int(request.headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if declared > MAX_BULK_BYTES:
+        raise too_large
+
+    content_type = request.headers.get("content-type", "")
+    received = 0
+    # Unparsed bytes: a partial NDJSON line, or the whole JSON array
+    buffer = bytearray()
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = []
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_BULK_BYTES:
+                raise too_large
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                buffer += chunk
+                continue
+            # Complete lines end in this chunk; only the partial line after them is kept
+            buffer += chunk[:end]
+            lines = buffer.split(b"\n")
+            buffer = bytearray(chunk[end + 1:])
+            for line in lines:
+                if line.strip():
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError as e:
+                        items.append(ValueError(f"Invalid JSON: {e}"))
+            if len(items) > MAX_BULK_ITEMS:
+                break
+        if buffer.strip():
+            try:
+                items.append(json.loads(buffer))
+            except ValueError as e:
+                items.append(ValueError(f"Invalid JSON: {e}"))
+    else:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_BULK_BYTES:
+                raise too_large
+            buffer += chunk
+        try:
+            items = json.loads(buffer)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    return items
+
+@app.post("/api/admin/timeslots/bulk")
+async def bulk_create_timeslots(request: Request, current_user: dict = Depends(get_current_admin)):
+    """Create many timeslots from a JSON array or NDJSON body (Admin only); returns per-item NDJSON results"""
+    items = await read_bulk_items(request)
+    
+    results = []
+    new_timeslots = []
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            results.append({"index": index, "status": "error", "detail": str(item)})
+            continue
+        try:
+            new_timeslot = build_timeslot(TimeSlotCreate.model_validate(item))
+        except ValidationError as e:
+            results.append({"index": index, "status": "error", "detail": e.errors(include_url=False)})
+            continue
+        new_timeslots.append(new_timeslot)
+        results.append({"index": index, "status": "created", "id": new_timeslot.id})
+    
+    await run_in_threadpool(timeslots.add_many, new_timeslots)
+    return ndjson_response(results)
+
+@app.post("/api/admin/timeslots/bulk/cancel")
+def bulk_cancel_timeslots(request: TimeSlotIds, current_user: dict = Depends(get_current_admin)):
+    """Cancel many timeslots in one transaction (Admin only); returns per-item NDJSON results"""
+    cancelled = timeslots.cancel_many(request.ids)
+    for ts in cancelled:
+        notification_hub.publish(list(ts.booked_by), {"type": "cancelled", "timeslot_id": ts.id})
+    
+    cancelled_ids = {ts.id for ts in cancelled}
+    results = [
+        {"id": timeslot_id, "status": "cancelled"} if timeslot_id in cancelled_ids
+        else {"id": timeslot_id, "status": "error", "detail": "Timeslot not found"}
+        for timeslot_id in request.ids
+    ]
+    return ndjson_response(results)
+
+@app.post("/api/admin/timeslots/bulk/reschedule")
+def bulk_reschedule_timeslots(request: TimeSlotBulkReschedule, current_user: dict = Depends(get_current_admin)):
+    """Reschedule many timeslots to the same date/time in one transaction (Admin only); returns per-item NDJSON results"""
+    try:
+        check_reschedule(request)
+        error = None
+    except HTTPException as e:
+        error = e.detail
+    
+    rescheduled = []
+    if error is None:
+        rescheduled = timeslots.reschedule_many(request.ids, request.date, request.start_time, request.end_time)
+    for ts in rescheduled:
+        notification_hub.publish(list(ts.booked_by), {"type": "rescheduled", "timeslot_id": ts.id})
+    
+    rescheduled_ids = {ts.id for ts in rescheduled}
+    results = []
+    for timeslot_id in request.ids:
+        if timeslot_id in rescheduled_ids:
+            results.append({"id": timeslot_id, "status": "rescheduled"})
+        elif error is not None and timeslots.timeslot_version(timeslot_id) is not None:
+            results.append({"id": timeslot_id, "status": "error", "detail": error})
+        else:
+            results.append({"id": timeslot_id, "status": "error", "detail": "Timeslot not found"})
+    return ndjson_response(results)
+
+@app.post("/api/admin/timeslots/bulk/delete")
+def bulk_delete_timeslots(request: TimeSlotIds, current_user: dict = Depends(get_current_admin)):
+    """Delete many timeslots in one transaction (Admin only); returns per-item NDJSON results"""
+    results = []
+    deleted = []
+    for timeslot_id in request.ids:
+        ts = timeslots.get(timeslot_id)
+        if ts is None:
+            results.append({"id": timeslot_id, "status": "error", "detail": "Timeslot not found"})
+            continue
+        deleted.append(ts)
+        results.append({"id": timeslot_id, "status": "deleted"})
+    
+    timeslots.delete_many([ts.id for ts in deleted])
+    for ts in deleted:
+        notification_hub.publish(list(ts.booked_by), {"type": "deleted", "timeslot_id": ts.id})
+    return ndjson_response(results)
 
 @app.delete("/api/timeslots/{timeslot_id}")
 def delete_timeslot(timeslot_id: str, current_user: dict = Depends(get_current_admin)):
     """Delete a timeslot (Admin only)"""
-    global timeslots
-    timeslots = [ts for ts in timeslots if ts.id != timeslot_id]
+    ts = timeslots.get(timeslot_id)
+    timeslots.delete(timeslot_id)
+    if ts is not None:
+        notification_hub.publish(list(ts.booked_by), {"type": "deleted", "timeslot_id": timeslot_id})
     return {"message": "Timeslot deleted successfully"}
 
 @app.post("/api/timeslots/{timeslot_id}/cancel")
 def cancel_timeslot(timeslot_id: str, current_user: dict = Depends(get_current_admin)):
     """Cancel a timeslot (Admin only)"""
-    for ts in timeslots:
-        if ts.id == timeslot_id:
-            ts.status = "cancelled"
-            return {"message": "Timeslot cancelled successfully", "timeslot": ts}
-    raise HTTPException(status_code=404, detail="Timeslot not found")
+    ts = timeslots.cancel(timeslot_id)
+    if ts is None:
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    notification_hub.publish(list(ts.booked_by), {"type": "cancelled", "timeslot_id": ts.id})
+    return {"message": "Timeslot cancelled successfully", "timeslot": ts}
 
 @app.post("/api/timeslots/{timeslot_id}/reschedule")
 def reschedule_timeslot(timeslot_id: str, reschedule_data: TimeSlotReschedule, current_user: dict = Depends(get_current_admin)):
     """Reschedule a timeslot to a later date (Admin only)"""
-    for ts in timeslots:
-        if ts.id == timeslot_id:
-            # Store original date/time if not already stored
-            if not ts.original_date:
-                ts.original_date = ts.date
-                ts.original_start_time = ts.start_time
-                ts.original_end_time = ts.end_time
-            
-            # Validate new date is in the future
-            try:
-                new_datetime = datetime.strptime(f"{reschedule_data.date} {reschedule_data.end_time}", "%Y-%m-%d %H:%M")
-                if new_datetime < datetime.now():
-                    raise HTTPException(status_code=400, detail="New date must be in the future")
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid date or time format")
-            
-            # Update to new date/time
-            ts.date = reschedule_data.date
-            ts.start_time = reschedule_data.start_time
-            ts.end_time = reschedule_data.end_time
-            ts.status = "rescheduled"
-            
-            return {"message": "Timeslot rescheduled successfully", "timeslot": ts}
-    raise HTTPException(status_code=404, detail="Timeslot not found")
+    if timeslots.timeslot_version(timeslot_id) is None:
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    
+    check_reschedule(reschedule_data)
+    ts = timeslots.reschedule(timeslot_id, reschedule_data.date, reschedule_data.start_time, reschedule_data.end_time)
+    if ts is None:
+        raise HTTPException(status_code=404, detail="Timeslot not found")
+    notification_hub.publish(list(ts.booked_by), {"type": "rescheduled", "timeslot_id": ts.id})
+    
+    return {"message": "Timeslot rescheduled successfully", "timeslot": ts}
+
+def check_reschedule(reschedule_data: TimeSlotReschedule):
+    """Reject a reschedule whose new date and time are not in the future"""
+    try:
+        datetime.strptime(reschedule_data.start_time, "%H:%M")
+        new_datetime = datetime.strptime(f"{reschedule_data.date} {reschedule_data.end_time}", "%Y-%m-%d %H:%M")
+        if new_datetime < datetime.now():
+            raise HTTPException(status_code=400, detail="New date must be in the future")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date or time format")
 
 @app.post("/api/admin/create-sample-events")
 def create_sample_events(current_user: dict = Depends(get_current_admin)):
@@ -325,7 +891,7 @@ def create_sample_events(current_user: dict = Depends(get_current_admin)):
         EventCategory.CAT8: ["Community Event", "Networking Mixer", "Workshop", "Special Event"]
     }
     
-    created_count = 0
+    new_timeslots = []
     for day_offset in range(14):
         event_date = today + timedelta(days=day_offset)
         date_str = event_date.strftime("%Y-%m-%d")
@@ -348,39 +914,129 @@ def create_sample_events(current_user: dict = Depends(get_current_admin)):
                 capacity=capacity,
                 status="active"
             )
-            timeslots.append(new_timeslot)
-            created_count += 1
+            new_timeslots.append(new_timeslot)
     
+    timeslots.add_many(new_timeslots)
+    created_count = len(new_timeslots)
     return {"message": f"Created {created_count} sample events for the next 2 weeks", "count": created_count}
 
+# Calendar endpoints
+@app.get("/api/calendar/summary")
+def get_calendar_summary(
+    month: str,
+    request: Request,
+    response: Response,
+    category: Optional[EventCategory] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Per-day event counts of a month (YYYY-MM) for rendering a month grid"""
+    try:
+        first_day = datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid month format, expected YYYY-MM")
+    # strptime also takes "2026-1"; answer (and cache) it as "2026-01"
+    month = first_day.strftime("%Y-%m")
+    last_day = (first_day + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+
+    user_id = current_user["username"]
+    categories = {category} if category else None
+    if user_id in user_preferences:
+        user_cats = set(user_preferences[user_id])
+        categories = user_cats if categories is None else categories & user_cats
+
+    now = datetime.now()
+    today = now.date().isoformat()
+    version = timeslots.version_for_dates(first_day.isoformat(), last_day.isoformat())
+    # The day counters ignore times, so today's free seats only count in events that have not ended
+    available_today = first_day.isoformat() <= today <= last_day.isoformat() and any(
+        record.status != "cancelled" and len(record.booked_by) < record.capacity and not record.has_ended(now)
+        for record in timeslots.query_records(today, today, categories)
+    )
+    etag = make_etag(
+        version, month, sorted(categories) if categories is not None else None, today, available_today
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers.update(REVALIDATE_HEADERS)
+
+    days = timeslots.day_counts(first_day.isoformat(), last_day.isoformat(), categories)
+    return {
+        "month": month,
+        "days": [
+            {
+                "date": day,
+                "total": sum(counts.values()),
+                "categories": {category.value: count for category, count in counts.items()},
+                "available": available_today if day == today else available > 0 and day > today
+            }
+            for day, counts, available in days
+        ]
+    }
+
 @app.get("/api/notifications")
 def get_notifications(current_user: dict = Depends(get_current_user)):
     """Get notifications for cancelled/rescheduled events that the user has booked"""
+    return build_notifications(current_user["username"])
+
+def sse_message(event: str, data: dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/api/notifications/stream")
+async def stream_notifications(request: Request, current_user: dict = Depends(get_stream_user)):
+    """Server-Sent Events stream of the user's notifications and waitlist promotions"""
     user_id = current_user["username"]
-    today = datetime.now().date()
-    today_str = today.strftime("%Y-%m-%d")
+    queue = notification_hub.subscribe(user_id)
     
-    # Get all timeslots where user has booked
-    user_bookings = [ts for ts in timeslots if user_id in ts.booked_by]
+    async def events():
+        try:
+            yield sse_message("notifications", await run_in_threadpool(build_notifications, user_id))
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=NOTIFICATION_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                # Several changes may have queued up; one refresh covers them all
+                queued = [event]
+                while not queue.empty():
+                    queued.append(queue.get_nowait())
+                for event in queued:
+                    if event["type"] == "promoted":
+                        yield sse_message("promoted", event)
+                if any(event["type"] != "promoted" for event in queued):
+                    yield sse_message("notifications", await run_in_threadpool(build_notifications, user_id))
+        finally:
+            notification_hub.unsubscribe(user_id, queue)
     
-    # Filter for events that are cancelled or rescheduled
-    cancelled_events = [ts for ts in user_bookings if ts.status and ts.status.lower() == "cancelled"]
-    rescheduled_events = [ts for ts in user_bookings if ts.status and ts.status.lower() == "rescheduled"]
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    for ts in user_bookings:
-        print(f"Event {ts.id} - Status: {ts.status}, Booked by: {ts.booked_by}")
+def build_notifications(user_id: str) -> dict:
+    """Build the notifications response for a user"""
+    # The store keeps each user's cancelled/rescheduled bookings up to date
+    digest = timeslots.notification_digest(user_id)
+    cancelled_entries = digest.cancelled if digest else []
+    rescheduled_entries = digest.rescheduled if digest else []
     
-    # Show all rescheduled events
-    future_rescheduled = rescheduled_events
+    cancelled_count = len(cancelled_entries)
+    rescheduled_count = len(rescheduled_entries)
     
-    cancelled_count = len(cancelled_events)
-    rescheduled_count = len(future_rescheduled)
+    # Only the first three events of each kind are described
+    cancelled_events = [timeslots.get(timeslot_id) for _, timeslot_id in cancelled_entries[:3]]
+    rescheduled_events = [timeslots.get(timeslot_id) for _, timeslot_id in rescheduled_entries[:3]]
     
     notifications = []
     if cancelled_count > 0:
         # Show details of cancelled events
         cancelled_details = []
-        for ts in cancelled_events[:3]:
+        for ts in filter(None, cancelled_events):
             category_name = ts.category.value if isinstance(ts.category, EventCategory) else str(ts.category)
             event_name = getattr(ts, 'name', 'Event')
             cancelled_details.append(f"'{event_name}' ({category_name}) on {ts.date}")
@@ -397,7 +1053,7 @@ def get_notifications(current_user: dict = Depends(get_current_user)):
     if rescheduled_count > 0:
         # Show details of rescheduled events
         rescheduled_details = []
-        for ts in future_rescheduled[:3]:
+        for ts in filter(None, rescheduled_events):
             category_name = ts.category.value if isinstance(ts.category, EventCategory) else str(ts.category)
             event_name = getattr(ts, 'name', 'Event')
             original_info = ""
@@ -420,6 +1076,12 @@ def get_notifications(current_user: dict = Depends(get_current_user)):
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    workers = int(os.getenv("WORKERS", 1))
+    if workers > 1:
+        # Workers are separate processes that share state through the database
+        os.environ["SHARED_STATE"] = "1"
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
 
 
@@ -0,0 +1,282 @@
+"""
+Metrics in the Prometheus text format, and sampled structured logging.
+
+Counters, gauges and histograms live in one registry rendered by
+``GET /metrics``. Recording is a dict lookup and a few additions under a
+lock, cheap enough for every request and every hot-path call:
+
+- MetricsMiddleware times each request under its route template (not the raw
+  path, so ids do not multiply series) and counts in-flight requests, status
+  codes and errors;
+- the password verifier, token decoding and the connection pool record
+  bcrypt, JWT and SQLite time;
+- gauges with a callback (store sizes, cache sizes) are read only when scraped.
+"""
+import logging
+import os
+import random
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Serve /metrics and time requests; off by default, as /metrics is unauthenticated
+METRICS = os.getenv("METRICS", "0").lower() in ("1", "true", "yes")
+# Fraction of bookings and unbookings logged (all are counted)
+BOOKING_LOG_SAMPLE = float(os.getenv("BOOKING_LOG_SAMPLE", 0.01))
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Iterable[str]) -> str:
+    pairs = ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+class Metric(ABC):
+    """A named family of series, one per combination of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """The exposition lines of every series"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in sorted(values)]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from `callback` when scraped
+
+    A callback returns either a number or, for labelled gauges, a dict of
+    label-value tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[Callable] = None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            value = self.callback()
+            values = list(value.items()) if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in sorted(values)]
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their count and sum"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), key + (le,))} {cumulative}")
+            labels = format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics rendered together by /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[Callable] = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route template", ("method", "route")
+)
+REQUESTS = registry.counter("http_requests_total", "Requests served, by route template and status", ("method", "route", "status"))
+REQUEST_ERRORS = registry.counter(
+    "http_request_errors_total", "Requests answered with a 5xx or an unhandled exception", ("method", "route")
+)
+IN_FLIGHT = registry.gauge("http_requests_in_flight", "Requests being served, notification streams included")
+BCRYPT_SECONDS = registry.histogram("password_verify_seconds", "Time to verify a password with bcrypt, queueing included")
+JWT_DECODE_SECONDS = registry.histogram(
+    "jwt_decode_seconds", "Time to decode and validate a JWT (cache misses only)",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+)
+DB_WAIT_SECONDS = registry.histogram("db_pool_wait_seconds", "Time waiting for a pooled SQLite connection")
+DB_SECONDS = registry.histogram("db_connection_seconds", "Time a pooled SQLite connection is held running queries")
+BOOKINGS = registry.counter("bookings_total", "Booking and unbooking attempts, by outcome", ("action", "outcome"))
+
+
+def log_sampled(logger: logging.Logger, rate: float, event: str, **fields):
+    """Log one line of `event` with its fields as key=value pairs, for a random `rate` of calls
+
+    The fields are also attached to the record (``record.fields``) for
+    structured handlers; ``sample`` tells readers how to scale counts.
+    """
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    fields["sample"] = rate
+    logger.info(
+        "%s %s", event, " ".join(f"{key}={value}" for key, value in fields.items()),
+        extra={"event": event, "fields": fields}
+    )
+
+
+# Endpoint function -> path template of its route
+_route_templates: Dict[Callable, str] = {}
+
+
+def route_template(scope) -> str:
+    """Path template of the route that matched a request, "unmatched" if none (yet)
+
+    The router fills in the matched endpoint on the request scope, so this
+    answers once the request has been routed.
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    template = _route_templates.get(endpoint)
+    if template is None:
+        template = "unmatched"
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                template = route.path
+                break
+        _route_templates[endpoint] = template
+    return template
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request under its route template
+
+    Unmatched paths share one label, so scanners cannot multiply series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status_code[0] = 500
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            IN_FLIGHT.dec()
+            method = scope["method"]
+            route = route_template(scope)
+            REQUEST_SECONDS.observe(elapsed, method, route)
+            REQUESTS.inc(method, route, str(status_code[0]))
+            if status_code[0] >= 500:
+                REQUEST_ERRORS.inc(method, route)
@@ -0,0 +1,75 @@
+from pydantic import BaseModel, field_validator
+from typing import List, Optional
+from enum import Enum
+from datetime import date, datetime
+
+# Enums
+class EventCategory(str, Enum):
+    CAT1 = "Music Festivals"
+    CAT2 = "Comedy Shows"
+    CAT3 = "Movies"
+    CAT4 = "Food Festivals"
+    CAT5 = "Art Exhibitions"
+    CAT6 = "Sports Events"
+    CAT7 = "Tech Conferences"
+    CAT8 = "Other"
+
+# Models
+class TimeSlot(BaseModel):
+    id: str
+    name: str  # Event name
+    category: EventCategory
+    date: str  # ISO format date string
+    start_time: str  # HH:MM format
+    end_time: str  # HH:MM format
+    booked_by: List[str] = []  # List of User IDs
+    capacity: int = 1  # Maximum number of seats
+    status: str = "active"  # "active", "cancelled", "rescheduled"
+    original_date: Optional[str] = None  # Original date if rescheduled
+    original_start_time: Optional[str] = None  # Original start time if rescheduled
+    original_end_time: Optional[str] = None  # Original end time if rescheduled
+
+class ScheduleInput(BaseModel):
+    """Checks for the inputs that carry a date, start_time and end_time"""
+
+    # The timeslot store keeps dates and times as integers, so they must parse.
+    # They are returned in canonical form, which the database and responses then share.
+    @field_validator("date", check_fields=False)
+    @classmethod
+    def check_date(cls, value: str) -> str:
+        return date.fromisoformat(value).isoformat()
+
+    @field_validator("start_time", "end_time", check_fields=False)
+    @classmethod
+    def check_time(cls, value: str) -> str:
+        return datetime.strptime(value, "%H:%M").strftime("%H:%M")
+
+class TimeSlotCreate(ScheduleInput):
+    name: str  # Event name
+    category: EventCategory
+    date: str
+    start_time: str
+    end_time: str
+    capacity: int = 1
+
+class TimeSlotReschedule(ScheduleInput):
+    date: str
+    start_time: str
+    end_time: str
+
+class TimeSlotIds(BaseModel):
+    ids: List[str]
+
+class TimeSlotBulkReschedule(TimeSlotReschedule):
+    ids: List[str]
+
+class TimeSlotBook(BaseModel):
+    user_id: str
+
+class UserPreferences(BaseModel):
+    user_id: str
+    categories: List[EventCategory]
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
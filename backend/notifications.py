@@ -0,0 +1,106 @@
+"""
+Notification state and delivery.
+
+NotificationDigest holds, per user, the booked events that need a
+notification. The timeslot store keeps digests up to date as bookings and
+statuses change, so building a user's notifications never scans the events.
+
+NotificationHub is an in-process pub/sub: each open
+``/api/notifications/stream`` connection subscribes a queue under its user
+id, and publishing touches only the queues of the users named in the event,
+so idle users and unaffected users cost nothing.
+"""
+import asyncio
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Event statuses that bookers are notified about
+NOTIFIED_STATUSES = ("cancelled", "rescheduled")
+
+# (creation sequence number, timeslot id): orders digest entries like the store
+DigestEntry = Tuple[int, str]
+
+# Events a slow client may fall behind by before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 32
+
+
+class NotificationDigest:
+    """A user's booked events that are cancelled or rescheduled, in creation order"""
+
+    __slots__ = ("cancelled", "rescheduled")
+
+    def __init__(self):
+        self.cancelled: List[DigestEntry] = []
+        self.rescheduled: List[DigestEntry] = []
+
+    def _entries(self, status: str) -> List[DigestEntry]:
+        return self.cancelled if status == "cancelled" else self.rescheduled
+
+    def add(self, status: str, entry: DigestEntry):
+        """File an event under one of NOTIFIED_STATUSES"""
+        insort(self._entries(status), entry)
+
+    def remove(self, status: str, entry: DigestEntry):
+        """Remove an event filed under `status`, if present"""
+        entries = self._entries(status)
+        i = bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def __bool__(self) -> bool:
+        return bool(self.cancelled or self.rescheduled)
+
+
+class NotificationHub:
+    """Fans events out to the asyncio queues subscribed for each user"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """Register a queue receiving the user's events; call from the event loop"""
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        """Remove a queue registered with subscribe"""
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def subscriber_count(self) -> int:
+        """Number of open subscriptions"""
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, user_ids: Iterable[str], event: dict):
+        """Send an event to every subscription of the given users
+
+        Safe to call from any thread; delivery happens on the event loop.
+        """
+        if self._loop is None:
+            return
+        user_ids = [user_id for user_id in user_ids if user_id in self._subscribers]
+        if not user_ids:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._deliver(user_ids, event)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, user_ids, event)
+
+    def _deliver(self, user_ids: Iterable[str], event: dict):
+        for user_id in user_ids:
+            for queue in self._subscribers.get(user_id, ()):
+                if queue.full():
+                    # Drop the oldest event rather than block the publisher
+                    queue.get_nowait()
+                queue.put_nowait(event)
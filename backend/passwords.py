@@ -0,0 +1,150 @@
+"""
+Password verification for the login endpoint.
+
+bcrypt is deliberately slow (hundreds of milliseconds of CPU per check), so
+verification runs in a bounded pool of worker processes instead of on the event loop,
+sheds load once too many logins are waiting, and remembers recently verified
+credentials for a short time so repeated logins skip bcrypt entirely.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import queue
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Optional
+from cache import TTLCache
+from metrics import BCRYPT_SECONDS
+
+# Number of processes verifying passwords in parallel
+LOGIN_WORKERS = int(os.getenv("LOGIN_WORKERS", os.cpu_count() or 1))
+# Logins allowed to wait for or run bcrypt before new ones are rejected with 503
+LOGIN_MAX_PENDING = int(os.getenv("LOGIN_MAX_PENDING", LOGIN_WORKERS * 16))
+# How long (seconds) and how many verified credentials are remembered
+CREDENTIAL_CACHE_TTL = int(os.getenv("CREDENTIAL_CACHE_TTL", 300))
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", 10000))
+
+# The worker processes run hashing.py as a script, which imports only passlib
+HASHING_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashing.py")
+
+
+class VerifierSaturated(Exception):
+    """Raised when the verification queue is full"""
+
+
+class VerifierUnavailable(Exception):
+    """Raised when a worker process died mid-verification; it is replaced for the next login"""
+
+
+class VerifierProcess:
+    """One worker process running hashing.py, answering one request at a time
+
+    Workers are started with fork+exec of a fresh interpreter, so they inherit
+    none of the server's threads or locks and never re-import its __main__.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, HASHING_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Blocks until the worker answers; raises VerifierUnavailable if it died"""
+        try:
+            self.process.stdin.write(json.dumps([plain_password, hashed_password]).encode() + b"\n")
+            self.process.stdin.flush()
+            answer = self.process.stdout.readline()
+        except (BrokenPipeError, ValueError):
+            answer = b""
+        if not answer:
+            raise VerifierUnavailable()
+        return answer == b"1\n"
+
+    def stop(self):
+        """Close the worker's input, which ends it, and reap it"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (BrokenPipeError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class PasswordVerifier:
+    """Verifies passwords in a pool of worker processes with backpressure and a result cache"""
+
+    def __init__(
+        self,
+        workers: int = LOGIN_WORKERS,
+        max_pending: int = LOGIN_MAX_PENDING,
+        cache_ttl: float = CREDENTIAL_CACHE_TTL,
+        cache_size: int = CREDENTIAL_CACHE_SIZE
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.cache = TTLCache(cache_size, cache_ttl)
+        # Per-process salt: cache keys are useless outside this process
+        self._salt = os.urandom(32)
+        # Idle worker processes, each lent to one of `workers` threads per verification
+        self._idle: "queue.Queue[VerifierProcess]" = queue.Queue()
+        self._threads: Optional[ThreadPoolExecutor] = None
+
+    def _cache_key(self, plain_password: str, hashed_password: str) -> bytes:
+        # The stored hash is part of the key, so a password change invalidates the entry
+        message = f"{hashed_password}\0{plain_password}".encode()
+        return hmac.new(self._salt, message, hashlib.sha256).digest()
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash without blocking the event loop
+
+        Raises VerifierSaturated when `max_pending` verifications are already queued
+        and VerifierUnavailable when the worker process died.
+        """
+        key = self._cache_key(plain_password, hashed_password)
+        if self.cache.get(key):
+            return True
+
+        if self.pending >= self.max_pending:
+            raise VerifierSaturated()
+        if self._threads is None:
+            for _ in range(self.workers):
+                self._idle.put(VerifierProcess())
+            self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-verifier")
+
+        self.pending += 1
+        start = perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            verified = await loop.run_in_executor(self._threads, self._verify, plain_password, hashed_password)
+        finally:
+            self.pending -= 1
+            BCRYPT_SECONDS.observe(perf_counter() - start)
+
+        if verified:
+            self.cache.set(key, True)
+        return verified
+
+    def _verify(self, plain_password: str, hashed_password: str) -> bool:
+        # Runs in one of the threads, which never outnumber the processes
+        process = self._idle.get()
+        try:
+            return process.verify(plain_password, hashed_password)
+        except VerifierUnavailable:
+            process.stop()
+            process = VerifierProcess()
+            raise
+        finally:
+            self._idle.put(process)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._threads is not None:
+            self._threads.shutdown(cancel_futures=True)
+            self._threads = None
+            while not self._idle.empty():
+                self._idle.get().stop()
@@ -0,0 +1,200 @@
+"""
+On-demand sampling profiler for live requests.
+
+``GET /api/admin/profile?seconds=10&rate=0.1`` profiles a random `rate` of
+the requests served during the window and returns their aggregated call
+stacks, or the same stacks in the collapsed format read by flamegraph.pl and
+speedscope (``format=collapsed``). No restart is needed, and while no window
+is open ProfilerMiddleware costs one attribute check per request.
+
+While a window is open, a sampler thread reads every thread's current stack
+(``sys._current_frames()``) every `interval` seconds and keeps the stacks
+that are serving a sampled request:
+
+- the middleware marks a sampled request by setting PROFILED_SCOPE, a context
+  variable, to its ASGI scope;
+- code running on the event loop has the middleware's frame below it, holding
+  the scope in its `profiled` local;
+- sync endpoints and dependencies run in anyio worker threads, which call
+  them through ``context.run`` with a copy of the request's context; the
+  `context` local of that frame tells whether the request was sampled, while
+  the function it runs is on the stack.
+
+Stacks are cut at those frames, so thread and event loop machinery does not
+show up, and rooted at the request's method and route template.
+"""
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from metrics import route_template
+
+# Scope of the request being profiled, None for requests that are not sampled
+PROFILED_SCOPE: contextvars.ContextVar = contextvars.ContextVar("profiled_scope", default=None)
+
+# Stacks and functions listed in the JSON report
+PROFILE_TOP = 50
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profiling window is already open"""
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    """Stacks sampled during one window, innermost frame last"""
+
+    def __init__(self, stacks: Counter, seconds: float, rate: float, interval: float, requests: int):
+        self.stacks = stacks
+        self.seconds = seconds
+        self.rate = rate
+        self.interval = interval
+        self.requests = requests
+
+    def collapsed(self) -> str:
+        """One `frame;frame;...;frame count` line per distinct stack"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def to_dict(self, top: int = PROFILE_TOP) -> dict:
+        routes: Counter = Counter()
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            routes[stack[0]] += count
+            if len(stack) > 1:
+                own[stack[-1]] += count
+            # A recursive function counts once per sample
+            for label in set(stack[1:]):
+                total[label] += count
+        return {
+            "seconds": round(self.seconds, 3),
+            "rate": self.rate,
+            "interval_ms": self.interval * 1000,
+            "requests_profiled": self.requests,
+            "samples": sum(self.stacks.values()),
+            "routes": dict(routes.most_common()),
+            "functions": [
+                {"function": label, "self": own[label], "total": count}
+                for label, count in total.most_common(top)
+            ],
+            "stacks": [{"stack": list(stack), "count": count} for stack, count in self.stacks.most_common(top)],
+        }
+
+
+class Profiler:
+    """Samples the stacks of profiled requests while a window is open"""
+
+    def __init__(self):
+        self.active = False
+        self.rate = 0.0
+        self.interval = 0.01
+        self.requests = 0
+        self._samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, rate: float, interval: float):
+        """Open a window profiling a `rate` fraction of requests, sampling every `interval` seconds
+
+        Raises ProfilerBusy if a window is already open.
+        """
+        with self._lock:
+            if self._thread is not None:
+                raise ProfilerBusy()
+            self.rate = rate
+            self.interval = interval
+            self.requests = 0
+            self._samples = Counter()
+            self._started = time.perf_counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+            self.active = True
+
+    def stop(self) -> Profile:
+        """Close the window and return what it sampled"""
+        with self._lock:
+            self.active = False
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        stacks: Counter = Counter()
+        labels: Dict[object, str] = {}
+        for (route, codes), count in self._samples.items():
+            for code in codes:
+                if code not in labels:
+                    labels[code] = frame_label(code)
+            stacks[(route,) + tuple(labels[code] for code in reversed(codes))] += count
+        return Profile(stacks, time.perf_counter() - self._started, self.rate, self.interval, self.requests)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                scope, codes = request_stack(frame)
+                if scope is not None and codes:
+                    self._samples[(f"{scope['method']} {route_template(scope)}", tuple(codes))] += 1
+
+
+def request_stack(frame) -> Tuple[Optional[dict], List]:
+    """The profiled request a thread is serving, if any, and its code objects above the request boundary
+
+    Code objects are listed innermost first.
+    """
+    codes = []
+    while frame is not None:
+        code = frame.f_code
+        if code is _MIDDLEWARE_CODE:
+            return frame.f_locals.get("profiled"), codes
+        if code.co_name == "run" and "context" in code.co_varnames:
+            local = frame.f_locals
+            context = local.get("context")
+            if isinstance(context, contextvars.Context):
+                # Idle workers keep their last item's locals: they serve it only while running its function
+                func = local.get("func")
+                func = getattr(func, "func", func)  # starlette wraps calls in functools.partial
+                if codes and codes[-1] is getattr(func, "__code__", None):
+                    return context.get(PROFILED_SCOPE), codes
+                return None, codes
+        codes.append(code)
+        frame = frame.f_back
+    return None, codes
+
+
+profiler = Profiler()
+
+
+class ProfilerMiddleware:
+    """ASGI middleware marking a random `profiler.rate` of requests for sampling"""
+
+    def __init__(self, app, profiler: Profiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler
+        if not profiler.active or scope["type"] != "http" or random.random() >= profiler.rate:
+            await self.app(scope, receive, send)
+            return
+        # Read by the sampler from this frame (event loop) and from copies of the context (worker threads)
+        profiled = scope
+        profiler.requests += 1
+        token = PROFILED_SCOPE.set(profiled)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            PROFILED_SCOPE.reset(token)
+
+
+_MIDDLEWARE_CODE = ProfilerMiddleware.__call__.__code__
@@ -0,0 +1,245 @@
+"""
+Compact in-memory representation of timeslots.
+
+The timeslot store keeps one EventRecord per event instead of a pydantic
+TimeSlot: dates are day ordinals, times are minutes since midnight, the
+category is a small int, and names, statuses and user ids are interned, so
+repeated values are stored once. TimeSlot models are only built when a
+timeslot leaves the store (EventRecord.to_model).
+
+A record's date and start time never change in place: rescheduling swaps in a
+new record, so the date index can tell stale entries by identity.
+"""
+import sys
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+from models import EventCategory, TimeSlot
+
+# (day ordinal, start minute, id): the order of the date index
+SortKey = Tuple[int, int, str]
+
+# (date, start, end, status, original date, original start, original end) in record form
+Schedule = Tuple[int, int, int, str, Optional[int], Optional[int], Optional[int]]
+
+# Categories by the small int stored in records
+CATEGORIES: Tuple[EventCategory, ...] = tuple(EventCategory)
+CATEGORY_CODES: Dict[EventCategory, int] = {category: code for code, category in enumerate(CATEGORIES)}
+
+# One int object per distinct day ordinal or minute, shared by every record using it
+_shared_ints: Dict[int, int] = {}
+
+
+def _share(value: int) -> int:
+    return _shared_ints.setdefault(value, value)
+
+
+def parse_date(value: str) -> int:
+    """Day ordinal of an ISO date string; raises ValueError if malformed"""
+    return _share(date.fromisoformat(value).toordinal())
+
+
+# ISO strings of the day ordinals seen so far, shared by every model built for that day
+_date_strings: Dict[int, str] = {}
+
+
+def format_date(ordinal: int) -> str:
+    """ISO date string of a day ordinal"""
+    text = _date_strings.get(ordinal)
+    if text is None:
+        text = _date_strings.setdefault(ordinal, date.fromordinal(ordinal).isoformat())
+    return text
+
+
+def parse_time(value: str) -> int:
+    """Minutes since midnight of an HH:MM string; raises ValueError if malformed"""
+    hours, minutes = value.split(":")
+    return _share(int(hours) * 60 + int(minutes))
+
+
+_time_strings = [f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in range(24 * 60 + 1)]
+
+
+def format_time(minutes: int) -> str:
+    """HH:MM string of minutes since midnight"""
+    if 0 <= minutes < len(_time_strings):
+        return _time_strings[minutes]
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def sort_key(timeslot: TimeSlot) -> SortKey:
+    """Ordering key used by the date index: (date, start_time, id)"""
+    return (parse_date(timeslot.date), parse_time(timeslot.start_time), timeslot.id)
+
+
+def _optional(parse, value: Optional[str]) -> Optional[int]:
+    return None if value is None else parse(value)
+
+
+def _optional_format(format, value: Optional[int]) -> Optional[str]:
+    return None if value is None else format(value)
+
+
+def parse_schedule(timeslot: TimeSlot) -> Schedule:
+    """The schedule and status of a timeslot in record form; raises ValueError if malformed"""
+    return (
+        parse_date(timeslot.date),
+        parse_time(timeslot.start_time),
+        parse_time(timeslot.end_time),
+        sys.intern(timeslot.status),
+        _optional(parse_date, timeslot.original_date),
+        _optional(parse_time, timeslot.original_start_time),
+        _optional(parse_time, timeslot.original_end_time),
+    )
+
+
+def format_schedule(schedule: Schedule) -> Tuple[Optional[str], ...]:
+    """The date, start_time, end_time, status and original_* columns of a parsed schedule"""
+    new_date, start, end, status, original_date, original_start, original_end = schedule
+    return (
+        format_date(new_date),
+        format_time(start),
+        format_time(end),
+        status,
+        _optional_format(format_date, original_date),
+        _optional_format(format_time, original_start),
+        _optional_format(format_time, original_end),
+    )
+
+
+class EventRecord:
+    """One timeslot as held by the store"""
+
+    __slots__ = (
+        "id", "name", "category", "date", "start", "end", "capacity", "status",
+        "original_date", "original_start", "original_end", "booked_by", "seq", "key", "version"
+    )
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        category: int,
+        date: int,
+        start: int,
+        end: int,
+        capacity: int,
+        status: str,
+        original_date: Optional[int],
+        original_start: Optional[int],
+        original_end: Optional[int],
+        booked_by: Tuple[str, ...],
+        seq: int
+    ):
+        self.id = id
+        self.name = sys.intern(name)
+        self.category = category
+        self.date = date
+        self.start = start
+        self.end = end
+        self.capacity = capacity
+        self.status = sys.intern(status)
+        self.original_date = original_date
+        self.original_start = original_start
+        self.original_end = original_end
+        # User ids in booking order; replaced, never mutated, when bookings change
+        self.booked_by = booked_by
+        # Creation order, used to order notification digests
+        self.seq = seq
+        self.key: SortKey = (date, start, id)
+        # Store version of the last change to this timeslot
+        self.version = 0
+
+    @classmethod
+    def from_model(cls, timeslot: TimeSlot, seq: int) -> "EventRecord":
+        """Record for a TimeSlot model; raises ValueError for malformed dates or times"""
+        return cls(
+            timeslot.id,
+            timeslot.name,
+            CATEGORY_CODES[EventCategory(timeslot.category)],
+            parse_date(timeslot.date),
+            parse_time(timeslot.start_time),
+            parse_time(timeslot.end_time),
+            timeslot.capacity,
+            timeslot.status,
+            _optional(parse_date, timeslot.original_date),
+            _optional(parse_time, timeslot.original_start_time),
+            _optional(parse_time, timeslot.original_end_time),
+            tuple(sys.intern(user_id) for user_id in timeslot.booked_by),
+            seq
+        )
+
+    def schedule(self) -> Schedule:
+        """The record's schedule and status, in the form parse_schedule returns"""
+        return (
+            self.date, self.start, self.end, self.status,
+            self.original_date, self.original_start, self.original_end
+        )
+
+    def updated(self, schedule: Schedule) -> "EventRecord":
+        """Apply a schedule and status from parse_schedule
+
+        Status-only changes are made in place; a new date or start time gives a
+        new record, which the caller swaps in.
+        """
+        new_date, new_start, end, status, original_date, original_start, original_end = schedule
+        if (new_date, new_start) == (self.date, self.start):
+            record = self
+        else:
+            record = EventRecord(
+                self.id, self.name, self.category, new_date, new_start, self.end, self.capacity,
+                self.status, self.original_date, self.original_start, self.original_end,
+                self.booked_by, self.seq
+            )
+            record.version = self.version
+        record.end = end
+        record.status = status
+        record.original_date = original_date
+        record.original_start = original_start
+        record.original_end = original_end
+        return record
+
+    def has_ended(self, now: datetime) -> bool:
+        """Whether the event's end time is before `now`"""
+        now_seconds = (now.toordinal() * 1440 + now.hour * 60 + now.minute) * 60 + now.second + now.microsecond / 1e6
+        return (self.date * 1440 + self.end) * 60 < now_seconds
+
+    def to_dict(self, fields: Optional[Iterable[str]] = None) -> dict:
+        """JSON-ready dict equal to the API's rendering of to_model()
+
+        `fields` projects it like the listings' `fields=` parameter, including `booked_count`.
+        """
+        values = {
+            "id": self.id,
+            "name": self.name,
+            "category": CATEGORIES[self.category].value,
+            "date": format_date(self.date),
+            "start_time": format_time(self.start),
+            "end_time": format_time(self.end),
+            "booked_by": list(self.booked_by),
+            "capacity": self.capacity,
+            "status": self.status,
+            "original_date": _optional_format(format_date, self.original_date),
+            "original_start_time": _optional_format(format_time, self.original_start),
+            "original_end_time": _optional_format(format_time, self.original_end),
+        }
+        if fields is None:
+            return values
+        values["booked_count"] = len(self.booked_by)
+        return {field: values[field] for field in fields}
+
+    def to_model(self) -> TimeSlot:
+        """The TimeSlot API model for this record"""
+        return TimeSlot(
+            id=self.id,
+            name=self.name,
+            category=CATEGORIES[self.category],
+            date=format_date(self.date),
+            start_time=format_time(self.start),
+            end_time=format_time(self.end),
+            booked_by=list(self.booked_by),
+            capacity=self.capacity,
+            status=self.status,
+            original_date=_optional_format(format_date, self.original_date),
+            original_start_time=_optional_format(format_time, self.original_start),
+            original_end_time=_optional_format(format_time, self.original_end)
+        )
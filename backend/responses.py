@@ -0,0 +1,39 @@
+"""
+Fast JSON responses for large payloads.
+
+FastAPI validates and re-encodes whatever an endpoint returns (pydantic
+models -> jsonable_encoder -> json.dumps), which for thousands of timeslots
+costs more CPU than fetching them. FastJSONResponse instead takes content
+that is already JSON-ready (dicts, lists, strings, numbers, None) and writes
+it straight to bytes, with orjson when it is installed and the standard
+library encoder otherwise. The bytes are the same compact JSON either way.
+
+It is opt-in: set FAST_JSON=1 to have the timeslot listings use it.
+"""
+import json
+import os
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional; pip install orjson
+    orjson = None
+
+# Serve the timeslot listings with FastJSONResponse
+FAST_JSON = os.getenv("FAST_JSON", "0").lower() in ("1", "true", "yes")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse for content that needs no validation or conversion"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
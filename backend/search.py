@@ -0,0 +1,342 @@
+"""
+Full-text search over event names.
+
+NameIndex is an inverted index from name tokens (lowercased words) to the
+sort keys ``(date, start_time, id)`` of the timeslots whose name contains
+them. Like the store's per-category date index, each token's keys are kept
+sorted in a compacted list and a small list of recent inserts, both never
+mutated once published, and removals only tombstone keys: a key is live
+while it is the `key` of its id's record. So a date range within one token
+is a bisect, and matches stream out in date order. A token of a single event
+(an id or a number in a name, say) keeps just its key.
+
+A query's words must all match, each either as a whole token or, failing
+that, as the prefix of one ("jazz ni" finds "Jazz Night"). Results are
+ranked in two tiers, events matching every word whole before those needing
+a prefix, and by date within a tier. Each tier walks the keys of the query
+word with the fewest candidates in date order, checks the other words
+against the event's own tokens and stops once `limit` results are found, so
+a query costs about O(log n + limit) for words that occur together.
+
+Words that never occur together would walk every key of the rarest one, so
+frequent tokens also count their events per distinct name, as long as they
+have few of them (event names repeat: "Jazz Night at Riverside" every week).
+Checking the query against those names first settles such queries without
+touching a key.
+"""
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from heapq import merge
+from itertools import islice
+from math import isqrt
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+from records import EventRecord, SortKey
+
+# Recent keys are merged into a token's compacted keys once they outnumber
+# max(RECENT_KEYS_MIN, sqrt(compacted)); tombstones are dropped once they
+# outnumber max(TOMBSTONES_MIN, a quarter of its keys)
+RECENT_KEYS_MIN = 64
+TOMBSTONES_MIN = 256
+
+# Tokens with at least NAME_COUNTS_MIN keys count their events per name, up
+# to NAME_COUNTS_MAX distinct names (past that, until their next compaction)
+NAME_COUNTS_MIN = 256
+NAME_COUNTS_MAX = 256
+
+# Words of a query beyond this many are ignored
+MAX_QUERY_TERMS = 8
+
+_WORD = re.compile(r"\w+")
+
+# (match tier, record): tier 0 matched every word whole, tier 1 needed a prefix
+SearchHit = Tuple[int, EventRecord]
+
+
+@lru_cache(maxsize=65536)
+def name_tokens(name: str) -> FrozenSet[str]:
+    """Distinct lowercased words of an event name
+
+    Names repeat a lot (and are interned), so tokenizing is cached per name.
+    """
+    return frozenset(_WORD.findall(name.casefold()))
+
+
+def query_terms(query: str) -> List[str]:
+    """Distinct lowercased words of a search query, in order"""
+    return list(dict.fromkeys(_WORD.findall(query.casefold())))[:MAX_QUERY_TERMS]
+
+
+def contains(tokens: List[str], token: str) -> bool:
+    i = bisect_left(tokens, token)
+    return i < len(tokens) and tokens[i] == token
+
+
+def is_live(key: SortKey, by_id: Dict[str, EventRecord]) -> bool:
+    record = by_id.get(key[2])
+    return record is not None and record.key is key
+
+
+def count_names(keys: Iterable[SortKey], by_id: Dict[str, EventRecord]) -> Optional[Dict[str, int]]:
+    """Events per name of the live `keys`, None past NAME_COUNTS_MAX names"""
+    counts: Dict[str, int] = {}
+    for key in keys:
+        record = by_id.get(key[2])
+        if record is not None and record.key is key:
+            counts[record.name] = counts.get(record.name, 0) + 1
+            if len(counts) > NAME_COUNTS_MAX:
+                return None
+    return counts
+
+
+class NameIndex:
+    """Token -> sort keys of the timeslots whose names contain it
+
+    Writers call `index` (before publishing the records in `added`) and then
+    `compact`, serialized by the caller; readers need no lock.
+    """
+
+    def __init__(self):
+        # Per token: (compacted keys, recent keys), both sorted, or the key of its only event
+        self._postings: Dict[str, Tuple[List[SortKey], List[SortKey]]] = {}
+        self._single: Dict[str, SortKey] = {}
+        # Tokens with tombstoned keys only
+        self._tombstones: Dict[str, int] = {}
+        # Per frequent token: events per name, None if it has too many names
+        self._names: Dict[str, Optional[Dict[str, int]]] = {}
+        self._uncounted: List[EventRecord] = []
+        # Every indexed token (and a few no longer indexed) for prefix lookups,
+        # as (compacted, recent) sorted lists; replaced, never mutated
+        self._vocabulary: Tuple[List[str], List[str]] = ([], [])
+
+    @classmethod
+    def build(cls, keys: Iterable[SortKey], by_id: Dict[str, EventRecord]) -> "NameIndex":
+        """Index the records of `by_id`, given all their keys in sorted order"""
+        index = cls()
+        postings: Dict[str, List[SortKey]] = {}
+        # Tokenized here rather than through name_tokens' cache, which every distinct name would churn
+        tokens_of: Dict[str, FrozenSet[str]] = {}
+        for key in keys:
+            name = by_id[key[2]].name
+            tokens = tokens_of.get(name)
+            if tokens is None:
+                tokens = tokens_of[name] = name_tokens.__wrapped__(name)
+            for token in tokens:
+                keys_with_token = postings.get(token)
+                if keys_with_token is None:
+                    postings[token] = [key]
+                else:
+                    keys_with_token.append(key)
+        for token, token_keys in postings.items():
+            if len(token_keys) == 1:
+                index._single[token] = token_keys[0]
+            else:
+                index._postings[token] = (token_keys, [])
+                if len(token_keys) >= NAME_COUNTS_MIN:
+                    index._names[token] = count_names(token_keys, by_id)
+        index._vocabulary = (sorted(postings), [])
+        return index
+
+    def index(self, removed: Iterable[EventRecord] = (), added: Iterable[EventRecord] = ()) -> Set[str]:
+        """Tombstone the keys of `removed` and publish those of `added`; returns the touched tokens"""
+        touched: Set[str] = set()
+        for record in removed:
+            for token in name_tokens(record.name):
+                self._tombstones[token] = self._tombstones.get(token, 0) + 1
+                touched.add(token)
+            # Uncounted by compact, once the records replacing it are published
+            self._uncounted.append(record)
+        inserted: Dict[str, List[SortKey]] = {}
+        for record in added:
+            for token in name_tokens(record.name):
+                inserted.setdefault(token, []).append(record.key)
+                counts = self._names.get(token)
+                if counts is not None:
+                    counts[record.name] = counts.get(record.name, 0) + 1
+                    if len(counts) > NAME_COUNTS_MAX:
+                        self._names[token] = None
+        new_tokens = []
+        for token, new_keys in inserted.items():
+            new_keys.sort()
+            postings = self._postings.get(token)
+            if postings is not None:
+                compacted, recent = postings
+                self._postings[token] = (compacted, list(merge(recent, new_keys)))
+            elif token in self._single:
+                # Published before the single key goes, so readers always find it
+                self._postings[token] = ([self._single[token]], new_keys)
+                del self._single[token]
+            elif len(new_keys) == 1:
+                self._single[token] = new_keys[0]
+                new_tokens.append(token)
+            else:
+                self._postings[token] = (new_keys, [])
+                new_tokens.append(token)
+            touched.add(token)
+        compacted, recent = self._vocabulary
+        new_tokens = [token for token in new_tokens
+                      if not contains(compacted, token) and not contains(recent, token)]
+        if new_tokens:
+            new_tokens.sort()
+            self._vocabulary = (compacted, list(merge(recent, new_tokens)))
+        return touched
+
+    def compact(self, tokens: Iterable[str], by_id: Dict[str, EventRecord]):
+        """Compact the touched tokens whose recent keys or tombstones grew too many
+
+        Call once the added records are published, so their keys count as live.
+        """
+        for record in self._uncounted:
+            for token in name_tokens(record.name):
+                counts = self._names.get(token)
+                if counts is not None:
+                    count = counts.get(record.name, 0)
+                    if count > 1:
+                        counts[record.name] = count - 1
+                    else:
+                        counts.pop(record.name, None)
+        self._uncounted = []
+        for token in tokens:
+            tombstones = self._tombstones.get(token, 0)
+            postings = self._postings.get(token)
+            if postings is None:
+                key = self._single.get(token)
+                if key is not None and tombstones and not is_live(key, by_id):
+                    del self._single[token]
+                    del self._tombstones[token]
+                continue
+            compacted, recent = postings
+            recount = token not in self._names
+            if (len(recent) > max(RECENT_KEYS_MIN, isqrt(len(compacted)))
+                    or tombstones > max(TOMBSTONES_MIN, (len(compacted) + len(recent)) // 4)):
+                compacted, recent = [key for key in merge(compacted, recent) if is_live(key, by_id)], []
+                self._tombstones.pop(token, None)
+                recount = True
+                if len(compacted) > 1:
+                    self._postings[token] = (compacted, recent)
+                elif compacted:
+                    self._single[token] = compacted[0]
+                    del self._postings[token]
+                else:
+                    del self._postings[token]
+            if len(compacted) + len(recent) < NAME_COUNTS_MIN:
+                self._names.pop(token, None)
+            elif recount:
+                self._names[token] = count_names(merge(compacted, recent), by_id)
+
+        compacted, recent = self._vocabulary
+        if (len(recent) > max(RECENT_KEYS_MIN, isqrt(len(compacted)))
+                or len(compacted) + len(recent) - len(self) > max(TOMBSTONES_MIN, len(self) // 4)):
+            self._vocabulary = ([token for token in merge(compacted, recent)
+                                 if token in self._postings or token in self._single], [])
+
+    def __len__(self) -> int:
+        """Number of distinct tokens"""
+        return len(self._postings) + len(self._single)
+
+    def _expand(self, term: str) -> List[str]:
+        """Tokens starting with `term`, maybe some no longer indexed"""
+        tokens = []
+        for vocabulary in self._vocabulary:
+            for i in range(bisect_left(vocabulary, term), len(vocabulary)):
+                if not vocabulary[i].startswith(term):
+                    break
+                tokens.append(vocabulary[i])
+        return tokens
+
+    def _keys(self, tokens: Iterable[str], start: Optional[int], stop: Optional[int]) -> Tuple[int, Iterator[SortKey]]:
+        """Keys of `tokens` within [start, stop) in order, possibly repeated, and how many there are"""
+        ranges = []
+        count = 0
+        for token in tokens:
+            key = self._single.get(token)
+            postings = ((key,),) if key is not None else self._postings.get(token, ())
+            for keys in postings:
+                lo = bisect_left(keys, (start,)) if start is not None else 0
+                hi = bisect_left(keys, (stop,)) if stop is not None else len(keys)
+                if lo < hi:
+                    count += hi - lo
+                    ranges.append(map(keys.__getitem__, range(lo, hi)))
+        return count, merge(*ranges)
+
+    def _names_of(self, tokens: Iterable[str], by_id: Dict[str, EventRecord]) -> Optional[List[str]]:
+        """Names of the events with any of `tokens` (and maybe a few more)
+
+        None if some token does not count them, or they are more than NAME_COUNTS_MAX.
+        """
+        names = []
+        for token in tokens:
+            if len(names) > NAME_COUNTS_MAX:
+                return None
+            key = self._single.get(token)
+            if key is not None:
+                record = by_id.get(key[2])
+                if record is not None:
+                    names.append(record.name)
+                continue
+            counts = self._names.get(token)
+            if counts is None:
+                if token in self._postings:
+                    return None
+                continue  # no longer indexed
+            # list() copies in one step, while the writer may be changing counts
+            names.extend(list(counts))
+        return names
+
+    def search(
+        self,
+        query: str,
+        by_id: Dict[str, EventRecord],
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        categories: Optional[Set[int]] = None,
+        limit: int = 20
+    ) -> List[SearchHit]:
+        """Up to `limit` timeslots whose names match every word of `query`, best first
+
+        `start` and `stop` bound the day ordinals ([start, stop)) and `categories`
+        holds category codes. Records must be treated as read-only.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+
+        def matches(tier: int, groups: List[List[str]], check: Callable[[FrozenSet[str]], bool]) -> Iterator[SearchHit]:
+            # The names some word occurs in, when its tokens count them, settle which names can match
+            allowed = None
+            for tokens in groups:
+                names = self._names_of(tokens, by_id)
+                if names is not None and (allowed is None or len(names) < len(allowed)):
+                    allowed = names
+            if allowed is not None:
+                allowed = {name for name in allowed if check(name_tokens(name))}
+                if not allowed:
+                    return
+            # Walk the rarest word's keys; the others are checked against each event's tokens
+            _, driver = min((self._keys(tokens, start, stop) for tokens in groups), key=lambda keys: keys[0])
+            seen = set()
+            for key in driver:
+                record = by_id.get(key[2])
+                if record is None or record.key is not key:
+                    continue  # tombstone
+                if categories is not None and record.category not in categories:
+                    continue
+                if record.id in seen:
+                    continue  # the same event under two tokens sharing the prefix
+                if check(name_tokens(record.name)) if allowed is None else record.name in allowed:
+                    seen.add(record.id)
+                    yield tier, record
+
+        hits = list(islice(
+            matches(0, [[term] for term in terms], lambda tokens: all(term in tokens for term in terms)),
+            limit
+        ))
+        if len(hits) < limit:
+            # Every whole-word match is in; add the ones that need a prefix
+            def needs_prefix(tokens: FrozenSet[str]) -> bool:
+                if all(term in tokens for term in terms):
+                    return False
+                return all(term in tokens or any(token.startswith(term) for token in tokens) for term in terms)
+
+            hits.extend(islice(matches(1, [self._expand(term) for term in terms], needs_prefix), limit - len(hits)))
+        return hits
@@ -0,0 +1,190 @@
+"""
+State shared between worker processes.
+
+Each uvicorn worker keeps its own in-memory copies (the timeslot store, user
+preferences), with SQLite as the source of truth. With SHARED_STATE on, every
+write transaction also appends a row per changed key to the ``changes``
+table, and each worker's ChangeFeed replays rows written since it last looked:
+
+- ``PRAGMA data_version`` on a dedicated connection tells, in microseconds and
+  without reading any table, whether another connection has committed, so an
+  idle feed costs one pragma per poll;
+- the feed reads the new rows in sequence order and hands each kind of key
+  (``timeslot``, ``preferences``) to the handler registered for it, which
+  reloads just those keys from the database.
+
+Rows are sequenced by the single SQLite writer, so every worker applies the
+same changes in the same order and the sequence number is a version that all
+workers agree on.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Keep workers' in-memory state in sync through the changes table
+SHARED_STATE = os.getenv("SHARED_STATE", "0").lower() in ("1", "true", "yes")
+# Seconds between background polls, which catch changes on workers that get no requests
+SHARED_POLL_INTERVAL = float(os.getenv("SHARED_POLL_INTERVAL", 0.5))
+# Rows kept in the changes table; a worker further behind reloads everything
+CHANGES_RETENTION = 100000
+
+# Identifies this process's rows in the changes table
+ORIGIN = uuid.uuid4().hex
+
+# (sequence number, key, written by this process)
+Change = Tuple[int, str, bool]
+
+
+def record_changes(conn: sqlite3.Connection, kind: str, keys: Iterable[str]):
+    """Log changed keys inside the caller's write transaction"""
+    conn.executemany(
+        "INSERT INTO changes (kind, key, origin) VALUES (?, ?, ?)",
+        [(kind, key, ORIGIN) for key in keys]
+    )
+
+
+def last_change(conn: sqlite3.Connection) -> int:
+    """Sequence number of the newest change row, 0 if none"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+
+class ChangeFeed:
+    """Replays rows of the changes table written since the last poll
+
+    Handlers are called as handler(changes) with the kind's changes in sequence
+    order, rows written by this process included, so that each handler can
+    advance its version. When rows this worker has not seen were pruned,
+    `on_resync` is called instead and should reload everything.
+    """
+
+    def __init__(self, interval: float = SHARED_POLL_INTERVAL):
+        self.interval = interval
+        self._handlers: Dict[str, Callable[[List[Change]], None]] = {}
+        self._resync_handlers: List[Callable[[], None]] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._seq = 0
+        self._pruned = 0
+        # Serializes polls; changes are applied in order by one thread at a time
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, kind: str, handler: Callable[[List[Change]], None]):
+        """Call `handler` with the changes of `kind` found by each poll"""
+        self._handlers[kind] = handler
+
+    def on_resync(self, handler: Callable[[], None]):
+        """Call `handler` when the feed fell too far behind to replay changes"""
+        self._resync_handlers.append(handler)
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the last change applied"""
+        return self._seq
+
+    def start(self, seq: int):
+        """Start following changes after `seq`, the last change reflected in loaded state"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = get_db_connection()
+            self._seq = self._pruned = seq
+            self._data_version = None
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background poll and close the feed's connection"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def changed(self) -> bool:
+        """Whether any connection may have committed since the last poll
+
+        Never waits: while another thread polls, the answer is True, and the
+        caller's poll then waits for that one, off the event loop.
+        """
+        if not self._lock.acquire(blocking=False):
+            return True
+        try:
+            if self._conn is None:
+                return False
+            return self._conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version
+        finally:
+            self._lock.release()
+
+    def poll(self):
+        """Apply every change committed since the last poll"""
+        with self._lock:
+            if self._conn is None:
+                return
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+            rows = self._conn.execute(
+                "SELECT seq, kind, key, origin FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)
+            ).fetchall()
+            if not rows:
+                return
+            # Sequence numbers have no gaps, except where old rows were pruned
+            if rows[0]["seq"] > self._seq + 1:
+                self._seq = rows[-1]["seq"]
+                for handler in self._resync_handlers:
+                    handler()
+                return
+            by_kind: Dict[str, List[Change]] = {}
+            for row in rows:
+                by_kind.setdefault(row["kind"], []).append((row["seq"], row["key"], row["origin"] == ORIGIN))
+            for kind, changes in by_kind.items():
+                handler = self._handlers.get(kind)
+                if handler is not None:
+                    handler(changes)
+            self._seq = rows[-1]["seq"]
+            if self._seq - self._pruned >= CHANGES_RETENTION:
+                # Workers more than CHANGES_RETENTION behind will resync
+                with self._conn:
+                    self._conn.execute("DELETE FROM changes WHERE seq <= ?", (self._seq - CHANGES_RETENTION,))
+                self._pruned = self._seq
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                logger.warning("Change feed poll failed: %s", e)
+
+
+change_feed = ChangeFeed()
+
+
+class ChangeFeedMiddleware:
+    """ASGI middleware catching up with other workers' writes before each request
+
+    Requests therefore see every write committed before they arrived, whichever
+    worker made it. The check is one pragma; replaying runs in the threadpool.
+    """
+
+    def __init__(self, app, feed: ChangeFeed = change_feed):
+        self.app = app
+        self.feed = feed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.feed.changed():
+            await run_in_threadpool(self.feed.poll)
+        await self.app(scope, receive, send)
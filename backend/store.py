@@ -0,0 +1,1115 @@
+"""
+Timeslot repository.
+
+Timeslots and bookings are persisted in the SQLite ``timeslots`` and
+``bookings`` tables and kept in an in-process cache keyed by timeslot id,
+so lookups never have to walk the full list of events. The cache holds
+compact EventRecords (see records.py); TimeSlot models are built only for
+the timeslots a method returns.
+
+Each category also keeps ``(date, start_time, id)`` keys sorted by date, so a
+date-range query is a bisect plus a slice per category. The keys live in a
+large compacted list and a small list of recent inserts; both are immutable
+once published, so a reader holding them sees a consistent snapshot while
+writers carry on. Deleting or rescheduling a timeslot only tombstones its old
+key (O(1)); a category is compacted into a fresh list once its recent inserts
+or tombstones grow past a threshold. The words of event names are indexed
+the same way, per word instead of per category, for search (search.py).
+
+Bookings are serialized per timeslot (striped locks) and the database only
+accepts a booking while the slot has free seats, so a slot is never overbooked.
+Cancelling and rescheduling take the same locks and write only the columns
+they change, so concurrent admin changes to one event never undo each other.
+
+Every change bumps a store version, recorded globally, per date and per
+timeslot, so readers can tell cheaply whether anything they showed changed.
+The last CHANGE_LOG_SIZE changes are also kept in a bounded log of (version,
+timeslot id, deleted), so a client holding version N can fetch just what
+changed since N (changes_since).
+
+Per-day counters of events, and of events with free seats, per category are
+adjusted on every change, so a month's calendar summary reads at most 31
+days of counters whatever the number of events (day_counts).
+
+With a ChangeFeed (shared.py), the store is one of several workers' copies
+of the database: writes only commit, logging the changed ids to the shared
+``changes`` table, and every copy, the writer's included, applies changes by
+reloading those ids from the database in the feed's order (apply_changes).
+Versions are then the feed's sequence numbers, the same in every worker.
+
+Every booking or status change also updates the affected users' notification
+digests, so reading a user's notifications is O(1), and a reverse index from
+user to booked timeslot ids answers "what has this user booked" without
+looking at anyone else's events.
+
+Users can wait for a seat in a full timeslot (``waitlist`` table, and a
+Waitlist per timeslot in memory, see waitlist.py). Releasing a seat hands it
+to the first waiter in the same transaction, so a freed seat never goes to
+whoever retries fastest, and a user -> waited-for timeslot ids index lists a
+user's places in line.
+"""
+import base64
+import json
+import sqlite3
+import sys
+import threading
+import os
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack
+from datetime import datetime
+from collections import deque
+from heapq import merge
+from itertools import islice
+from math import isqrt
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from database import pool
+from models import EventCategory, TimeSlot
+from notifications import NOTIFIED_STATUSES, NotificationDigest
+from shared import Change, ChangeFeed, last_change, record_changes
+from search import NameIndex, SearchHit
+from waitlist import Waitlist
+from records import (
+    CATEGORIES, CATEGORY_CODES, EventRecord, Schedule, SortKey, format_date, format_schedule, format_time,
+    parse_date, parse_schedule, parse_time
+)
+
+# Number of striped locks serializing bookings; timeslots hash onto them
+BOOKING_LOCK_STRIPES = 64
+
+# A category's recent inserts are merged into its compacted keys once they
+# outnumber max(RECENT_KEYS_MIN, sqrt(compacted)), and its tombstones are
+# dropped once they outnumber max(TOMBSTONES_MIN, a quarter of its keys)
+RECENT_KEYS_MIN = 256
+TOMBSTONES_MIN = 1024
+
+# Ids reloaded per query when applying changes from other workers
+APPLY_CHUNK_IDS = 500
+
+# Date ranges spanning more days than this are versioned by the global version
+DATE_VERSION_SPAN_MAX = 366
+
+# Changes kept for delta sync; clients further behind get a full snapshot
+CHANGE_LOG_SIZE = int(os.getenv("CHANGE_LOG_SIZE", "10000"))
+
+# Inserts the booking only while the timeslot has a free seat
+BOOK_QUERY = """
+    INSERT INTO bookings (timeslot_id, user_id, booked_at)
+    SELECT ?, ?, ?
+    WHERE (SELECT COUNT(*) FROM bookings WHERE timeslot_id = ?)
+        < (SELECT capacity FROM timeslots WHERE id = ?)
+"""
+
+# First in line for a timeslot's next free seat
+NEXT_WAITER_QUERY = "SELECT id, user_id FROM waitlist WHERE timeslot_id = ? ORDER BY id LIMIT 1"
+
+CANCEL_QUERY = "UPDATE timeslots SET status = 'cancelled' WHERE id = ?"
+
+# Moves a timeslot, keeping its first schedule in original_* (right-hand sides read the old row)
+RESCHEDULE_QUERY = """
+    UPDATE timeslots
+    SET original_date = COALESCE(original_date, date),
+        original_start_time = CASE WHEN original_date IS NULL THEN start_time ELSE original_start_time END,
+        original_end_time = CASE WHEN original_date IS NULL THEN end_time ELSE original_end_time END,
+        date = ?, start_time = ?, end_time = ?, status = 'rescheduled'
+    WHERE id = ?
+"""
+
+
+class BookingError(Exception):
+    """Base class for bookings the store refuses"""
+
+
+class TimeslotNotFound(BookingError):
+    """No timeslot has the given id"""
+
+
+class TimeslotCancelled(BookingError):
+    """The timeslot has been cancelled"""
+
+
+class TimeslotEnded(BookingError):
+    """The timeslot has already ended"""
+
+
+class AlreadyBooked(BookingError):
+    """The user already holds a seat"""
+
+
+class TimeslotFull(BookingError):
+    """Every seat is taken"""
+
+
+class NotBooked(BookingError):
+    """The user holds no seat to release"""
+
+
+class AlreadyWaiting(BookingError):
+    """The user is already on the waitlist"""
+
+
+class NotWaiting(BookingError):
+    """The user is not on the waitlist"""
+
+
+def encode_cursor(key: SortKey) -> str:
+    """Opaque pagination cursor pointing just past `key`"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> SortKey:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not (isinstance(key, list) and len(key) == 3
+            and type(key[0]) is int and type(key[1]) is int and isinstance(key[2], str)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+class TimeslotStore:
+    """Write-through cache of timeslots backed by SQLite"""
+
+    def __init__(self, feed: Optional[ChangeFeed] = None):
+        # Shared mode: writes are applied when the feed replays them
+        self._feed = feed
+        # A key in the date index is live only while it is the `key` of its id's record
+        self._by_id: Dict[str, EventRecord] = {}
+        # Per category: (compacted keys, recent keys), both sorted and never mutated once published
+        self._date_index: Dict[EventCategory, Tuple[List[SortKey], List[SortKey]]] = {
+            category: ([], []) for category in EventCategory
+        }
+        self._tombstones: Dict[EventCategory, int] = dict.fromkeys(EventCategory, 0)
+        # Name token -> keys, for search; maintained with the date index
+        self._names = NameIndex()
+        self._user_bookings: Dict[str, Set[str]] = {}
+        # Waitlists of the timeslots users wait for, changed under the timeslot's booking lock
+        self._waitlists: Dict[str, Waitlist] = {}
+        self._user_waits: Dict[str, Set[str]] = {}
+        self._user_lock = threading.Lock()
+        self._booking_locks = [threading.Lock() for _ in range(BOOKING_LOCK_STRIPES)]
+        self._index_lock = threading.Lock()
+        self._next_seq = 0
+        # Status that the bookers of each cancelled/rescheduled timeslot are notified about
+        self._notified: Dict[str, str] = {}
+        self._digests: Dict[str, NotificationDigest] = {}
+        self._digest_lock = threading.Lock()
+        # Per day ordinal: (events, events with free seats) per category code
+        self._day_counts: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._day_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._reset_versions()
+
+    def _reset_versions(self, base: Optional[int] = None):
+        # Versions start from the clock, so they never repeat across restarts
+        self._base_version = time.time_ns() // 1000 if base is None else base
+        self._version = self._base_version
+        # Version of the last change to each date (day ordinal) changed since the base
+        self._date_versions: Dict[int, int] = {}
+        # (version, timeslot id, deleted) of recent changes, oldest first
+        self._changes: deque = deque(maxlen=CHANGE_LOG_SIZE)
+        # Changes up to this version may have left the log
+        self._changes_floor = self._base_version
+
+    def _bump(self, timeslot_ids: Iterable[str], dates: Iterable[int], deleted: bool = False) -> int:
+        """Record a change to `timeslot_ids`, dated `dates`, and return its version
+
+        Call after the change is visible, so a reader never pairs a new version with old data.
+        """
+        with self._version_lock:
+            self._version += 1
+            self._record_change(self._version, timeslot_ids, dates, deleted)
+            return self._version
+
+    def _record_change(self, version: int, timeslot_ids: Iterable[str], dates: Iterable[int], deleted: bool):
+        """Stamp dates with `version` and append to the change log; call holding _version_lock"""
+        timeslot_ids = list(timeslot_ids)
+        for day in dates:
+            self._date_versions[day] = version
+        changes = self._changes
+        overflow = len(changes) + len(timeslot_ids) - changes.maxlen
+        if overflow > 0:
+            self._changes_floor = changes[overflow - 1][0] if overflow <= len(changes) else version
+        changes.extend((version, timeslot_id, deleted) for timeslot_id in timeslot_ids)
+
+    @property
+    def version(self) -> int:
+        """Version of the last change to any timeslot"""
+        return self._version
+
+    def advance(self, version: Optional[int] = None) -> int:
+        """Issue a version for a change outside the store that changes what clients see
+
+        Without `version` the next version is taken; in shared mode pass the
+        change's sequence number. No timeslot is logged as changed. Returns the
+        version that marks the change.
+        """
+        with self._version_lock:
+            self._version = self._version + 1 if version is None else max(self._version, version)
+            return self._version if version is None else version
+
+    def version_for_dates(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
+        """Version of the last change to a timeslot dated within an inclusive range
+
+        Open or very long ranges get the global version. Raises ValueError for
+        dates that are not ISO formatted.
+        """
+        if not start_date or not end_date:
+            return self._version
+        start, stop = parse_date(start_date), parse_date(end_date)
+        if stop - start > DATE_VERSION_SPAN_MAX:
+            return self._version
+        date_versions = self._date_versions
+        return max([self._base_version] + [date_versions.get(day, 0) for day in range(start, stop + 1)])
+
+    def changes_since(self, since: int) -> Optional[Tuple[int, List[EventRecord], List[str]]]:
+        """Timeslots changed after version `since`: (version, upserted records, deleted ids)
+
+        Returns None when changes after `since` are no longer in the log, or `since`
+        is unknown, in which case the caller needs a full snapshot. Records reflect at least the returned
+        version and must be treated as read-only; a timeslot deleted after that
+        version is reported as deleted.
+        """
+        with self._version_lock:
+            version = self._version
+            # A version from before the log or not issued by this store (e.g. another database)
+            if since < self._changes_floor or since > version:
+                return None
+            latest: Dict[str, bool] = {}
+            for change_version, timeslot_id, deleted in reversed(self._changes):
+                if change_version <= since:
+                    break
+                latest.setdefault(timeslot_id, deleted)
+        upserts: List[EventRecord] = []
+        deletions: List[str] = []
+        for timeslot_id, deleted in reversed(latest.items()):
+            record = None if deleted else self._by_id.get(timeslot_id)
+            if record is None:
+                deletions.append(timeslot_id)
+            else:
+                upserts.append(record)
+        return version, upserts, deletions
+
+    def timeslot_version(self, timeslot_id: str) -> Optional[int]:
+        """Version of the last change to a timeslot, or None if it does not exist"""
+        record = self._by_id.get(timeslot_id)
+        return None if record is None else record.version
+
+    def load(self):
+        """Load all timeslots and bookings from the database into the cache"""
+        with pool.connection() as conn:
+            # Read first: changes racing the load are replayed again, which is harmless
+            base = last_change(conn) if self._feed is not None else None
+            timeslot_rows = conn.execute("SELECT * FROM timeslots ORDER BY rowid").fetchall()
+            booking_rows = conn.execute("SELECT timeslot_id, user_id FROM bookings ORDER BY id").fetchall()
+            waitlist_rows = conn.execute("SELECT timeslot_id, user_id FROM waitlist ORDER BY id").fetchall()
+
+        booked: Dict[str, List[str]] = {}
+        for row in booking_rows:
+            booked.setdefault(row["timeslot_id"], []).append(sys.intern(row["user_id"]))
+        waiting: Dict[str, List[str]] = {}
+        for row in waitlist_rows:
+            waiting.setdefault(row["timeslot_id"], []).append(sys.intern(row["user_id"]))
+
+        by_id: Dict[str, EventRecord] = {}
+        for seq, row in enumerate(timeslot_rows):
+            by_id[row["id"]] = self._record_from_row(row, booked.get(row["id"], ()), seq)
+
+        self._by_id = by_id
+        self._user_bookings = {}
+        for record in by_id.values():
+            for user_id in record.booked_by:
+                self._user_bookings.setdefault(user_id, set()).add(record.id)
+        self._waitlists = {timeslot_id: Waitlist(user_ids) for timeslot_id, user_ids in waiting.items()}
+        self._user_waits = {}
+        for timeslot_id, user_ids in waiting.items():
+            for user_id in user_ids:
+                self._user_waits.setdefault(user_id, set()).add(timeslot_id)
+        self._next_seq = len(by_id)
+        self._notified = {}
+        self._digests = {}
+        for record in by_id.values():
+            self._sync_notifications(record)
+        date_index: Dict[EventCategory, List[SortKey]] = {category: [] for category in EventCategory}
+        for record in by_id.values():
+            date_index[CATEGORIES[record.category]].append(record.key)
+        for keys in date_index.values():
+            keys.sort()
+        self._date_index = {category: (keys, []) for category, keys in date_index.items()}
+        self._tombstones = dict.fromkeys(EventCategory, 0)
+        self._names = NameIndex.build(merge(*date_index.values()), by_id)
+        self._day_counts = {}
+        for record in by_id.values():
+            self._count(record, 1)
+        self._reset_versions(base)
+        for record in by_id.values():
+            record.version = self._base_version
+
+    @staticmethod
+    def _record_from_row(row: sqlite3.Row, booked_by: Iterable[str], seq: int) -> EventRecord:
+        return EventRecord(
+            row["id"],
+            row["name"],
+            CATEGORY_CODES[EventCategory(row["category"])],
+            parse_date(row["date"]),
+            parse_time(row["start_time"]),
+            parse_time(row["end_time"]),
+            row["capacity"],
+            row["status"],
+            parse_date(row["original_date"]) if row["original_date"] else None,
+            parse_time(row["original_start_time"]) if row["original_start_time"] else None,
+            parse_time(row["original_end_time"]) if row["original_end_time"] else None,
+            tuple(booked_by),
+            seq
+        )
+
+    def _reindex(self, removed: Iterable[EventRecord] = (), added: Iterable[EventRecord] = ()):
+        """Tombstone the index keys of `removed` and index and publish the records in `added`
+
+        A rescheduled timeslot passes its old record in `removed` and its new one in
+        `added`. Touched categories get new (compacted, recent) lists, so readers
+        never see a list change under them.
+        """
+        with self._index_lock:
+            inserted: Dict[EventCategory, List[SortKey]] = {}
+            for record in removed:
+                category = CATEGORIES[record.category]
+                self._tombstones[category] += 1
+                inserted.setdefault(category, [])
+            for record in added:
+                inserted.setdefault(CATEGORIES[record.category], []).append(record.key)
+
+            # Publish the new keys before their records, so they never point at nothing
+            for category, new_keys in inserted.items():
+                if new_keys:
+                    compacted, recent = self._date_index[category]
+                    new_keys.sort()
+                    self._date_index[category] = (compacted, list(merge(recent, new_keys)))
+            tokens = self._names.index(removed, added)
+            for record in added:
+                self._by_id[record.id] = record
+
+            by_id = self._by_id
+            self._names.compact(tokens, by_id)
+            for category in inserted:
+                compacted, recent = self._date_index[category]
+                if (len(recent) > max(RECENT_KEYS_MIN, isqrt(len(compacted)))
+                        or self._tombstones[category] > max(TOMBSTONES_MIN, (len(compacted) + len(recent)) // 4)):
+                    compacted = [key for key in merge(compacted, recent)
+                                 if getattr(by_id.get(key[2]), "key", None) is key]
+                    self._date_index[category] = (compacted, [])
+                    self._tombstones[category] = 0
+
+    def _booking_lock(self, timeslot_id: str) -> threading.Lock:
+        return self._booking_locks[hash(timeslot_id) % BOOKING_LOCK_STRIPES]
+
+    def _hold_booking_locks(self, timeslot_ids: Iterable[str]) -> ExitStack:
+        """Context manager holding the booking locks of several timeslots
+
+        Stripes are taken in index order, so two holders never deadlock.
+        """
+        stack = ExitStack()
+        for stripe in sorted({hash(timeslot_id) % BOOKING_LOCK_STRIPES for timeslot_id in timeslot_ids}):
+            stack.enter_context(self._booking_locks[stripe])
+        return stack
+
+    def _add_user_booking(self, user_id: str, timeslot_id: str):
+        self._link(self._user_bookings, user_id, timeslot_id)
+
+    def _remove_user_booking(self, user_id: str, timeslot_id: str):
+        self._unlink(self._user_bookings, user_id, timeslot_id)
+
+    def _link(self, index: Dict[str, Set[str]], user_id: str, timeslot_id: str):
+        """Add a timeslot to a user's entry in a user -> timeslot ids index"""
+        with self._user_lock:
+            index.setdefault(user_id, set()).add(timeslot_id)
+
+    def _unlink(self, index: Dict[str, Set[str]], user_id: str, timeslot_id: str):
+        """Remove a timeslot from a user's entry in a user -> timeslot ids index"""
+        with self._user_lock:
+            timeslot_ids = index.get(user_id)
+            if timeslot_ids is not None:
+                timeslot_ids.discard(timeslot_id)
+                if not timeslot_ids:
+                    del index[user_id]
+
+    def _enqueue(self, timeslot_id: str, user_id: str) -> int:
+        """Put a user at the end of a timeslot's line; call holding its booking lock"""
+        waitlist = self._waitlists.get(timeslot_id)
+        if waitlist is None:
+            waitlist = self._waitlists[timeslot_id] = Waitlist()
+        position = waitlist.join(user_id)
+        self._link(self._user_waits, user_id, timeslot_id)
+        return position
+
+    def _dequeue(self, timeslot_id: str, user_id: str):
+        """Take a user out of a timeslot's line, if there; call holding its booking lock"""
+        waitlist = self._waitlists.get(timeslot_id)
+        if waitlist is not None and waitlist.leave(user_id):
+            if not waitlist:
+                del self._waitlists[timeslot_id]
+            self._unlink(self._user_waits, user_id, timeslot_id)
+
+    def _refile(self, record: EventRecord, user_ids: Iterable[str], old_status: Optional[str], new_status: Optional[str]):
+        """Move a timeslot between the given users' digest lists"""
+        entry = (record.seq, record.id)
+        with self._digest_lock:
+            for user_id in user_ids:
+                if old_status is not None:
+                    digest = self._digests.get(user_id)
+                    if digest is not None:
+                        digest.remove(old_status, entry)
+                        if not digest:
+                            del self._digests[user_id]
+                if new_status is not None:
+                    self._digests.setdefault(user_id, NotificationDigest()).add(new_status, entry)
+
+    def _count(self, record: EventRecord, sign: int):
+        """Add (sign 1) or remove (sign -1) a record's contribution to its day's counters"""
+        with self._day_lock:
+            counts = self._day_counts.get(record.date)
+            if counts is None:
+                counts = self._day_counts[record.date] = ([0] * len(CATEGORIES), [0] * len(CATEGORIES))
+            events, available = counts
+            events[record.category] += sign
+            if record.status.lower() != "cancelled" and len(record.booked_by) < record.capacity:
+                available[record.category] += sign
+            if not any(events):
+                del self._day_counts[record.date]
+
+    def _sync_notifications(self, record: EventRecord):
+        """Refile a timeslot's bookers after its status may have changed"""
+        status = record.status.lower() if record.status else None
+        new_status = status if status in NOTIFIED_STATUSES else None
+        old_status = self._notified.get(record.id)
+        if new_status == old_status:
+            return
+        self._refile(record, record.booked_by, old_status, new_status)
+        if new_status is None:
+            del self._notified[record.id]
+        else:
+            self._notified[record.id] = new_status
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Sizes of the in-memory structures, for monitoring"""
+        with self._user_lock:
+            bookings = sum(len(booked) for booked in self._user_bookings.values())
+            users = len(self._user_bookings)
+            waiting = sum(len(waited) for waited in self._user_waits.values())
+        return {
+            "timeslots": len(self._by_id),
+            "bookings": bookings,
+            "users_with_bookings": users,
+            "waitlisted": waiting,
+            "index_tombstones": sum(self._tombstones.values()),
+            "notified_users": len(self._digests),
+            "change_log": len(self._changes),
+            "name_tokens": len(self._names),
+        }
+
+    def bookings_for(self, user_id: str) -> List[TimeSlot]:
+        """Timeslots booked by a user, ordered by (date, start_time, id)"""
+        by_id = self._by_id
+        booked = [by_id[timeslot_id] for timeslot_id in list(self._user_bookings.get(user_id, ())) if timeslot_id in by_id]
+        booked.sort(key=lambda record: record.key)
+        return [record.to_model() for record in booked]
+
+    def notification_digest(self, user_id: str) -> Optional[NotificationDigest]:
+        """The user's booked events that are cancelled or rescheduled, if any"""
+        return self._digests.get(user_id)
+
+    def waitlist_position(self, timeslot_id: str, user_id: str) -> Optional[int]:
+        """The user's place in the timeslot's line (1 is next), None if not waiting"""
+        with self._booking_lock(timeslot_id):
+            waitlist = self._waitlists.get(timeslot_id)
+            return None if waitlist is None else waitlist.position(user_id)
+
+    def waitlist_length(self, timeslot_id: str) -> int:
+        """Number of users waiting for a seat in the timeslot"""
+        return len(self._waitlists.get(timeslot_id, ()))
+
+    def waitlist_for(self, user_id: str) -> List[Tuple[TimeSlot, int]]:
+        """(timeslot, place in line) for every timeslot the user waits for, ordered by (date, start_time, id)"""
+        by_id = self._by_id
+        waiting = []
+        for timeslot_id in list(self._user_waits.get(user_id, ())):
+            record = by_id.get(timeslot_id)
+            position = self.waitlist_position(timeslot_id, user_id)
+            if record is not None and position is not None:
+                waiting.append((record, position))
+        waiting.sort(key=lambda entry: entry[0].key)
+        return [(record.to_model(), position) for record, position in waiting]
+
+    def day_counts(
+        self,
+        start_date: str,
+        end_date: str,
+        categories: Optional[Set[EventCategory]] = None
+    ) -> List[Tuple[str, Dict[EventCategory, int], int]]:
+        """(date, events per category, events with free seats) for every day of an inclusive range
+
+        Only categories with events are listed. Cancelled events count as events
+        but never as having free seats. Raises ValueError for malformed dates.
+        """
+        start, stop = parse_date(start_date), parse_date(end_date)
+        codes = range(len(CATEGORIES)) if categories is None else sorted(CATEGORY_CODES[c] for c in categories)
+        days = []
+        with self._day_lock:
+            for day in range(start, stop + 1):
+                counts = self._day_counts.get(day)
+                if counts is None:
+                    days.append((format_date(day), {}, 0))
+                    continue
+                events, available = counts
+                days.append((
+                    format_date(day),
+                    {CATEGORIES[code]: events[code] for code in codes if events[code]},
+                    sum(available[code] for code in codes)
+                ))
+        return days
+
+    def get(self, timeslot_id: str) -> Optional[TimeSlot]:
+        """Get a timeslot by id"""
+        record = self._by_id.get(timeslot_id)
+        return None if record is None else record.to_model()
+
+    def all(self) -> List[TimeSlot]:
+        """Get all timeslots in creation order"""
+        return [record.to_model() for record in list(self._by_id.values())]
+
+    def query(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        categories: Optional[Set[EventCategory]] = None,
+        after: Optional[SortKey] = None,
+        limit: Optional[int] = None
+    ) -> List[TimeSlot]:
+        """Get timeslots within an inclusive date range, ordered by (date, start_time, id)
+
+        `after` skips everything up to and including that key, and `limit` caps the
+        number of results, so a page costs O(log n + limit) however large the range.
+        Raises ValueError for dates that are not ISO formatted.
+        """
+        return [record.to_model() for record in self.query_records(start_date, end_date, categories, after, limit)]
+
+    def query_records(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        categories: Optional[Set[EventCategory]] = None,
+        after: Optional[SortKey] = None,
+        limit: Optional[int] = None
+    ) -> List[EventRecord]:
+        """Like query, but returns the records themselves, for rendering without models
+
+        Callers must treat the records as read-only.
+        """
+        start = parse_date(start_date) if start_date else None
+        # The day after `end_date` sorts after every key on that date
+        stop = parse_date(end_date) + 1 if end_date else None
+        if categories is None:
+            categories = self._date_index.keys()
+        ranges = []
+        for category in categories:
+            for keys in self._date_index[category]:
+                lo = bisect_left(keys, (start,)) if start is not None else 0
+                if after is not None:
+                    lo = max(lo, bisect_right(keys, after))
+                hi = bisect_left(keys, (stop,)) if stop is not None else len(keys)
+                if lo < hi:
+                    # Lazily, so a page only walks the keys it needs
+                    ranges.append(map(keys.__getitem__, range(lo, hi)))
+        by_id = self._by_id
+        # Skip tombstones: keys that are no longer their record's key
+        records = (record for record, key in ((by_id.get(key[2]), key) for key in merge(*ranges))
+                   if record is not None and record.key is key)
+        if limit is not None:
+            records = islice(records, limit)
+        return list(records)
+
+    def search(
+        self,
+        query: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        categories: Optional[Set[EventCategory]] = None,
+        limit: int = 20
+    ) -> List[SearchHit]:
+        """Up to `limit` (tier, record) pairs for the timeslots whose names match `query`, best first
+
+        Whole-word matches (tier 0) come before prefix matches (tier 1), each in
+        (date, start_time, id) order; see search.py. Raises ValueError for dates
+        that are not ISO formatted. Callers must treat the records as read-only.
+        """
+        start = parse_date(start_date) if start_date else None
+        stop = parse_date(end_date) + 1 if end_date else None
+        codes = {CATEGORY_CODES[category] for category in categories} if categories is not None else None
+        return self._names.search(query, self._by_id, start, stop, codes, limit)
+
+    def add(self, timeslot: TimeSlot):
+        """Persist a new timeslot"""
+        self.add_many([timeslot])
+
+    def add_many(self, timeslots: Iterable[TimeSlot]):
+        """Persist several new timeslots in a single transaction
+
+        Raises ValueError, before writing anything, if a date or time is malformed.
+        """
+        timeslots = list(timeslots)
+        with self._index_lock:
+            first_seq = self._next_seq
+            self._next_seq += len(timeslots)
+        records = [EventRecord.from_model(ts, first_seq + i) for i, ts in enumerate(timeslots)]
+        created_at = datetime.now().isoformat()
+        with pool.connection() as conn, conn:
+            conn.executemany('''
+                INSERT INTO timeslots (id, name, category, date, start_time, end_time, capacity,
+                                       status, original_date, original_start_time, original_end_time, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (ts.id, ts.name, ts.category.value, ts.date, ts.start_time, ts.end_time, ts.capacity,
+                 ts.status, ts.original_date, ts.original_start_time, ts.original_end_time, created_at)
+                for ts in timeslots
+            ])
+            if self._feed is not None:
+                record_changes(conn, "timeslot", [ts.id for ts in timeslots])
+        if self._feed is not None:
+            self._feed.poll()
+            return
+        for record in records:
+            for user_id in record.booked_by:
+                self._add_user_booking(user_id, record.id)
+            self._sync_notifications(record)
+            self._count(record, 1)
+        self._reindex(added=records)
+        version = self._bump([record.id for record in records], {record.date for record in records})
+        for record in records:
+            record.version = version
+
+    def update(self, timeslot: TimeSlot):
+        """Persist changes to the schedule or status of a cached timeslot"""
+        self.update_many([timeslot])
+
+    def update_many(self, timeslots: Iterable[TimeSlot]):
+        """Persist schedule or status changes of several cached timeslots in a single transaction
+
+        A timeslot whose date or start time changed gets a new record, so concurrent
+        readers never see an event whose date disagrees with its place in the index.
+        Raises ValueError, writing nothing, if a date or time is malformed.
+        """
+        # Parse everything before writing, so a malformed value changes nothing
+        schedules = [(ts.id, parse_schedule(ts)) for ts in timeslots]
+        with pool.connection() as conn, conn:
+            conn.executemany('''
+                UPDATE timeslots
+                SET date = ?, start_time = ?, end_time = ?, status = ?,
+                    original_date = ?, original_start_time = ?, original_end_time = ?
+                WHERE id = ?
+            ''', [format_schedule(schedule) + (timeslot_id,) for timeslot_id, schedule in schedules])
+            if self._feed is not None:
+                record_changes(conn, "timeslot", [timeslot_id for timeslot_id, _ in schedules])
+        if self._feed is not None:
+            self._feed.poll()
+            return
+        for timeslot_id, schedule in schedules:
+            with self._booking_lock(timeslot_id):
+                record = self._by_id.get(timeslot_id)
+                if record is not None:  # else deleted concurrently
+                    self._apply_schedule(record, schedule)
+
+    def _apply_schedule(self, record: EventRecord, schedule: Schedule):
+        """Give a cached timeslot a new schedule and status; call holding its booking lock"""
+        self._count(record, -1)
+        updated = record.updated(schedule)
+        self._count(updated, 1)
+        if updated is not record:
+            self._reindex(removed=(record,), added=(updated,))
+        self._sync_notifications(updated)
+        updated.version = self._bump((record.id,), (record.date, updated.date))
+
+    def cancel(self, timeslot_id: str) -> Optional[TimeSlot]:
+        """Cancel a timeslot; returns it, or None if there is no such timeslot"""
+        cancelled = self.cancel_many([timeslot_id])
+        return cancelled[0] if cancelled else None
+
+    def cancel_many(self, timeslot_ids: Iterable[str]) -> List[TimeSlot]:
+        """Cancel several timeslots in a single transaction
+
+        Returns the cancelled timeslots; unknown ids are skipped.
+        """
+        def cancelled(schedule: Schedule) -> Schedule:
+            return schedule[:3] + ("cancelled",) + schedule[4:]
+
+        return self._change_many(timeslot_ids, CANCEL_QUERY, (), cancelled)
+
+    def reschedule(self, timeslot_id: str, new_date: str, start_time: str, end_time: str) -> Optional[TimeSlot]:
+        """Move a timeslot; returns it, or None if there is no such timeslot"""
+        rescheduled = self.reschedule_many([timeslot_id], new_date, start_time, end_time)
+        return rescheduled[0] if rescheduled else None
+
+    def reschedule_many(
+        self, timeslot_ids: Iterable[str], new_date: str, start_time: str, end_time: str
+    ) -> List[TimeSlot]:
+        """Move several timeslots to one date and time in a single transaction
+
+        A timeslot's first schedule is kept in its original_* fields. Returns the
+        rescheduled timeslots; unknown ids are skipped. Raises ValueError,
+        writing nothing, if the date or a time is malformed.
+        """
+        day, start, end = parse_date(new_date), parse_time(start_time), parse_time(end_time)
+
+        def rescheduled(schedule: Schedule) -> Schedule:
+            old_date, old_start, old_end, _, original_date, original_start, original_end = schedule
+            if original_date is None:
+                original_date, original_start, original_end = old_date, old_start, old_end
+            return (day, start, end, "rescheduled", original_date, original_start, original_end)
+
+        params = (format_date(day), format_time(start), format_time(end))
+        return self._change_many(timeslot_ids, RESCHEDULE_QUERY, params, rescheduled)
+
+    def _change_many(
+        self, timeslot_ids: Iterable[str], query: str, params: tuple, change: Callable[[Schedule], Schedule]
+    ) -> List[TimeSlot]:
+        """Run `query` with `params` and the id for each timeslot, in one transaction
+
+        Holds the timeslots' booking locks throughout, so each change applies to the
+        current state of its timeslot; `change` maps a record's schedule to the one
+        the query writes. Returns the changed timeslots, skipping unknown ids.
+        """
+        timeslot_ids = list(dict.fromkeys(timeslot_ids))
+        with self._hold_booking_locks(timeslot_ids):
+            with pool.connection() as conn, conn:
+                changed = [
+                    timeslot_id for timeslot_id in timeslot_ids
+                    if conn.execute(query, params + (timeslot_id,)).rowcount
+                ]
+                if self._feed is not None:
+                    record_changes(conn, "timeslot", changed)
+            if self._feed is None:
+                records = [self._by_id[timeslot_id] for timeslot_id in changed if timeslot_id in self._by_id]
+                for record in records:
+                    self._apply_schedule(record, change(record.schedule()))
+                return [self._by_id[record.id].to_model() for record in records]
+        self._feed.poll()
+        return [ts for ts in map(self.get, changed) if ts is not None]
+
+    def delete(self, timeslot_id: str):
+        """Delete a timeslot and its bookings"""
+        self.delete_many([timeslot_id])
+
+    def delete_many(self, timeslot_ids: Iterable[str]):
+        """Delete several timeslots and their bookings in a single transaction"""
+        params = [(timeslot_id,) for timeslot_id in timeslot_ids]
+        with pool.connection() as conn, conn:
+            conn.executemany("DELETE FROM bookings WHERE timeslot_id = ?", params)
+            conn.executemany("DELETE FROM waitlist WHERE timeslot_id = ?", params)
+            conn.executemany("DELETE FROM timeslots WHERE id = ?", params)
+            if self._feed is not None:
+                record_changes(conn, "timeslot", [timeslot_id for (timeslot_id,) in params])
+        if self._feed is not None:
+            self._feed.poll()
+            return
+        for (timeslot_id,) in params:
+            with self._booking_lock(timeslot_id):
+                record = self._by_id.pop(timeslot_id, None)
+                if record is None:
+                    continue  # unknown or deleted concurrently
+                for user_id in record.booked_by:
+                    self._remove_user_booking(user_id, timeslot_id)
+                for user_id in self._waitlists.pop(timeslot_id, ()):
+                    self._unlink(self._user_waits, user_id, timeslot_id)
+                self._refile(record, record.booked_by, self._notified.pop(timeslot_id, None), None)
+                self._count(record, -1)
+                self._reindex(removed=(record,))
+                self._bump((timeslot_id,), (record.date,), deleted=True)
+
+    def book(self, timeslot_id: str, user_id: str) -> TimeSlot:
+        """Atomically give the user a seat in the timeslot and return the booked timeslot
+
+        Raises a BookingError subclass when the timeslot does not exist, is
+        cancelled or over, or is already booked by the user or full.
+        """
+        with self._booking_lock(timeslot_id):
+            record = self._bookable(timeslot_id, user_id)
+            if len(record.booked_by) >= record.capacity:
+                raise TimeslotFull()
+            self._take_seat(record, user_id)
+            if self._feed is None:
+                return record.to_model()
+        # Shared mode: the feed applies the booking, taking the booking lock itself
+        self._feed.poll()
+        return self._by_id.get(timeslot_id, record).to_model()
+
+    def _bookable(self, timeslot_id: str, user_id: str) -> EventRecord:
+        """The timeslot's record, if the user could take a seat in it were one free
+
+        Raises TimeslotNotFound, TimeslotCancelled, TimeslotEnded or AlreadyBooked otherwise.
+        """
+        record = self._by_id.get(timeslot_id)
+        if record is None:
+            raise TimeslotNotFound()
+        if record.status == "cancelled":
+            raise TimeslotCancelled()
+        if record.has_ended(datetime.now()):
+            raise TimeslotEnded()
+        if user_id in record.booked_by:
+            raise AlreadyBooked()
+        return record
+
+    def _take_seat(self, record: EventRecord, user_id: str):
+        """Book a seat for the user; call holding the timeslot's booking lock
+
+        Raises AlreadyBooked or TimeslotFull when the database refuses the booking.
+        """
+        timeslot_id = record.id
+        # The database re-checks capacity, which also covers other processes
+        with pool.connection() as conn, conn:
+            try:
+                cursor = conn.execute(BOOK_QUERY, (
+                    timeslot_id, user_id, datetime.now().isoformat(), timeslot_id, timeslot_id
+                ))
+            except sqlite3.IntegrityError:
+                raise AlreadyBooked()
+            if cursor.rowcount == 0:
+                raise TimeslotFull()
+            if self._feed is not None:
+                record_changes(conn, "timeslot", (timeslot_id,))
+        if self._feed is None:
+            user_id = sys.intern(user_id)
+            self._count(record, -1)
+            record.booked_by += (user_id,)
+            self._count(record, 1)
+            self._add_user_booking(user_id, timeslot_id)
+            self._refile(record, (user_id,), None, self._notified.get(timeslot_id))
+            record.version = self._bump((timeslot_id,), (record.date,))
+
+    def unbook(self, timeslot_id: str, user_id: str) -> Optional[str]:
+        """Atomically release the user's seat and give it to the first user on the waitlist
+
+        Returns the promoted user, if any; nobody is promoted into a cancelled or
+        ended timeslot. Raises TimeslotNotFound for an unknown timeslot and
+        NotBooked if the user holds no seat.
+        """
+        with self._booking_lock(timeslot_id):
+            record = self._by_id.get(timeslot_id)
+            if record is None:
+                raise TimeslotNotFound()
+            if user_id not in record.booked_by:
+                raise NotBooked()
+            promoted, dropped = None, []
+            with pool.connection() as conn, conn:
+                cursor = conn.execute(
+                    "DELETE FROM bookings WHERE timeslot_id = ? AND user_id = ?",
+                    (timeslot_id, user_id)
+                )
+                if cursor.rowcount == 0:
+                    raise NotBooked()  # released by another worker
+                if record.status != "cancelled" and not record.has_ended(datetime.now()):
+                    promoted, dropped = self._promote(conn, timeslot_id)
+                if self._feed is not None:
+                    record_changes(conn, "timeslot", (timeslot_id,))
+            if self._feed is None:
+                notified = self._notified.get(timeslot_id)
+                booked_by = tuple(booker for booker in record.booked_by if booker != user_id)
+                self._count(record, -1)
+                record.booked_by = booked_by if promoted is None else booked_by + (promoted,)
+                self._count(record, 1)
+                self._remove_user_booking(user_id, timeslot_id)
+                self._refile(record, (user_id,), notified, None)
+                for waiter in dropped:
+                    self._dequeue(timeslot_id, waiter)
+                if promoted is not None:
+                    self._dequeue(timeslot_id, promoted)
+                    self._add_user_booking(promoted, timeslot_id)
+                    self._refile(record, (promoted,), None, notified)
+                record.version = self._bump((timeslot_id,), (record.date,))
+                return promoted
+        self._feed.poll()
+        return promoted
+
+    @staticmethod
+    def _promote(conn: sqlite3.Connection, timeslot_id: str) -> Tuple[Optional[str], List[str]]:
+        """Book the freed seat for the first waiter, inside the caller's transaction
+
+        Returns the promoted user, if any, and the waiters taken out of line
+        because they hold a seat already.
+        """
+        dropped = []
+        while True:
+            waiter = conn.execute(NEXT_WAITER_QUERY, (timeslot_id,)).fetchone()
+            if waiter is None:
+                return None, dropped
+            user_id = sys.intern(waiter["user_id"])
+            try:
+                cursor = conn.execute(BOOK_QUERY, (
+                    timeslot_id, user_id, datetime.now().isoformat(), timeslot_id, timeslot_id
+                ))
+            except sqlite3.IntegrityError:
+                cursor = None
+            if cursor is not None and cursor.rowcount == 0:
+                return None, dropped  # still full
+            conn.execute("DELETE FROM waitlist WHERE id = ?", (waiter["id"],))
+            if cursor is not None:
+                return user_id, dropped
+            dropped.append(user_id)
+
+    def join_waitlist(self, timeslot_id: str, user_id: str) -> int:
+        """Put the user at the end of the timeslot's waitlist and return their place in line (1 is next)
+
+        If the timeslot has a free seat and nobody is waiting, the user gets the
+        seat instead and 0 is returned. Raises a BookingError subclass when the
+        timeslot does not exist, is cancelled or over, or the user already holds
+        a seat or waits for one.
+        """
+        with self._booking_lock(timeslot_id):
+            record = self._bookable(timeslot_id, user_id)
+            waitlist = self._waitlists.get(timeslot_id)
+            if waitlist is not None and user_id in waitlist:
+                raise AlreadyWaiting()
+            booked = False
+            if not waitlist and len(record.booked_by) < record.capacity:
+                try:
+                    self._take_seat(record, user_id)
+                    booked = True
+                except TimeslotFull:
+                    pass  # taken by another worker: wait for the next one
+            if not booked:
+                with pool.connection() as conn, conn:
+                    try:
+                        conn.execute(
+                            "INSERT INTO waitlist (timeslot_id, user_id, joined_at) VALUES (?, ?, ?)",
+                            (timeslot_id, user_id, datetime.now().isoformat())
+                        )
+                    except sqlite3.IntegrityError:
+                        raise AlreadyWaiting()  # joined through another worker
+                    if self._feed is not None:
+                        record_changes(conn, "timeslot", (timeslot_id,))
+            if self._feed is None:
+                return 0 if booked else self._enqueue(timeslot_id, sys.intern(user_id))
+        self._feed.poll()
+        # Promoted already if no longer waiting
+        return self.waitlist_position(timeslot_id, user_id) or 0
+
+    def leave_waitlist(self, timeslot_id: str, user_id: str):
+        """Take the user off the timeslot's waitlist
+
+        Raises NotWaiting if the user is not on it.
+        """
+        with self._booking_lock(timeslot_id):
+            waitlist = self._waitlists.get(timeslot_id)
+            if waitlist is None or user_id not in waitlist:
+                raise NotWaiting()
+            with pool.connection() as conn, conn:
+                cursor = conn.execute(
+                    "DELETE FROM waitlist WHERE timeslot_id = ? AND user_id = ?",
+                    (timeslot_id, user_id)
+                )
+                if cursor.rowcount == 0:
+                    raise NotWaiting()  # promoted or left through another worker
+                if self._feed is not None:
+                    record_changes(conn, "timeslot", (timeslot_id,))
+            if self._feed is None:
+                self._dequeue(timeslot_id, user_id)
+                return
+        self._feed.poll()
+
+    def apply_changes(
+        self, changes: List[Change]
+    ) -> List[Tuple[Optional[EventRecord], Optional[EventRecord], List[str]]]:
+        """Reload timeslots named by a ChangeFeed from the database
+
+        Each changed id is re-read with its bookings and waitlist and swapped in,
+        and versions advance to the changes' sequence numbers once all are
+        visible. Returns (old record, new record, promoted users) for the changes
+        written by other processes, None standing for a missing timeslot, where
+        promoted users left the waitlist for a seat; the records must be treated
+        as read-only.
+        """
+        latest: Dict[str, int] = {}
+        for seq, timeslot_id, _ in changes:
+            latest[timeslot_id] = seq
+        remote = {timeslot_id for _, timeslot_id, own in changes if not own}
+        ids = sorted(latest, key=latest.get)
+
+        rows: Dict[str, sqlite3.Row] = {}
+        booked: Dict[str, List[str]] = {}
+        waiting: Dict[str, List[str]] = {}
+        with pool.connection() as conn:
+            for i in range(0, len(ids), APPLY_CHUNK_IDS):
+                chunk = ids[i:i + APPLY_CHUNK_IDS]
+                marks = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT * FROM timeslots WHERE id IN ({marks})", chunk):
+                    rows[row["id"]] = row
+                for row in conn.execute(
+                    f"SELECT timeslot_id, user_id FROM bookings WHERE timeslot_id IN ({marks}) ORDER BY id", chunk
+                ):
+                    booked.setdefault(row["timeslot_id"], []).append(sys.intern(row["user_id"]))
+                for row in conn.execute(
+                    f"SELECT timeslot_id, user_id FROM waitlist WHERE timeslot_id IN ({marks}) ORDER BY id", chunk
+                ):
+                    waiting.setdefault(row["timeslot_id"], []).append(sys.intern(row["user_id"]))
+
+        applied = []
+        transitions = []
+        for timeslot_id in ids:
+            with self._booking_lock(timeslot_id):
+                old = self._by_id.get(timeslot_id)
+                row = rows.get(timeslot_id)
+                new = None
+                if row is not None:
+                    if old is None:
+                        with self._index_lock:
+                            seq = self._next_seq
+                            self._next_seq += 1
+                    else:
+                        seq = old.seq
+                    new = self._record_from_row(row, booked.get(timeslot_id, ()), seq)
+                    new.version = latest[timeslot_id]
+                if old is not None:
+                    for user_id in old.booked_by:
+                        self._remove_user_booking(user_id, timeslot_id)
+                    self._refile(old, old.booked_by, self._notified.pop(timeslot_id, None), None)
+                    self._count(old, -1)
+                if new is not None:
+                    for user_id in new.booked_by:
+                        self._add_user_booking(user_id, timeslot_id)
+                    self._sync_notifications(new)
+                    self._count(new, 1)
+                if old is not None and new is not None and (new.key, new.category) == (old.key, old.category):
+                    # Same place in the index (e.g. a booking): keep the indexed key
+                    new.key = old.key
+                    self._by_id[timeslot_id] = new
+                else:
+                    if new is None:
+                        self._by_id.pop(timeslot_id, None)
+                    self._reindex(removed=(old,) if old else (), added=(new,) if new else ())
+
+                old_waiters = list(self._waitlists.pop(timeslot_id, ()))
+                for user_id in old_waiters:
+                    self._unlink(self._user_waits, user_id, timeslot_id)
+                new_waiters = waiting.get(timeslot_id, []) if new is not None else []
+                if new_waiters:
+                    self._waitlists[timeslot_id] = Waitlist(new_waiters)
+                    for user_id in new_waiters:
+                        self._link(self._user_waits, user_id, timeslot_id)
+                promoted = [] if new is None else [
+                    user_id for user_id in old_waiters
+                    if user_id in new.booked_by and (old is None or user_id not in old.booked_by)
+                ]
+            dates = {record.date for record in (old, new) if record is not None}
+            applied.append((latest[timeslot_id], timeslot_id, dates, new is None))
+            if timeslot_id in remote:
+                transitions.append((old, new, promoted))
+
+        with self._version_lock:
+            for version, timeslot_id, dates, deleted in applied:
+                self._record_change(version, (timeslot_id,), dates, deleted)
+            if applied:
+                self._version = max(self._version, applied[-1][0])
+        return transitions
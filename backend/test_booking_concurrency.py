@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for booking: fires thousands of parallel bookings
+at a single timeslot and checks it is never overbooked.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from testkit import make_store_with_slot, make_timeslot
+from database import pool
+from store import BookingError, TimeslotStore
+
+USERS = 2000
+THREADS = 64
+
+
+def attempt(store, timeslot, user_id):
+    try:
+        store.book(timeslot.id, user_id)
+        return True
+    except BookingError:
+        return False
+
+
+def booked_rows(timeslot_id):
+    with pool.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM bookings WHERE timeslot_id = ?", (timeslot_id,)).fetchone()[0]
+
+
+def test_parallel_bookings_never_overbook():
+    """Distinct users race for the seats of one slot"""
+    capacity = 5
+    store, timeslot = make_store_with_slot(capacity)
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = list(executor.map(lambda i: attempt(store, timeslot, f"user{i}"), range(USERS)))
+
+    print(f"{sum(results)} of {USERS} bookings succeeded for {capacity} seats")
+    assert sum(results) == capacity
+    booked_by = store.get(timeslot.id).booked_by
+    assert len(booked_by) == capacity
+    assert len(set(booked_by)) == capacity
+    assert booked_rows(timeslot.id) == capacity
+
+
+def test_parallel_duplicate_bookings_by_one_user():
+    """The same user hammers one slot; only one booking may land"""
+    store, timeslot = make_store_with_slot(capacity=USERS)
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = list(executor.map(lambda _: attempt(store, timeslot, "user1"), range(USERS)))
+
+    print(f"{sum(results)} of {USERS} duplicate bookings succeeded")
+    assert sum(results) == 1
+    assert store.get(timeslot.id).booked_by == ["user1"]
+    assert booked_rows(timeslot.id) == 1
+
+
+def test_parallel_book_and_unbook():
+    """Users book and release seats concurrently; the count stays within capacity"""
+    capacity = 3
+    store, timeslot = make_store_with_slot(capacity)
+
+    def churn(i):
+        user_id = f"user{i % 50}"
+        if attempt(store, timeslot, user_id):
+            assert len(store.get(timeslot.id).booked_by) <= capacity
+            store.unbook(timeslot.id, user_id)
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        list(executor.map(churn, range(USERS)))
+
+    assert store.get(timeslot.id).booked_by == []
+    assert booked_rows(timeslot.id) == 0
+
+
+def test_parallel_cancel_and_reschedule():
+    """A cancel and a reschedule racing on the same events never undo each other"""
+    store, _ = make_store_with_slot(capacity=1)
+    timeslots = [make_timeslot(capacity=1) for _ in range(200)]
+    store.add_many(timeslots)
+    ids = [ts.id for ts in timeslots]
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        futures = [executor.submit(store.cancel, timeslot_id) for timeslot_id in ids]
+        futures += [executor.submit(store.reschedule, timeslot_id, "2099-02-01", "09:00", "11:00") for timeslot_id in ids]
+        assert all(future.result() is not None for future in futures)
+
+    reloaded = TimeslotStore()
+    reloaded.load()
+    for timeslot_id in ids:
+        ts = store.get(timeslot_id)
+        assert (ts.date, ts.start_time, ts.end_time) == ("2099-02-01", "09:00", "11:00")
+        assert (ts.original_date, ts.original_start_time, ts.original_end_time) == ("2099-01-01", "10:00", "12:00")
+        assert ts.status in ("cancelled", "rescheduled")
+        assert reloaded.get(timeslot_id) == ts
+
+
+if __name__ == "__main__":
+    print("Testing concurrent bookings")
+    test_parallel_bookings_never_overbook()
+    test_parallel_duplicate_bookings_by_one_user()
+    test_parallel_book_and_unbook()
+    test_parallel_cancel_and_reschedule()
+    print("Test completed!")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Differential test for the incrementally maintained notification digests:
+drives random bookings, cancellations, reschedules and deletions through the
+API and compares GET /api/notifications with the original full-scan
+implementation after every step.
+"""
+import random
+
+import testkit  # noqa: F401 (scratch database)
+from fastapi.testclient import TestClient
+from auth import create_access_token
+from models import EventCategory
+import main
+
+USERS = [f"user{i}" for i in range(6)]
+STEPS = 600
+
+
+def reference_notifications(user_id, all_timeslots=None):
+    """get_notifications as it was before digests: a scan over every timeslot"""
+    if all_timeslots is None:
+        all_timeslots = main.timeslots.all()
+    user_bookings = [ts for ts in all_timeslots if user_id in ts.booked_by]
+    cancelled_events = [ts for ts in user_bookings if ts.status and ts.status.lower() == "cancelled"]
+    rescheduled_events = [ts for ts in user_bookings if ts.status and ts.status.lower() == "rescheduled"]
+    future_rescheduled = rescheduled_events
+
+    cancelled_count = len(cancelled_events)
+    rescheduled_count = len(future_rescheduled)
+
+    notifications = []
+    if cancelled_count > 0:
+        cancelled_details = []
+        for ts in cancelled_events[:3]:
+            category_name = ts.category.value if isinstance(ts.category, EventCategory) else str(ts.category)
+            event_name = getattr(ts, 'name', 'Event')
+            cancelled_details.append(f"'{event_name}' ({category_name}) on {ts.date}")
+        detail_text = f": {', '.join(cancelled_details)}" if cancelled_details else ""
+        if cancelled_count > 3:
+            detail_text += f" and {cancelled_count - 3} more"
+        notifications.append({
+            "type": "cancelled",
+            "count": cancelled_count,
+            "message": f"You have {cancelled_count} cancelled event(s){detail_text}"
+        })
+
+    if rescheduled_count > 0:
+        rescheduled_details = []
+        for ts in future_rescheduled[:3]:
+            category_name = ts.category.value if isinstance(ts.category, EventCategory) else str(ts.category)
+            event_name = getattr(ts, 'name', 'Event')
+            original_info = ""
+            if ts.original_date:
+                original_info = f" (was {ts.original_date})"
+            rescheduled_details.append(f"'{event_name}' ({category_name}) on {ts.date}{original_info}")
+        detail_text = f": {', '.join(rescheduled_details)}" if rescheduled_details else ""
+        if rescheduled_count > 3:
+            detail_text += f" and {rescheduled_count - 3} more"
+        notifications.append({
+            "type": "rescheduled",
+            "count": rescheduled_count,
+            "message": f"You have {rescheduled_count} rescheduled event(s){detail_text}"
+        })
+
+    return {
+        "notifications": notifications,
+        "total": cancelled_count + rescheduled_count
+    }
+
+
+def bearer(username, is_admin=False):
+    token = create_access_token({"sub": username, "is_admin": is_admin})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def random_date(rng):
+    return f"20{rng.randint(90, 99)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def test_notifications_match_full_scan():
+    rng = random.Random(1234)
+    admin = bearer("admin1", is_admin=True)
+    users = {user_id: bearer(user_id) for user_id in USERS}
+
+    with TestClient(main.app) as client:
+        ids = []
+        for step in range(STEPS):
+            action = rng.choice(["create", "create", "book", "book", "book", "unbook",
+                                 "cancel", "reschedule", "reschedule", "delete", "samples"])
+            if action == "create" or not ids:
+                response = client.post("/api/timeslots", headers=admin, json={
+                    "name": f"Event {step}",
+                    "category": rng.choice(list(EventCategory)).value,
+                    "date": random_date(rng),
+                    "start_time": "10:00",
+                    "end_time": "12:00",
+                })
+                ids.append(response.json()["id"])
+            elif action == "samples":
+                client.post("/api/admin/create-sample-events", headers=admin)
+                ids = [ts.id for ts in main.timeslots.all()]
+            elif action == "book":
+                client.post(f"/api/timeslots/{rng.choice(ids)}/book", headers=users[rng.choice(USERS)])
+            elif action == "unbook":
+                client.delete(f"/api/timeslots/{rng.choice(ids)}/book", headers=users[rng.choice(USERS)])
+            elif action == "cancel":
+                client.post(f"/api/timeslots/{rng.choice(ids)}/cancel", headers=admin)
+            elif action == "reschedule":
+                client.post(f"/api/timeslots/{rng.choice(ids)}/reschedule", headers=admin, json={
+                    "date": random_date(rng), "start_time": "09:00", "end_time": "11:00"
+                })
+            elif action == "delete":
+                timeslot_id = rng.choice(ids)
+                client.delete(f"/api/timeslots/{timeslot_id}", headers=admin)
+                ids.remove(timeslot_id)
+
+            all_timeslots = main.timeslots.all()
+            for user_id, headers in users.items():
+                actual = client.get("/api/notifications", headers=headers).json()
+                assert actual == reference_notifications(user_id, all_timeslots), (step, action, user_id)
+
+        # Digests rebuilt from the database must agree as well
+        main.timeslots.load()
+        for user_id, headers in users.items():
+            assert client.get("/api/notifications", headers=headers).json() == reference_notifications(user_id)
+
+        totals = {user_id: reference_notifications(user_id)["total"] for user_id in USERS}
+        print(f"{STEPS} steps, {len(main.timeslots)} timeslots, notification totals: {totals}")
+
+
+if __name__ == "__main__":
+    print("Testing notification digests against a full scan")
+    test_notifications_match_full_scan()
+    print("Test completed!")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared-state mode (shared.py): two timeslot stores standing in
+for two workers take random writes and must agree, after polling their change
+feeds, with each other and with a fresh load of the database; and worker
+processes racing to book one timeslot must never overbook it.
+"""
+import multiprocessing
+import os
+import random
+
+from testkit import make_timeslot  # scratch database, also found by the worker processes
+import store
+from database import init_db
+from shared import ChangeFeed
+from store import TimeslotStore
+
+STEPS = 300
+WORKERS = 4
+CAPACITY = 25
+
+
+def worker_store():
+    """A store in shared mode with its own change feed, like one uvicorn worker"""
+    feed = ChangeFeed(interval=3600)  # polled by hand (and by the store's writes)
+    timeslot_store = TimeslotStore(feed)
+    feed.subscribe("timeslot", timeslot_store.apply_changes)
+    timeslot_store.load()
+    feed.start(timeslot_store.version)
+    return timeslot_store, feed
+
+
+def state(timeslot_store):
+    timeslots = timeslot_store.all()
+    return (
+        sorted((ts.model_dump() for ts in timeslots), key=lambda ts: ts["id"]),
+        [timeslot_store.day_counts(day, day) for day in sorted({ts.date for ts in timeslots})],
+        [ts.id for ts in timeslot_store.bookings_for("user0")],
+        [(ts.id, position) for ts, position in timeslot_store.waitlist_for("user0")],
+        timeslot_store.stats()["waitlisted"],
+    )
+
+
+def test_workers_converge():
+    init_db()
+    rng = random.Random(5)
+    workers = [worker_store(), worker_store()]
+    user_ids = [f"user{i}" for i in range(4)]
+    for step in range(STEPS):
+        before = workers[0][0].version
+        timeslot_store, _ = rng.choice(workers)
+        ids = [ts.id for ts in timeslot_store.all()]
+        action = rng.choice([
+            "create", "bulk", "cancel", "reschedule", "book", "unbook", "join_waitlist", "leave_waitlist", "delete"
+        ])
+        if action == "create" or not ids:
+            timeslot_store.add(make_timeslot(rng, capacity=3))
+        elif action == "bulk":
+            timeslot_store.add_many(make_timeslot(rng, capacity=3) for _ in range(rng.randint(1, 10)))
+        elif action == "cancel":
+            timeslot_store.cancel_many(rng.sample(ids, min(len(ids), 3)))
+        elif action == "reschedule":
+            timeslot_store.reschedule(rng.choice(ids), f"2999-01-{rng.randint(1, 28):02d}", "09:00", "23:00")
+        elif action in ("book", "unbook", "join_waitlist", "leave_waitlist"):
+            try:
+                getattr(timeslot_store, action)(rng.choice(ids), rng.choice(user_ids))
+            except store.BookingError:
+                pass
+        elif action == "delete":
+            timeslot_store.delete(rng.choice(ids))
+
+        for _, feed in workers:
+            feed.poll()
+        (first, _), (second, _) = workers
+        assert first.version == second.version, step
+        assert state(first) == state(second), (step, action)
+        if step % 50 == 0:
+            # Versions are shared: a delta taken on one worker applies to the other
+            deltas = [timeslot_store.changes_since(before) for timeslot_store, _ in workers]
+            assert [([record.to_dict() for record in upserts], deleted) for _, upserts, deleted in deltas] == [
+                ([record.to_dict() for record in deltas[0][1]], deltas[0][2])
+            ] * 2
+
+    reloaded = TimeslotStore()
+    reloaded.load()
+    assert state(reloaded) == state(workers[0][0])
+    for _, feed in workers:
+        feed.stop()
+    print(f"{STEPS} writes, {len(reloaded)} timeslots, version {workers[0][0].version}")
+
+
+def book_seats(timeslot_id, worker, results):
+    os.environ["SHARED_STATE"] = "1"
+    timeslot_store, feed = worker_store()
+    booked = 0
+    for i in range(CAPACITY):
+        try:
+            timeslot_store.book(timeslot_id, f"worker{worker}-user{i}")
+            booked += 1
+        except store.TimeslotFull:
+            feed.poll()
+    feed.stop()
+    results.put(booked)
+
+
+def test_booking_across_processes():
+    init_db()
+    timeslot_store, feed = worker_store()
+    ts = make_timeslot(random.Random(1), capacity=CAPACITY)
+    timeslot_store.add(ts)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=book_seats, args=(ts.id, worker, results)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    booked = sum(results.get(timeout=300) for _ in processes)
+    for process in processes:
+        process.join()
+
+    feed.poll()
+    assert booked == CAPACITY, booked
+    assert len(timeslot_store.get(ts.id).booked_by) == CAPACITY
+    feed.stop()
+    print(f"{WORKERS} processes booked {booked} of {CAPACITY} seats")
+
+
+if __name__ == "__main__":
+    print("Testing shared state between workers")
+    test_workers_converge()
+    test_booking_across_processes()
+    print("Test completed!")
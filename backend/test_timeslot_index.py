@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Tests for the tombstoned date index of the timeslot store: random creates,
+reschedules, cancellations and deletes are checked against a sort of every
+cached timeslot, with thresholds small enough that compaction runs often,
+and readers query while writers churn the index. A replica kept up to date
+through changes_since must always match the store, and so must the per-day
+counters and name searches.
+"""
+import functools
+import random
+import threading
+
+from testkit import make_timeslot, patched, random_date
+import search
+import store
+from database import init_db
+from models import EventCategory
+from search import name_tokens, query_terms
+from records import sort_key
+from store import TimeslotStore
+
+STEPS = 1000
+
+QUERIES = ["jazz", "night", "jazz night", "jazz market", "ja", "ni", "nigh", "j n", "night jazz", "niche", "test", "x", "", "JAZZ!"]
+
+
+def small_thresholds(test):
+    """Run `test` with tuning constants shrunk, and restore them afterwards"""
+    @functools.wraps(test)
+    def run():
+        with patched(
+            store,
+            # Compact after a handful of changes so the test exercises it constantly
+            RECENT_KEYS_MIN=4,
+            TOMBSTONES_MIN=4,
+            # Small enough that slow replicas fall back to snapshots
+            CHANGE_LOG_SIZE=50,
+        ), patched(
+            search,
+            RECENT_KEYS_MIN=2,
+            TOMBSTONES_MIN=2,
+            # Frequent tokens count names, and "night" has too many to
+            NAME_COUNTS_MIN=2,
+            NAME_COUNTS_MAX=2,
+        ):
+            test()
+    return run
+
+
+def reference_query(all_timeslots, start_date, end_date, categories, after=None, limit=None):
+    """query() as a filter and sort over every cached timeslot"""
+    matches = sorted(
+        (ts for ts in all_timeslots
+         if start_date <= ts.date <= end_date and ts.category in categories
+         and (after is None or sort_key(ts) > after)),
+        key=sort_key
+    )
+    return matches if limit is None else matches[:limit]
+
+
+def new_store():
+    init_db()
+    timeslot_store = TimeslotStore()
+    timeslot_store.load()
+    timeslot_store.delete_many([ts.id for ts in timeslot_store.all()])
+    return timeslot_store
+
+
+@small_thresholds
+def test_query_matches_full_scan():
+    rng = random.Random(4321)
+    timeslot_store = new_store()
+    ids = []
+    for step in range(STEPS):
+        action = rng.choice(["create", "create", "bulk", "reschedule", "cancel", "delete", "delete"])
+        if action == "create" or not ids:
+            ts = make_timeslot(rng)
+            timeslot_store.add(ts)
+            ids.append(ts.id)
+        elif action == "bulk":
+            batch = [make_timeslot(rng) for _ in range(rng.randint(1, 20))]
+            timeslot_store.add_many(batch)
+            ids.extend(ts.id for ts in batch)
+        elif action == "reschedule":
+            ts = timeslot_store.get(rng.choice(ids))
+            ts.date = random_date(rng)
+            ts.status = "rescheduled"
+            timeslot_store.update(ts)
+        elif action == "cancel":
+            ts = timeslot_store.get(rng.choice(ids))
+            ts.status = "cancelled"
+            timeslot_store.update(ts)
+        elif action == "delete":
+            deleted = rng.sample(ids, min(len(ids), rng.randint(1, 3)))
+            timeslot_store.delete_many(deleted)
+            ids = [timeslot_id for timeslot_id in ids if timeslot_id not in deleted]
+
+        start_date, end_date = sorted((random_date(rng), random_date(rng)))
+        categories = set(rng.sample(list(EventCategory), rng.randint(1, len(EventCategory))))
+        all_timeslots = timeslot_store.all()
+        assert sorted(ts.id for ts in all_timeslots) == sorted(ids)
+        expected = reference_query(all_timeslots, start_date, end_date, categories)
+        assert timeslot_store.query(start_date, end_date, categories) == expected, (step, action)
+        if expected:
+            after = sort_key(rng.choice(expected))
+            assert (timeslot_store.query(start_date, end_date, categories, after=after, limit=5)
+                    == reference_query(all_timeslots, start_date, end_date, categories, after=after, limit=5)), step
+
+    # Reloading from the database yields the same answers
+    everything = reference_query(timeslot_store.all(), "", "9999", set(EventCategory))
+    timeslot_store.load()
+    assert timeslot_store.query() == everything
+    print(f"{STEPS} steps, {len(timeslot_store)} timeslots")
+
+
+@small_thresholds
+def test_readers_see_consistent_pages_during_churn():
+    rng = random.Random(99)
+    timeslot_store = new_store()
+    timeslot_store.add_many(make_timeslot(rng) for _ in range(2000))
+    stop = threading.Event()
+    failures = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                page = timeslot_store.query("2090-01-01", "2099-12-31", limit=200)
+                keys = [sort_key(ts) for ts in page]
+                assert keys == sorted(keys) and len(set(keys)) == len(keys)
+            except Exception as e:
+                failures.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    writer_rng = random.Random(7)
+    ids = [ts.id for ts in timeslot_store.all()]
+    for _ in range(1500):
+        i = rng.randrange(len(ids))
+        if writer_rng.random() < 0.5:
+            ts = timeslot_store.get(ids[i])
+            ts.date = random_date(writer_rng)
+            timeslot_store.update(ts)
+        else:
+            timeslot_store.delete(ids[i])
+            ts = make_timeslot(writer_rng)
+            timeslot_store.add(ts)
+            ids[i] = ts.id
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert not failures, failures
+    assert timeslot_store.query() == reference_query(timeslot_store.all(), "", "9999", set(EventCategory))
+
+
+def random_change(rng, timeslot_store, ids, user_ids):
+    """Apply one random create, bulk create, reschedule, cancel, booking, unbooking or delete"""
+    action = rng.choice(["create", "bulk", "reschedule", "cancel", "book", "unbook", "delete"])
+    if action == "create" or not ids:
+        ts = make_timeslot(rng, capacity=rng.randint(1, 3))
+        ts.date = f"2999-01-{rng.randint(1, 3):02d}"  # bookable
+        timeslot_store.add(ts)
+        ids.append(ts.id)
+    elif action == "bulk":
+        batch = [make_timeslot(rng) for _ in range(rng.randint(1, 20))]
+        timeslot_store.add_many(batch)
+        ids.extend(ts.id for ts in batch)
+    elif action == "reschedule":
+        ts = timeslot_store.get(rng.choice(ids))
+        ts.date = random_date(rng)
+        timeslot_store.update(ts)
+    elif action == "cancel":
+        ts = timeslot_store.get(rng.choice(ids))
+        ts.status = "cancelled"
+        timeslot_store.update(ts)
+    elif action in ("book", "unbook"):
+        try:
+            getattr(timeslot_store, action)(rng.choice(ids), rng.choice(user_ids))
+        except store.BookingError:
+            pass
+    elif action == "delete":
+        deleted = rng.choice(ids)
+        timeslot_store.delete(deleted)
+        ids.remove(deleted)
+
+
+def sync(timeslot_store, replica, version):
+    """Bring `replica` (id -> dict) up to date with the store; returns (new version, snapshot?)"""
+    changes = timeslot_store.changes_since(version)
+    if changes is None:
+        version = timeslot_store.version
+        replica.clear()
+        replica.update((record.id, record.to_dict()) for record in timeslot_store.query_records())
+        return version, True
+    version, upserts, deleted = changes
+    for record in upserts:
+        replica[record.id] = record.to_dict()
+    for timeslot_id in deleted:
+        replica.pop(timeslot_id, None)
+    return version, False
+
+
+@small_thresholds
+def test_change_log_replays_to_store_state():
+    rng = random.Random(2024)
+    timeslot_store = new_store()
+    user_ids = [f"user{i}" for i in range(5)]
+    # Replicas syncing every step, every few steps and rarely
+    replicas = {every: ({}, 0) for every in (1, 7, 60)}
+    snapshots = dict.fromkeys(replicas, 0)
+    ids = []
+    for step in range(STEPS):
+        random_change(rng, timeslot_store, ids, user_ids)
+        for every, (replica, version) in replicas.items():
+            if step % every == 0:
+                version, snapshot = sync(timeslot_store, replica, version)
+                snapshots[every] += snapshot
+                expected = {ts.id: ts.model_dump(mode="json") for ts in timeslot_store.all()}
+                assert replica == expected, (step, every)
+                assert timeslot_store.changes_since(version)[1:] == ([], [])
+                replicas[every] = (replica, version)
+
+    # Only the first sync of a replica that keeps up needs a snapshot
+    assert snapshots[1] == 1, snapshots
+    print(f"snapshots per replica: {snapshots}")
+
+
+def reference_day_counts(all_timeslots, day, categories):
+    """day_counts() of a single day as a filter over every cached timeslot"""
+    on_day = [ts for ts in all_timeslots if ts.date == day and ts.category in categories]
+    counts = {}
+    for ts in on_day:
+        counts[ts.category] = counts.get(ts.category, 0) + 1
+    available = sum(1 for ts in on_day if ts.status != "cancelled" and len(ts.booked_by) < ts.capacity)
+    return (day, counts, available)
+
+
+@small_thresholds
+def test_day_counts_match_full_scan():
+    rng = random.Random(31)
+    timeslot_store = new_store()
+    user_ids = [f"user{i}" for i in range(5)]
+    ids = []
+    for step in range(STEPS):
+        random_change(rng, timeslot_store, ids, user_ids)
+        all_timeslots = timeslot_store.all()
+        days = sorted({ts.date for ts in all_timeslots})
+        day = rng.choice(days) if days and rng.random() < 0.8 else random_date(rng)
+        categories = set(rng.sample(list(EventCategory), rng.randint(1, len(EventCategory))))
+        assert timeslot_store.day_counts(day, day, categories) == [reference_day_counts(all_timeslots, day, categories)], step
+
+    timeslot_store.load()
+    assert timeslot_store.day_counts("2999-01-01", "2999-01-03") == [
+        reference_day_counts(timeslot_store.all(), day, set(EventCategory))
+        for day in ("2999-01-01", "2999-01-02", "2999-01-03")
+    ]
+
+
+def reference_search(all_timeslots, query, start_date, end_date, categories, limit):
+    """search() as a filter and sort over every cached timeslot: whole-word matches, then prefix matches"""
+    terms = query_terms(query)
+    tiers = ([], [])
+    for ts in all_timeslots:
+        if not (start_date <= ts.date <= end_date and ts.category in categories) or not terms:
+            continue
+        tokens = name_tokens(ts.name)
+        if all(term in tokens for term in terms):
+            tiers[0].append(ts)
+        elif all(any(token.startswith(term) for token in tokens) for term in terms):
+            tiers[1].append(ts)
+    return [(tier, ts.id) for tier, matches in enumerate(tiers) for ts in sorted(matches, key=sort_key)][:limit]
+
+
+@small_thresholds
+def test_search_matches_full_scan():
+    rng = random.Random(77)
+    timeslot_store = new_store()
+    user_ids = [f"user{i}" for i in range(5)]
+    ids = []
+
+    def check(step):
+        all_timeslots = timeslot_store.all()
+        query = rng.choice(QUERIES)
+        start_date, end_date = sorted([random_date(rng), random_date(rng)]) if rng.random() < 0.5 else ("0001-01-01", "9999-12-31")
+        categories = set(rng.sample(list(EventCategory), rng.randint(1, len(EventCategory))))
+        limit = rng.choice([1, 5, 1000])
+        hits = timeslot_store.search(query, start_date, end_date, categories, limit)
+        expected = reference_search(all_timeslots, query, start_date, end_date, categories, limit)
+        assert [(tier, record.id) for tier, record in hits] == expected, (step, query)
+
+    for step in range(STEPS):
+        random_change(rng, timeslot_store, ids, user_ids)
+        check(step)
+    timeslot_store.load()
+    for step in range(50):
+        check(STEPS + step)
+
+
+@small_thresholds
+def test_malformed_update_writes_nothing():
+    """A bad date anywhere in a batch leaves the database and the cache as they were"""
+    timeslot_store = new_store()
+    rng = random.Random(11)
+    batch = [make_timeslot(rng) for _ in range(3)]
+    timeslot_store.add_many(batch)
+    edited = [timeslot_store.get(ts.id) for ts in batch]
+    edited[0].status = "cancelled"
+    edited[2].date = "2027-1-6"
+    try:
+        timeslot_store.update_many(edited)
+        assert False, "malformed date accepted"
+    except ValueError:
+        pass
+    reloaded = TimeslotStore()
+    reloaded.load()
+    for ts in batch:
+        assert timeslot_store.get(ts.id) == ts
+        assert reloaded.get(ts.id) == ts
+
+
+if __name__ == "__main__":
+    print("Testing the timeslot date index")
+    test_query_matches_full_scan()
+    test_readers_see_consistent_pages_during_churn()
+    test_change_log_replays_to_store_state()
+    test_day_counts_match_full_scan()
+    test_search_matches_full_scan()
+    test_malformed_update_writes_nothing()
+    print("Test completed!")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Waitlist tests: positions against a plain list, first-come first-served
+promotion on unbooking (also after a reload from the database), and parallel
+joins and unbookings that never overbook.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from testkit import make_store_with_slot
+from database import pool
+from store import AlreadyBooked, AlreadyWaiting, BookingError, NotWaiting, TimeslotStore
+from waitlist import Waitlist
+
+THREADS = 32
+
+
+def waiting_rows(timeslot_id):
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT user_id FROM waitlist WHERE timeslot_id = ? ORDER BY id", (timeslot_id,)
+        )]
+
+
+def test_positions_match_a_list():
+    """Random joins, leaves and promotions give the same positions as list.index"""
+    rng = random.Random(7)
+    waitlist, model = Waitlist(), []
+    for step in range(20000):
+        user_id = f"user{rng.randrange(200)}"
+        action = rng.random()
+        if action < 0.5 and user_id not in model:
+            assert waitlist.join(user_id) == len(model) + 1
+            model.append(user_id)
+        elif action < 0.8:
+            assert waitlist.leave(user_id) == (user_id in model)
+            if user_id in model:
+                model.remove(user_id)
+        elif model:
+            first = next(iter(waitlist))
+            assert first == model[0]
+            waitlist.leave(first)
+            model.pop(0)
+        if step % 97 == 0:
+            assert list(waitlist) == model
+            assert len(waitlist) == len(model)
+            for position, waiter in enumerate(model, 1):
+                assert waitlist.position(waiter) == position
+        assert waitlist.position("nobody") is None
+    print(f"{len(model)} users left waiting after 20000 operations")
+
+
+def test_unbook_promotes_in_order():
+    """Seats go to waiters in joining order, and the line survives a reload"""
+    store, timeslot = make_store_with_slot()
+    assert store.join_waitlist(timeslot.id, "owner") == 0  # free seat: booked at once
+    assert store.get(timeslot.id).booked_by == ["owner"]
+    for i in range(5):
+        assert store.join_waitlist(timeslot.id, f"user{i}") == i + 1
+    try:
+        store.join_waitlist(timeslot.id, "user3")
+        assert False, "joined twice"
+    except AlreadyWaiting:
+        pass
+    try:
+        store.join_waitlist(timeslot.id, "owner")
+        assert False, "waited for an own seat"
+    except AlreadyBooked:
+        pass
+
+    store.leave_waitlist(timeslot.id, "user1")
+    try:
+        store.leave_waitlist(timeslot.id, "user1")
+        assert False, "left twice"
+    except NotWaiting:
+        pass
+    assert store.waitlist_position(timeslot.id, "user2") == 2
+    assert store.waitlist_length(timeslot.id) == 4
+
+    assert store.unbook(timeslot.id, "owner") == "user0"
+    assert store.get(timeslot.id).booked_by == ["user0"]
+    assert store.waitlist_position(timeslot.id, "user0") is None
+    assert store.waitlist_position(timeslot.id, "user2") == 1
+    assert [ts.id for ts, position in store.waitlist_for("user4")] == [timeslot.id]
+    assert store.waitlist_for("user4")[0][1] == 3
+    assert [ts.id for ts in store.bookings_for("user0")] == [timeslot.id]
+
+    reloaded = TimeslotStore()
+    reloaded.load()
+    assert waiting_rows(timeslot.id) == ["user2", "user3", "user4"]
+    assert reloaded.waitlist_position(timeslot.id, "user4") == 3
+    assert reloaded.unbook(timeslot.id, "user0") == "user2"
+    assert reloaded.get(timeslot.id).booked_by == ["user2"]
+    assert reloaded.waitlist_length(timeslot.id) == 2
+
+
+def test_parallel_joins_and_unbooks_never_overbook():
+    """Users queue and give seats back concurrently; every seat is handed on in order"""
+    capacity = 3
+    users = 400
+    store, timeslot = make_store_with_slot(capacity)
+
+    def join(i):
+        try:
+            return store.join_waitlist(timeslot.id, f"user{i}")
+        except BookingError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        positions = list(executor.map(join, range(users)))
+    assert positions.count(0) == capacity
+    assert sorted(p for p in positions if p) == list(range(1, users - capacity + 1))
+    line = waiting_rows(timeslot.id)
+    assert len(line) == users - capacity
+
+    def release(_):
+        booked_by = store.get(timeslot.id).booked_by
+        assert len(booked_by) <= capacity
+        if not booked_by:
+            return None
+        try:
+            return store.unbook(timeslot.id, random.choice(booked_by))
+        except BookingError:
+            return None  # the seat was released by another thread
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        promoted = [user_id for user_id in executor.map(release, range(users)) if user_id]
+
+    print(f"{len(promoted)} waiters promoted into {capacity} seats")
+    assert sorted(promoted, key=line.index) == line[:len(promoted)]
+    booked_by = store.get(timeslot.id).booked_by
+    assert len(booked_by) <= capacity
+    with pool.connection() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM bookings WHERE timeslot_id = ?", (timeslot.id,)).fetchone()[0]
+    assert rows == len(booked_by)
+    assert waiting_rows(timeslot.id) == line[len(promoted):]
+    assert store.waitlist_length(timeslot.id) == len(line) - len(promoted)
+
+
+if __name__ == "__main__":
+    print("Testing waitlists")
+    test_positions_match_a_list()
+    test_unbook_promotes_in_order()
+    test_parallel_joins_and_unbooks_never_overbook()
+    print("Test completed!")
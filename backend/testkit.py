@@ -0,0 +1,81 @@
+"""
+Scratch database and fixtures shared by the test_*.py scripts.
+
+Test modules import this before any backend module. It points DB_FILE at a
+fresh temporary database, used by every test module of a run and by worker
+processes a test spawns (they inherit EVENT_MANAGER_TEST_DB), so no server
+or real database is needed. Each script runs on its own
+(`python test_waitlist.py`) or under pytest.
+"""
+import os
+import random
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+if "EVENT_MANAGER_TEST_DB" not in os.environ:
+    os.environ["EVENT_MANAGER_TEST_DB"] = os.path.join(tempfile.mkdtemp(prefix="event-manager-test-"), "test.db")
+os.environ["DB_FILE"] = os.environ["EVENT_MANAGER_TEST_DB"]
+
+from database import init_db
+from models import EventCategory, TimeSlot
+from store import TimeslotStore
+
+
+# Names of random timeslots, sharing words and prefixes for the name search
+NAMES = ["Index Test", "Jazz Night", "Improv Night", "Night Market", "Jazz Brunch", "Jazzercise", "Niche Films"]
+
+
+def random_date(rng: random.Random) -> str:
+    """A random future date in the 2090s"""
+    return f"20{rng.randint(90, 99)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def make_timeslot(rng: Optional[random.Random] = None, capacity: int = 1) -> TimeSlot:
+    """A future timeslot with the given capacity
+
+    Without `rng` it is always a two-hour "Test Event" on 2099-01-01; with one,
+    the name, category, date and start time are drawn from it.
+    """
+    if rng is None:
+        return TimeSlot(
+            id=str(uuid.uuid4()),
+            name="Test Event",
+            category=EventCategory.CAT1,
+            date="2099-01-01",
+            start_time="10:00",
+            end_time="12:00",
+            capacity=capacity,
+        )
+    return TimeSlot(
+        id=str(uuid.uuid4()),
+        name=rng.choice(NAMES),
+        category=rng.choice(list(EventCategory)),
+        date=random_date(rng),
+        start_time=f"{rng.randint(8, 20):02d}:00",
+        end_time="22:00",
+        capacity=capacity,
+    )
+
+
+def make_store_with_slot(capacity: int = 1):
+    """A store holding one future timeslot with the given capacity"""
+    init_db()
+    store = TimeslotStore()
+    timeslot = make_timeslot(capacity=capacity)
+    store.add(timeslot)
+    return store, timeslot
+
+
+@contextmanager
+def patched(module, **values):
+    """Set module attributes (tuning constants) for the duration of a with block"""
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
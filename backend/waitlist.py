@@ -0,0 +1,101 @@
+"""
+Per-timeslot waitlists.
+
+A Waitlist holds the users waiting for a seat in one full timeslot, first
+come, first served. Every waiter gets the next slot of an append-only list,
+and a Fenwick tree over the slots (1 while the slot's user waits, 0 once they
+leave) counts the waiters up to any slot. A waiter's position is that count
+at their own slot, so joining, leaving, promoting the head and looking up a
+position each take O(log n) for n slots; length and membership are O(1).
+Plain O(1) positions would need every leave to renumber the users behind it.
+Slots are renumbered once left slots outnumber the waiters, O(waiters)
+amortized over the leaves that made them.
+
+The store serializes changes to a timeslot's waitlist with its booking lock.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class Waitlist:
+    """Users waiting for a seat in one timeslot, in joining order"""
+
+    __slots__ = ("_slots", "_tree", "_tickets", "_head")
+
+    def __init__(self, user_ids: Iterable[str] = ()):
+        # User id per slot, None once they left; slots before _head are all None
+        self._slots: List[Optional[str]] = list(user_ids)
+        # Slot of every waiting user
+        self._tickets: Dict[str, int] = {user_id: slot for slot, user_id in enumerate(self._slots)}
+        self._head = 0
+        self._tree: List[int] = []
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._tickets
+
+    def __iter__(self) -> Iterator[str]:
+        """Waiting users, first in line first"""
+        return (user_id for user_id in self._slots[self._head:] if user_id is not None)
+
+    def join(self, user_id: str) -> int:
+        """Add a user at the end of the line and return their position (1-based)
+
+        The user must not be waiting already.
+        """
+        slot = len(self._slots)
+        self._slots.append(user_id)
+        self._tickets[user_id] = slot
+        # Fenwick append: node i covers slots (i - lowbit(i), i], 1-based
+        index = slot + 1
+        self._tree.append(1 + self._count(slot) - self._count(index - (index & -index)))
+        return len(self._tickets)
+
+    def leave(self, user_id: str) -> bool:
+        """Take a user out of the line; False if they were not waiting"""
+        slot = self._tickets.pop(user_id, None)
+        if slot is None:
+            return False
+        self._slots[slot] = None
+        index = slot + 1
+        while index <= len(self._tree):
+            self._tree[index - 1] -= 1
+            index += index & -index
+        slots = self._slots
+        while self._head < len(slots) and slots[self._head] is None:
+            self._head += 1
+        if len(slots) - len(self._tickets) > max(len(self._tickets), 16):
+            self._renumber()
+        return True
+
+    def position(self, user_id: str) -> Optional[int]:
+        """A waiting user's place in line (1 is next), None if they are not waiting"""
+        slot = self._tickets.get(user_id)
+        return None if slot is None else self._count(slot + 1)
+
+    def _count(self, slots: int) -> int:
+        # Waiting users in the first `slots` slots
+        total = 0
+        tree = self._tree
+        while slots > 0:
+            total += tree[slots - 1]
+            slots &= slots - 1
+        return total
+
+    def _build(self):
+        # O(slots) Fenwick construction: each node passes its sum on to its parent
+        tree = [0 if user_id is None else 1 for user_id in self._slots]
+        for index in range(1, len(tree) + 1):
+            parent = index + (index & -index)
+            if parent <= len(tree):
+                tree[parent - 1] += tree[index - 1]
+        self._tree = tree
+
+    def _renumber(self):
+        # Drop the left slots: O(waiters), amortized over the leaves that made them
+        self._slots = list(self)
+        self._tickets = {user_id: slot for slot, user_id in enumerate(self._slots)}
+        self._head = 0
+        self._build()
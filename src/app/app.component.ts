@@ -2,7 +2,7 @@ import { Component, OnInit, OnDestroy } from '@angular/core';
 import { Router } from '@angular/router';
 import { AuthService } from './auth.service';
 import { DataServiceService } from './data-service.service';
-import { interval, Subscription } from 'rxjs';
+import { Subscription } from 'rxjs';
 
 interface Notification {
   type: string;
@@ -33,12 +33,7 @@ export class AppComponent implements OnInit, OnDestroy {
     if (this.authService.isAuthenticated()) {
       this.authService.verifyToken();
       this.loadNotifications();
-      // Refresh notifications
-      this.notificationSubscription = interval(30000).subscribe(() => {
-        if (this.authService.isAuthenticated()) {
-          this.loadNotifications();
-        }
-      });
+      this.subscribeToNotifications();
     }
 
     // Listen for notification update events
@@ -58,6 +53,19 @@ export class AppComponent implements OnInit, OnDestroy {
     }
   }
 
+  // Receive notification updates pushed by the server instead of polling
+  subscribeToNotifications(): void {
+    this.notificationSubscription = this.dataService.streamNotifications().subscribe({
+      next: (response) => {
+        this.notifications = response.notifications || [];
+        this.notificationCount = response.total || 0;
+      },
+      error: (err) => {
+        console.error('Notification stream closed:', err);
+      }
+    });
+  }
+
   loadNotifications(): void {
     if (!this.authService.isAuthenticated()) {
       console.log('Not authenticated, skipping notifications');
@@ -103,6 +111,7 @@ export class AppComponent implements OnInit, OnDestroy {
   }
 
   logout(): void {
+    this.notificationSubscription?.unsubscribe();
     this.authService.logout();
     this.router.navigate(['/login']);
   }
@@ -29,6 +29,30 @@ export interface TimeSlot {
   original_end_time?: string;  // Original end time if rescheduled
 }
 
+export interface TimeSlotChanges {
+  version: number;  // Pass as `since` on the next call
+  snapshot: boolean;  // true: upserts replace the local copy
+  upserts: TimeSlot[];
+  deleted: string[];  // Timeslot IDs
+}
+
+export interface CalendarDay {
+  date: string;
+  total: number;
+  categories: { [category: string]: number };
+  available: boolean;  // Has a bookable event with free seats
+}
+
+export interface CalendarSummary {
+  month: string;  // YYYY-MM
+  days: CalendarDay[];
+}
+
+export interface WaitlistEntry {
+  timeslot: TimeSlot;
+  position: number;  // 1 is next in line
+}
+
 export interface TimeSlotCreate {
   name: string;  // Event name
   category: EventCategory;
@@ -78,6 +102,12 @@ export class DataServiceService {
     });
   }
 
+  getUserBookings(userId: string): Observable<TimeSlot[]> {
+    return this.http.get<TimeSlot[]>(`${this.apiUrl}/users/${userId}/bookings`, {
+      headers: this.getHeaders()
+    });
+  }
+
   getTimeslots(startDate?: string, endDate?: string, category?: EventCategory): Observable<TimeSlot[]> {
     let params = new HttpParams();
     if (startDate) params = params.set('start_date', startDate);
@@ -90,6 +120,35 @@ export class DataServiceService {
     });
   }
 
+  searchTimeslots(query: string, startDate?: string, endDate?: string, category?: EventCategory): Observable<TimeSlot[]> {
+    let params = new HttpParams().set('q', query);
+    if (startDate) params = params.set('start_date', startDate);
+    if (endDate) params = params.set('end_date', endDate);
+    if (category) params = params.set('category', category);
+
+    return this.http.get<TimeSlot[]>(`${this.apiUrl}/timeslots/search`, {
+      params,
+      headers: this.getHeaders()
+    });
+  }
+
+  getTimeslotChanges(since: number): Observable<TimeSlotChanges> {
+    return this.http.get<TimeSlotChanges>(`${this.apiUrl}/timeslots/changes`, {
+      params: new HttpParams().set('since', since),
+      headers: this.getHeaders()
+    });
+  }
+
+  getCalendarSummary(month: string, category?: EventCategory): Observable<CalendarSummary> {
+    let params = new HttpParams().set('month', month);
+    if (category) params = params.set('category', category);
+
+    return this.http.get<CalendarSummary>(`${this.apiUrl}/calendar/summary`, {
+      params,
+      headers: this.getHeaders()
+    });
+  }
+
   createTimeslot(timeslot: TimeSlotCreate): Observable<TimeSlot> {
     return this.http.post<TimeSlot>(`${this.apiUrl}/timeslots`, timeslot, {
       headers: this.getHeaders()
@@ -114,6 +173,26 @@ export class DataServiceService {
     });
   }
 
+  // Booked straight away ({status: 'booked', timeslot}) if a seat is free,
+  // otherwise queued ({status: 'waiting', position, waiting})
+  joinWaitlist(timeslotId: string): Observable<any> {
+    return this.http.post(`${this.apiUrl}/timeslots/${timeslotId}/waitlist`, {}, {
+      headers: this.getHeaders()
+    });
+  }
+
+  leaveWaitlist(timeslotId: string): Observable<any> {
+    return this.http.delete(`${this.apiUrl}/timeslots/${timeslotId}/waitlist`, {
+      headers: this.getHeaders()
+    });
+  }
+
+  getUserWaitlist(userId: string): Observable<WaitlistEntry[]> {
+    return this.http.get<WaitlistEntry[]>(`${this.apiUrl}/users/${userId}/waitlist`, {
+      headers: this.getHeaders()
+    });
+  }
+
   getAllTimeslots(): Observable<TimeSlot[]> {
     return this.http.get<TimeSlot[]>(`${this.apiUrl}/admin/timeslots`, {
       headers: this.getHeaders()
@@ -149,6 +228,25 @@ export class DataServiceService {
     });
   }
 
+  // Pushes the notifications response on connect and whenever it changes.
+  // EventSource cannot send headers, so the token goes in the query string.
+  streamNotifications(): Observable<any> {
+    return new Observable(observer => {
+      const token = this.authService.getToken() || '';
+      const source = new EventSource(`${this.apiUrl}/notifications/stream?token=${encodeURIComponent(token)}`);
+      source.addEventListener('notifications', (event: MessageEvent) => {
+        observer.next(JSON.parse(event.data));
+      });
+      source.onerror = (err) => {
+        // EventSource reconnects by itself unless the server refused the stream
+        if (source.readyState === EventSource.CLOSED) {
+          observer.error(err);
+        }
+      };
+      return () => source.close();
+    });
+  }
+
   //Create sample events
   createSampleEvents(): Observable<any> {
     return this.http.post(`${this.apiUrl}/admin/create-sample-events`, {}, {